@@ -20,11 +20,24 @@ import os
 import sys
 import threading
 
+import aidentified_matching_api.arrow_csv as arrow_csv
 import aidentified_matching_api.constants as constants
+import aidentified_matching_api.daemon as daemon
 import aidentified_matching_api.daily_files as daily_files
 import aidentified_matching_api.dataset as dataset
 import aidentified_matching_api.dataset_file as dataset_file
+import aidentified_matching_api.inputs as inputs
+import aidentified_matching_api.inventory as inventory
+import aidentified_matching_api.metrics as metrics
+import aidentified_matching_api.pipeline as pipeline
+import aidentified_matching_api.profiling as profiling
+import aidentified_matching_api.progress as progress
 import aidentified_matching_api.token_service as token_service
+import aidentified_matching_api.tracing as tracing
+from aidentified_matching_api.client import AsyncMatchingClient
+from aidentified_matching_api.client import MatchingClient
+
+__all__ = ["AsyncMatchingClient", "MatchingClient", "main"]
 
 
 parser = argparse.ArgumentParser(
@@ -41,6 +54,34 @@ parser.add_argument(
     default=os.environ.get("AID_PASSWORD"),
 )
 parser.add_argument("--verbose", help="Write log output to stderr", action="store_true")
+parser.add_argument(
+    "--no-daemon",
+    help="Run the command in this process even if a daemon is running",
+    action="store_true",
+)
+parser.add_argument(
+    "--progress",
+    help="Report progress, throughput and ETA of validation, uploads and downloads on stderr, as JSON lines when stderr isn't a terminal. Runs the command in this process.",
+    action="store_true",
+)
+parser.add_argument(
+    "--metrics-file",
+    help="Write timings, bytes and counts of every phase of the command to this file as JSON. Runs the command in this process.",
+)
+parser.add_argument(
+    "--trace-file",
+    help="Write a timeline of every upload task and thread to this file as Chrome trace events, for chrome://tracing or ui.perfetto.dev. Runs the command in this process.",
+)
+parser.add_argument(
+    "--profile-cpu",
+    help="Profile the command with cProfile, including its upload threads. Writes pstats data to this file and a summary to this file with .txt appended. Runs the command in this process.",
+    metavar="PATH",
+)
+parser.add_argument(
+    "--profile-memory",
+    help="Trace the command's allocations with tracemalloc and write the peak and top allocations to this file. Runs the command in this process.",
+    metavar="PATH",
+)
 
 
 subparser = parser.add_subparsers()
@@ -55,6 +96,24 @@ token_parser.add_argument(
 )
 token_parser.set_defaults(func=token_service.get_token)
 
+#
+# daemon
+#
+
+daemon_parser = subparser.add_parser(
+    "daemon", help="Manage the background daemon that keeps sessions warm"
+)
+daemon_subparser = daemon_parser.add_subparsers()
+
+daemon_run = daemon_subparser.add_parser("run", help="Run the daemon in the foreground")
+daemon_run.set_defaults(func=daemon.run_daemon, daemon_command=True)
+
+daemon_status = daemon_subparser.add_parser("status", help="Print daemon status")
+daemon_status.set_defaults(func=daemon.daemon_status, daemon_command=True)
+
+daemon_stop = daemon_subparser.add_parser("stop", help="Stop a running daemon")
+daemon_stop.set_defaults(func=daemon.stop_daemon, daemon_command=True)
+
 #
 # dataset
 #
@@ -91,6 +150,7 @@ dataset_files_subparser = dataset_files_parser.add_subparsers()
 
 
 def _get_dataset_file_parent(
+    dataset_name=True,
     dataset_file_name=False,
     dataset_file_upload=False,
     dataset_file_download=False,
@@ -102,9 +162,10 @@ def _get_dataset_file_parent(
         title="required arguments"
     )
 
-    _dataset_parent_group.add_argument(
-        "--dataset-name", help="Name of parent dataset", required=True
-    )
+    if dataset_name:
+        _dataset_parent_group.add_argument(
+            "--dataset-name", help="Name of parent dataset", required=True
+        )
 
     if dataset_file_name:
         _dataset_parent_group.add_argument(
@@ -114,7 +175,7 @@ def _get_dataset_file_parent(
     if dataset_file_upload:
         _dataset_parent_group.add_argument(
             "--dataset-file-path",
-            help="Path to local file for upload",
+            help="Path to local file for upload, or - for standard input",
             required=True,
             type=argparse.FileType(mode="rb"),
         )
@@ -146,6 +207,58 @@ def _get_dataset_file_parent(
             dest="validate",
         )
 
+        _dataset_csv_group.add_argument(
+            "--validate-workers",
+            help="Validate the CSV in this many parallel processes (default 1). Only used for local files in an encoding such as UTF-8 where newlines are single bytes.",
+            type=int,
+            default=1,
+        )
+
+        _dataset_csv_group.add_argument(
+            "--revalidate",
+            help="Validate the file even if it passed validation before and hasn't changed since",
+            action="store_true",
+        )
+
+        _dataset_csv_group.add_argument(
+            "--validate-values",
+            help="Also check that email, phone, postal_code and state values are well-formed",
+            action="store_true",
+        )
+
+        _dataset_csv_group.add_argument(
+            "--validation-report",
+            help="Keep validating after the first bad row and write every error to this file, as CSV or as JSON lines if the name ends in .jsonl",
+            default=None,
+        )
+
+        _dataset_csv_group.add_argument(
+            "--validation-report-limit",
+            help="Most errors to write to --validation-report, all errors are still counted (default 100000)",
+            type=int,
+            default=100_000,
+        )
+
+        _dataset_csv_group.add_argument(
+            "--input-format",
+            help="Format of the file. (default 'auto', Parquet or JSON lines from the start of the file, otherwise CSV) Parquet needs the pyarrow package.",
+            choices=inputs.INPUT_FORMATS,
+            default="auto",
+        )
+
+        _dataset_csv_group.add_argument(
+            "--csv-engine",
+            help="CSV parser. (default 'auto', pyarrow when it's installed and the file isn't a pipe, otherwise the csv module) The files, errors and reports are the same either way.",
+            choices=arrow_csv.CSV_ENGINES,
+            default="auto",
+        )
+
+        _dataset_csv_group.add_argument(
+            "--auto-dialect",
+            help="Detect the encoding, delimiter and quote character from the start of the file. Overrides --csv-encoding, --csv-delimiter, --csv-quotechar and --csv-skip-initial-space.",
+            action="store_true",
+        )
+
         _dataset_csv_group.add_argument(
             "--csv-encoding",
             help="Re-encode text CSV file before uploading. (default 'UTF-8') A list of supported encodings is at https://docs.python.org/3/library/codecs.html#standard-encodings",
@@ -189,6 +302,26 @@ def _get_dataset_file_parent(
             action="store_true",
         )
 
+        _dataset_csv_group.add_argument(
+            "--csv-header-map",
+            help="Rename a column as it's validated and uploaded, as SOURCE=DESTINATION. Can be given more than once.",
+            action="append",
+            metavar="SOURCE=DESTINATION",
+        )
+
+        _dataset_csv_group.add_argument(
+            "--csv-drop-column",
+            help="Leave a column out of validation and the upload. Can be given more than once.",
+            action="append",
+            metavar="HEADER",
+        )
+
+        _dataset_csv_group.add_argument(
+            "--csv-drop-unknown",
+            help="Leave out every column that isn't a valid header for the match logic, after --csv-header-map renames.",
+            action="store_true",
+        )
+
     return _dataset_file_parent
 
 
@@ -236,6 +369,132 @@ dataset_file_upload_group.add_argument(
 dataset_file_upload_group.set_defaults(func=dataset_file.upload_dataset_file)
 dataset_file_upload_group.set_defaults(upload_dataset_file_lock=threading.Lock())
 
+dataset_file_upload_shards = dataset_files_subparser.add_parser(
+    "upload-shards",
+    help="Split a CSV over the row limit into new dataset files and upload them",
+    parents=[
+        _get_dataset_file_parent(
+            dataset_file_name=True, dataset_file_upload=True, validation=True
+        )
+    ],
+)
+dataset_file_upload_shards.add_argument(
+    "--shard-rows",
+    help="Most rows in each dataset file (default 500000)",
+    type=int,
+    default=500_000,
+)
+dataset_file_upload_shards.add_argument(
+    "--include-households",
+    help="Add household members of matches to output",
+    action="store_true",
+)
+dataset_file_upload_shards.add_argument(
+    "--match-logic",
+    help="Choose matching technique. See API documentation for details. Default is OPPORTUNISTIC",
+    choices=["OPPORTUNISTIC", "ADDRESS", "EMAIL"],
+    default="OPPORTUNISTIC",
+)
+dataset_file_upload_shards.add_argument(
+    "--upload-part-size",
+    help="Size of upload chunk in megabytes",
+    type=int,
+    default=100,
+)
+dataset_file_upload_shards.add_argument(
+    "--concurrent-uploads",
+    help="Max number of concurrent uploads, across all shards",
+    type=int,
+    default=4,
+)
+dataset_file_upload_shards.add_argument(
+    "--max-upload-rate",
+    help="Limit upload bandwidth across all shards, in megabytes per second",
+    type=float,
+    default=None,
+)
+dataset_file_upload_shards.set_defaults(func=dataset_file.upload_dataset_file_shards)
+
+dataset_file_upload_many = dataset_files_subparser.add_parser(
+    "upload-many",
+    help="Create a dataset file for each of many CSVs and upload them",
+    parents=[_get_dataset_file_parent(validation=True)],
+)
+dataset_file_upload_many.add_argument(
+    "--dataset-file-paths",
+    help="Files, directories of files or glob patterns to upload. Each dataset file is named after its file.",
+    required=True,
+    nargs="+",
+    metavar="PATH",
+)
+dataset_file_upload_many.add_argument(
+    "--include-households",
+    help="Add household members of matches to output",
+    action="store_true",
+)
+dataset_file_upload_many.add_argument(
+    "--match-logic",
+    help="Choose matching technique. See API documentation for details. Default is OPPORTUNISTIC",
+    choices=["OPPORTUNISTIC", "ADDRESS", "EMAIL"],
+    default="OPPORTUNISTIC",
+)
+dataset_file_upload_many.add_argument(
+    "--upload-part-size",
+    help="Size of upload chunk in megabytes",
+    type=int,
+    default=100,
+)
+dataset_file_upload_many.add_argument(
+    "--concurrent-uploads",
+    help="Max number of concurrent uploads, across all files",
+    type=int,
+    default=4,
+)
+dataset_file_upload_many.add_argument(
+    "--concurrent-files",
+    help="Max number of files validating or uploading at once (default 2)",
+    type=int,
+    default=2,
+)
+dataset_file_upload_many.add_argument(
+    "--max-upload-rate",
+    help="Limit upload bandwidth across all files, in megabytes per second",
+    type=float,
+    default=None,
+)
+dataset_file_upload_many.add_argument(
+    "--max-buffered-mb",
+    help="Limit memory held by upload parts across all files, in megabytes. Default is twice the part size times --concurrent-uploads",
+    type=int,
+    default=None,
+)
+dataset_file_upload_many.add_argument(
+    "--max-api-calls",
+    help="Max number of concurrent API calls for upload parts across all files",
+    type=int,
+    default=None,
+)
+dataset_file_upload_many.set_defaults(
+    func=dataset_file.upload_many_dataset_files, in_process=True
+)
+
+dataset_file_validate = dataset_files_subparser.add_parser(
+    "validate",
+    help="Validate a local CSV file without uploading it",
+    parents=[
+        _get_dataset_file_parent(
+            dataset_name=False, dataset_file_upload=True, validation=True
+        )
+    ],
+)
+dataset_file_validate.add_argument(
+    "--match-logic",
+    help="Validate for this matching technique. Default is OPPORTUNISTIC",
+    choices=["OPPORTUNISTIC", "ADDRESS", "EMAIL"],
+    default="OPPORTUNISTIC",
+)
+dataset_file_validate.set_defaults(func=dataset_file.validate_dataset_file)
+
 dataset_file_abort = dataset_files_subparser.add_parser(
     "abort",
     help="Abort dataset file upload",
@@ -252,6 +511,45 @@ dataset_file_download_group = dataset_files_subparser.add_parser(
 )
 dataset_file_download_group.set_defaults(func=dataset_file.download_dataset_file)
 
+dataset_file_wait = dataset_files_subparser.add_parser(
+    "wait",
+    help="Wait for dataset files to finish matching or fail",
+    parents=[_get_dataset_file_parent()],
+)
+dataset_file_wait.add_argument(
+    "--dataset-file-name",
+    help="Name of a dataset file to wait for, repeat for several",
+    required=True,
+    action="append",
+)
+dataset_file_wait.add_argument(
+    "--timeout", help="Give up after this many seconds", type=float, default=None
+)
+dataset_file_wait.add_argument(
+    "--poll-interval",
+    help="Seconds between status checks at first and after any change (default 5)",
+    type=float,
+    default=5.0,
+)
+dataset_file_wait.add_argument(
+    "--max-poll-interval",
+    help="Longest wait between status checks in seconds (default 300)",
+    type=float,
+    default=300.0,
+)
+dataset_file_wait.add_argument(
+    "--upload-grace",
+    help="Seconds a dataset file may stay UPLOAD_NOT_STARTED before the wait gives up on it. By default it's waited for until --timeout, unless its upload was aborted",
+    type=float,
+    default=None,
+)
+dataset_file_wait.add_argument(
+    "--download-dir",
+    help="Download each dataset file into this directory, named after it, as soon as it finishes matching",
+)
+# Waits can take hours, and the daemon runs one command at a time
+dataset_file_wait.set_defaults(func=dataset_file.wait_dataset_files, in_process=True)
+
 
 dataset_file_delete = dataset_files_subparser.add_parser(
     "delete",
@@ -316,15 +614,74 @@ dataset_file_trigger_download.set_defaults(
     func=daily_files.download_dataset_trigger_file
 )
 
+#
+# pipeline
+#
+
+pipeline_parser = subparser.add_parser(
+    "pipeline", help="Run dataset-file steps from a manifest"
+)
+pipeline_subparser = pipeline_parser.add_subparsers()
+
+pipeline_run = pipeline_subparser.add_parser(
+    "run",
+    help="Create, upload, wait for and download the dataset files of a manifest, picking up where the last run stopped",
+)
+pipeline_run.add_argument(
+    "--manifest",
+    help="JSON or YAML (.yaml, .yml) manifest of datasets and their files",
+    required=True,
+)
+pipeline_run.add_argument(
+    "--checkpoint",
+    help="File recording the steps done, default is the manifest path with .checkpoint.json appended",
+)
+pipeline_run.set_defaults(func=pipeline.run_manifest, in_process=True)
+
+#
+# inventory
+#
+
+inventory_parser = subparser.add_parser(
+    "inventory",
+    help="List every dataset and dataset-file as JSON lines, many at once",
+)
+inventory_parser.add_argument(
+    "--dataset-name",
+    help="Only list this dataset, may be given more than once. Default is every dataset",
+    action="append",
+)
+inventory_parser.add_argument(
+    "--include-deltas",
+    help="List the delta files of every dataset-file",
+    action="store_true",
+)
+inventory_parser.add_argument(
+    "--include-triggers",
+    help="List the trigger files of every dataset-file",
+    action="store_true",
+)
+inventory_parser.add_argument(
+    "--concurrent-requests",
+    help="API calls made at once",
+    type=int,
+    default=16,
+)
+inventory_parser.add_argument(
+    "--output", help="Write to this file instead of stdout", metavar="PATH"
+)
+inventory_parser.set_defaults(func=inventory.list_inventory, in_process=True)
+
 
 def main():
-    parsed = parser.parse_args()
+    argv = sys.argv[1:]
+    parsed = parser.parse_args(argv)
 
     if parsed.verbose:
         logging.basicConfig(
-            format="%(asctime)s %(levelname)-8s %(message)s",
+            format=constants.LOG_FORMAT,
             level=logging.INFO,
-            datefmt="%Y-%m-%d %H:%M:%S",
+            datefmt=constants.LOG_DATE_FORMAT,
             stream=sys.stderr,
         )
 
@@ -332,4 +689,25 @@ def main():
         parser.print_help()
         return
 
-    parsed.func(parsed)
+    exit_code = daemon.try_forward(parsed, argv)
+    if exit_code is not None:
+        return exit_code
+
+    if parsed.progress:
+        progress.enable(sys.stderr)
+    if parsed.metrics_file is not None:
+        metrics.enable()
+    if parsed.trace_file is not None:
+        tracing.enable()
+
+    try:
+        with profiling.profile(parsed.profile_cpu, parsed.profile_memory):
+            return parsed.func(parsed)
+    finally:
+        if parsed.metrics_file is not None:
+            metrics.write(parsed.metrics_file)
+            metrics.disable()
+        if parsed.trace_file is not None:
+            tracing.write(parsed.trace_file)
+            tracing.disable()
+        progress.disable()
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import csv
+import logging
+import re
+
+import aidentified_matching_api.progress as progress
+
+# CSV parsing with pyarrow, when it's installed. Arrow parses and checks a
+# block of records at a time in C++, the csv module is the fallback for
+# everything it can't do exactly the same way. Validation through Arrow
+# only ever says a file is fine: anything it doesn't like is validated
+# again by the csv module so the errors are the usual ones.
+
+logger = logging.getLogger("matching_api_cli")
+
+CSV_ENGINES = ["auto", "python", "arrow"]
+ARROW_BLOCK_SIZE = 1024 * 1024
+# Besides \n and \r, str.splitlines breaks the csv module's lines on these.
+# Arrow doesn't, records holding any of them are left to the csv module.
+SPLITLINES_BREAKS = "[\x0b\x0c\x1c-\x1e\x85\u2028\u2029]"
+
+
+class ArrowCsvError(Exception):
+    """Arrow couldn't read a CSV, the csv module might."""
+
+
+def available() -> bool:
+    try:
+        import pyarrow.csv  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def check_engine(csv_engine: str):
+    if csv_engine not in CSV_ENGINES:
+        raise Exception(f"Unknown csv-engine '{csv_engine}'")
+    if csv_engine == "arrow" and not available():
+        raise Exception(
+            "The arrow csv-engine requires the pyarrow package, "
+            "install it with 'pip install aidentified-matching-api[arrow]'"
+        )
+
+
+def can_read(csv_args) -> bool:
+    """Whether csv_args asks for Arrow, or doesn't mind, and Arrow parses
+    its dialect the same way as the csv module."""
+    if csv_args.csv_engine == "python" or csv_args.input_format != "csv":
+        return False
+    if csv_args.csv_engine == "auto" and not available():
+        return False
+
+    # There's no skipinitialspace, and records are only re-read from the
+    # start, which a pipe can't do. The quote check doesn't follow escapes.
+    if (
+        csv_args.skipinitialspace
+        or not csv_args.raw_fd.seekable()
+        or csv_args.escapechar
+    ):
+        logger.info("Arrow can't read this CSV, using the csv module")
+        return False
+
+    return True
+
+
+class _QuoteCheck:
+    """Hands Arrow the file, finding any closing quote that isn't followed
+    by a delimiter or line break. The csv module's strict mode rejects
+    those, Arrow carries on with the rest as part of the value."""
+
+    def __init__(self, csv_args):
+        self.raw_fd = csv_args.raw_fd
+        self.decoder = csv_args.codec_info.incrementaldecoder(errors="replace")
+        self.bad = False
+        # The character before pending, so a quote at its start can be told
+        # apart
+        self.buffer = "\n"
+        if csv_args.quoting == csv.QUOTE_NONE:
+            self.tokens = None
+            return
+
+        delimiter, quote = re.escape(csv_args.delimiter), re.escape(csv_args.quotechar)
+        value = f"[^{quote}]*"
+        if csv_args.doublequotes:
+            value += f"(?:{quote}{quote}[^{quote}]*)*"
+        boundary = f"[{delimiter}\r\n]"
+        not_boundary = f"[^{delimiter}\r\n]"
+        # A quoted value starts at a boundary, a quote anywhere else is part
+        # of an unquoted one
+        self.tokens = re.compile(
+            f"[^{quote}]*(?:(?:(?<!{not_boundary}){quote}{value}{quote}"
+            f"(?={boundary})|(?<={not_boundary}){quote})[^{quote}]*)*",
+            re.DOTALL,
+        )
+        self.unfinished = re.compile(f"{quote}{value}{quote}?", re.DOTALL)
+
+    def _check(self, text: str):
+        buffer = self.buffer + text
+        end = self.tokens.match(buffer, 1).end()
+        pending = buffer[end:]
+        # Only a quoted value running on into the next read is left over,
+        # and the csv module doesn't read one longer than its field limit
+        if pending and (
+            len(pending) > csv.field_size_limit()
+            or not self.unfinished.fullmatch(pending)
+        ):
+            self.bad = True
+        self.buffer = buffer[end - 1 :]
+
+    def read(self, size=-1) -> bytes:
+        data = self.raw_fd.read(size)
+        if self.tokens is None or self.bad:
+            return data
+
+        if data:
+            self._check(self.decoder.decode(data))
+        else:
+            # Nothing can be left unfinished at the end of the file
+            self._check(self.decoder.decode(b"", final=True) + "\n")
+            self.bad = self.bad or len(self.buffer) > 1
+        return data
+
+    @property
+    def closed(self) -> bool:
+        return self.raw_fd.closed
+
+
+def _open(csv_args, quote_check: _QuoteCheck, column_count: int):
+    import pyarrow
+    import pyarrow.csv
+
+    quoting = csv_args.quoting != csv.QUOTE_NONE
+    csv_args.raw_fd.seek(0)
+    # The header is read as a record, so duplicate or odd header names
+    # don't matter to Arrow. Every column is a string as in the csv module.
+    return pyarrow.csv.open_csv(
+        quote_check,
+        read_options=pyarrow.csv.ReadOptions(
+            encoding=csv_args.codec_info.name,
+            block_size=ARROW_BLOCK_SIZE,
+            autogenerate_column_names=True,
+        ),
+        parse_options=pyarrow.csv.ParseOptions(
+            delimiter=csv_args.delimiter,
+            quote_char=csv_args.quotechar if quoting else False,
+            double_quote=csv_args.doublequotes,
+            escape_char=csv_args.escapechar or False,
+            newlines_in_values=True,
+            ignore_empty_lines=False,
+        ),
+        convert_options=pyarrow.csv.ConvertOptions(
+            column_types={f"f{idx}": pyarrow.string() for idx in range(column_count)},
+            strings_can_be_null=False,
+            quoted_strings_can_be_null=False,
+        ),
+    )
+
+
+def _batches(csv_args, headers):
+    """Record batches after the header row."""
+    import pyarrow
+    import pyarrow.compute
+
+    quote_check = _QuoteCheck(csv_args)
+    try:
+        reader = _open(csv_args, quote_check, len(headers))
+        first = True
+        for batch in reader:
+            # Arrow has read every byte of a batch by the time it's here
+            if quote_check.bad:
+                raise ArrowCsvError("Quote the csv module's strict mode rejects")
+            if first:
+                first = False
+                header_row = [column[0].as_py() for column in batch.columns]
+                if batch.num_rows == 0 or header_row != list(headers):
+                    raise ArrowCsvError("Header row doesn't match the csv module's")
+                batch = batch.slice(1)
+            for column in batch.columns:
+                breaks = pyarrow.compute.match_substring_regex(
+                    column, SPLITLINES_BREAKS
+                )
+                if pyarrow.compute.any(breaks).as_py():
+                    raise ArrowCsvError("Value with a line break only Python has")
+            yield batch
+        if quote_check.bad:
+            raise ArrowCsvError("Quote the csv module's strict mode rejects")
+    except (pyarrow.ArrowInvalid, UnicodeError) as e:
+        raise ArrowCsvError(str(e)) from None
+
+
+def row_batches(csv_args, headers):
+    """Records after the header row as lists of row tuples, a block of the
+    file at a time. Raises ArrowCsvError if Arrow can't read them the same
+    way as the csv module."""
+    empty_row = ("",) * len(headers)
+    for batch in _batches(csv_args, headers):
+        rows = list(zip(*(column.to_pylist() for column in batch.columns)))
+        # Could be a blank line, which is an empty record to the csv module
+        if empty_row in rows:
+            raise ArrowCsvError("Record with no values")
+        yield rows
+
+
+def records_valid(validator, csv_args) -> bool:
+    """Checks the records after the header the same way as
+    validator.validate_records. True if they're all fine, False if any of
+    them (or anything else) needs a look from the csv module."""
+    import pyarrow
+    import pyarrow.compute
+
+    required_idxes = [idx for _, idx in validator.required_header_idxes]
+    # A blank line is an empty record to the csv module and a record of
+    # empty values to Arrow, the required values catch both.
+    if not required_idxes:
+        return False
+
+    # Into the validator's own digest set a batch at a time, so memory
+    # stays flat. Any duplicate is found and reported by the csv module.
+    id_uniqueness = validator.id_uniqueness
+    record_count = 0
+    try:
+        for batch in _batches(csv_args, validator.headers):
+            progress.reached(csv_args.raw_fd.tell())
+            record_count += batch.num_rows
+            if validator.max_rows is not None and record_count > validator.max_rows:
+                return False
+
+            columns = batch.columns
+            for idx in required_idxes:
+                if pyarrow.compute.any(pyarrow.compute.equal(columns[idx], "")).as_py():
+                    return False
+
+            for _, idx, check in validator.value_checks:
+                for value in columns[idx].to_pylist():
+                    if value and not check(value):
+                        return False
+
+            if validator.id_idx is not None:
+                ids = columns[validator.id_idx].to_pylist()
+                if not id_uniqueness.add_all(ids):
+                    return False
+    except ArrowCsvError as e:
+        logger.info(f"Arrow couldn't read the CSV, using the csv module: {e}")
+        return False
+
+    validator.records_read = record_count
+    return True
@@ -0,0 +1,943 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import contextlib
+import copy
+import io
+import logging
+import os
+import time
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import requests
+
+import aidentified_matching_api.metrics as metrics
+import aidentified_matching_api.progress as progress
+import aidentified_matching_api.token_service as token
+import aidentified_matching_api.upload as upload
+import aidentified_matching_api.validation as validation
+
+logger = logging.getLogger("matching_api_cli")
+
+# Name -> ID lookups are repeated by nearly every operation. IDs and
+# match_logic never change for a given object, only a delete and re-create
+# under the same name can make an entry stale, so entries expire and the
+# delete operations forget them explicitly.
+ID_CACHE_TTL = 300
+
+# Statuses a dataset-file stays in until someone acts on it. Only a new
+# upload moves one on from UPLOAD_NOT_STARTED, which is also where a new
+# file waits for its first upload, see FinishedCheck.
+TERMINAL_STATUSES = (
+    "MATCHING_FINISHED",
+    "VALIDATION_ERROR",
+    "MATCHING_ERROR",
+    "UPLOAD_NOT_STARTED",
+)
+# Growth of the wait between status polls while nothing changes
+POLL_BACKOFF = 1.5
+
+
+class FinishedCheck:
+    """Tells when a waited for dataset-file is in one of TERMINAL_STATUSES.
+
+    A file in UPLOAD_NOT_STARTED is taken to be about to upload and isn't
+    finished, unless it went back there from another status (its upload was
+    aborted), was marked uploaded, or has been there upload_grace seconds.
+    """
+
+    def __init__(self, upload_grace: Optional[float] = None):
+        self.upload_grace = upload_grace
+        self.statuses = {}
+        self.uploaded = set()
+        self.not_started_since = {}
+
+    def mark_uploaded(self, name: str):
+        self.uploaded.add(name)
+
+    def finished(self, dataset_file: dict, now: float) -> bool:
+        name = dataset_file["name"]
+        status = dataset_file["status"]
+        previous = self.statuses.get(name)
+        self.statuses[name] = status
+        if status != "UPLOAD_NOT_STARTED":
+            self.not_started_since.pop(name, None)
+            return status in TERMINAL_STATUSES
+
+        since = self.not_started_since.setdefault(name, now)
+        aborted = name in self.uploaded or previous not in (None, status)
+        waited_out = self.upload_grace is not None and now - since >= self.upload_grace
+        return aborted or waited_out
+
+    def grace_left(self, names, now: float) -> Optional[float]:
+        """Seconds until the first of names waiting to upload runs out of
+        grace, None if there's no grace period or none of them are."""
+        not_started = [
+            self.not_started_since[name]
+            for name in names
+            if name in self.not_started_since
+        ]
+        if self.upload_grace is None or not not_started:
+            return None
+        return max(min(not_started) + self.upload_grace - now, 0)
+
+
+class MatchingClient:
+    """Synchronous client for the matching API.
+
+    The client owns its token and pooled HTTP session, so one instance can
+    run any number of operations over shared connections. Every operation
+    returns the API's response data rather than printing it.
+    """
+
+    def __init__(
+        self,
+        email: Optional[str] = None,
+        password: Optional[str] = None,
+        token_service: Optional[token.TokenService] = None,
+    ):
+        self.email = email if email is not None else os.environ.get("AID_EMAIL")
+        self.password = (
+            password if password is not None else os.environ.get("AID_PASSWORD")
+        )
+        self.token_service = token_service or token.TokenService()
+        self._id_cache = {}
+
+    @property
+    def session(self) -> requests.Session:
+        return self.token_service.session
+
+    def api_call(self, method: str, url: str, **kwargs):
+        # The token service only reads the credentials off of the client.
+        return self.token_service.api_call(
+            self, getattr(self.session, method), url, **kwargs
+        )
+
+    def paginated_api_call(self, method: str, url: str, **kwargs):
+        return self.token_service.paginated_api_call(
+            self, getattr(self.session, method), url, **kwargs
+        )
+
+    def next_page_url(self, url: str, paged: dict) -> Optional[str]:
+        return self.token_service.next_page_url(url, paged)
+
+    def next_page_urls(self, url: str, paged: dict) -> Optional[list]:
+        return self.token_service.next_page_urls(url, paged)
+
+    def get_token(self) -> str:
+        return self.token_service.get_token(self)
+
+    #
+    # ID lookups
+    #
+
+    def _cache_get(self, key):
+        try:
+            expires_at, value = self._id_cache[key]
+        except KeyError:
+            return None
+
+        if time.monotonic() > expires_at:
+            del self._id_cache[key]
+            return None
+
+        return value
+
+    def _cache_put(self, key, value):
+        self._id_cache[key] = (time.monotonic() + ID_CACHE_TTL, value)
+
+    def _forget_dataset(self, dataset_name: str):
+        for key in list(self._id_cache):
+            if key[1] == dataset_name:
+                del self._id_cache[key]
+
+    def get_dataset_id(self, dataset_name: str) -> str:
+        cache_key = ("dataset", dataset_name)
+        dataset_id = self._cache_get(cache_key)
+        if dataset_id is not None:
+            return dataset_id
+
+        resp_obj = self.api_call("get", "/v1/dataset/", params={"name": dataset_name})
+
+        if resp_obj["count"] == 0:
+            raise Exception(f"No dataset with name '{dataset_name}' found")
+
+        dataset_id = resp_obj["results"][0]["dataset_id"]
+        self._cache_put(cache_key, dataset_id)
+
+        return dataset_id
+
+    def get_dataset_file(self, dataset_name: str, dataset_file_name: str) -> dict:
+        """Only the immutable fields (IDs, match_logic, include_households)
+        of the returned object are safe to use, it may come from the cache."""
+        cache_key = ("dataset_file", dataset_name, dataset_file_name)
+        dataset_file = self._cache_get(cache_key)
+        if dataset_file is not None:
+            return dataset_file
+
+        dataset_params = {
+            "dataset_name": dataset_name,
+            "name": dataset_file_name,
+        }
+        resp_obj = self.api_call("get", "/v1/dataset-file/", params=dataset_params)
+
+        if resp_obj["count"] == 0:
+            raise Exception(f"No dataset file with name '{dataset_file_name}' found")
+
+        dataset_file = resp_obj["results"][0]
+        self._cache_put(cache_key, dataset_file)
+
+        return dataset_file
+
+    def get_dataset_file_id(self, dataset_name: str, dataset_file_name: str) -> str:
+        return self.get_dataset_file(dataset_name, dataset_file_name)["dataset_file_id"]
+
+    #
+    # dataset
+    #
+
+    def list_datasets(self) -> list:
+        return self.paginated_api_call("get", "/v1/dataset/")
+
+    def create_dataset(self, name: str) -> dict:
+        return self.api_call("post", "/v1/dataset/", json={"name": name})
+
+    def delete_dataset(self, name: str):
+        dataset_id = self.get_dataset_id(name)
+
+        self.api_call("delete", f"/v1/dataset/{dataset_id}/")
+        self._forget_dataset(name)
+
+    #
+    # dataset-file
+    #
+
+    def list_dataset_files(self, dataset_name: str) -> list:
+        return self.paginated_api_call(
+            "get", "/v1/dataset-file/", params={"dataset_name": dataset_name}
+        )
+
+    def create_dataset_file(
+        self,
+        dataset_name: str,
+        dataset_file_name: str,
+        include_households: bool = False,
+        match_logic: str = "OPPORTUNISTIC",
+    ) -> dict:
+        dataset_file_payload = {
+            "dataset_id": self.get_dataset_id(dataset_name),
+            "name": dataset_file_name,
+            "include_households": include_households,
+            "match_logic": match_logic,
+        }
+        return self.api_call("post", "/v1/dataset-file/", json=dataset_file_payload)
+
+    def abort_dataset_file(self, dataset_name: str, dataset_file_name: str) -> dict:
+        dataset_file_id = self.get_dataset_file_id(dataset_name, dataset_file_name)
+        return self.api_call(
+            "post", f"/v1/dataset-file/{dataset_file_id}/abort-upload/"
+        )
+
+    def delete_dataset_file(self, dataset_name: str, dataset_file_name: str):
+        dataset_file_id = self.get_dataset_file_id(dataset_name, dataset_file_name)
+
+        self.api_call("delete", f"/v1/dataset-file/{dataset_file_id}/")
+        self._id_cache.pop(("dataset_file", dataset_name, dataset_file_name), None)
+
+    @staticmethod
+    def _validate_upload(
+        csv_args,
+        validate: bool,
+        match_logic: str,
+        validation_options: Optional[validation.ValidationOptions],
+    ):
+        """Validate the file before it's uploaded. A pipe can only be read
+        once, so it's validated as it's uploaded from the rows returned
+        here instead."""
+        if not validate:
+            return None
+
+        if not csv_args.raw_fd.seekable():
+            logger.info("Input is a pipe, validating while uploading")
+            return validation.validated_rows(csv_args, match_logic, validation_options)
+
+        logger.info("Starting validation")
+        validation.validate_csv(csv_args, match_logic, validation_options)
+        logger.info("Validation complete")
+        return None
+
+    @staticmethod
+    def _upload_csv_args(csv_args, upload_part_size: int, match_logic: str):
+        if upload_part_size < 5:
+            raise Exception("upload_part_size must be greater than 5 Mb")
+
+        if not isinstance(csv_args, validation.CsvArgs):
+            csv_args = validation.make_csv_args(csv_args)
+
+        projection = csv_args.projection
+        if projection is not None and projection.valid_headers is None:
+            # Unknown columns depend on the dataset-file's match logic
+            projection.valid_headers = validation.get_validator_class(
+                match_logic
+            ).valid_headers
+
+        return csv_args
+
+    def _prepare_upload(
+        self,
+        dataset_name: str,
+        dataset_file_name: str,
+        csv_args,
+        validate: bool,
+        upload_part_size: int,
+        validation_options: Optional[validation.ValidationOptions] = None,
+    ):
+        dataset_file = self.get_dataset_file(dataset_name, dataset_file_name)
+        dataset_file_id = dataset_file["dataset_file_id"]
+        csv_args = self._upload_csv_args(
+            csv_args, upload_part_size, dataset_file["match_logic"]
+        )
+        rows = self._validate_upload(
+            csv_args, validate, dataset_file["match_logic"], validation_options
+        )
+
+        self.api_call("post", f"/v1/dataset-file/{dataset_file_id}/initiate-upload/")
+
+        return dataset_file_id, csv_args, rows
+
+    def _complete_upload(self, dataset_file_id: str) -> dict:
+        with metrics.timer("upload.complete"):
+            return self.api_call(
+                "post", f"/v1/dataset-file/{dataset_file_id}/complete-upload/"
+            )
+
+    def upload_dataset_file(
+        self,
+        dataset_name: str,
+        dataset_file_name: str,
+        csv_args,
+        validate: bool = True,
+        upload_part_size: int = 100,
+        concurrent_uploads: int = 4,
+        validation_options: Optional[validation.ValidationOptions] = None,
+    ) -> dict:
+        """Validate and upload a CSV to an existing dataset-file.
+
+        csv_args is either a binary file object of a UTF-8 comma-separated
+        CSV, or a validation.CsvArgs from validation.make_csv_args() for
+        any other format. validation_options tunes how validation runs.
+        """
+        dataset_file_id, csv_args, rows = self._prepare_upload(
+            dataset_name,
+            dataset_file_name,
+            csv_args,
+            validate,
+            upload_part_size,
+            validation_options,
+        )
+
+        loop = asyncio.new_event_loop()
+        try:
+            with upload.upload_abort_ctxmgr(self, dataset_file_id):
+                loop.run_until_complete(
+                    upload.manage_uploads(
+                        self,
+                        dataset_file_id,
+                        csv_args,
+                        upload_part_size,
+                        concurrent_uploads,
+                        rows=rows,
+                    )
+                )
+        finally:
+            loop.close()
+
+        return self._complete_upload(dataset_file_id)
+
+    def _prepare_sharded_upload(
+        self,
+        csv_args,
+        validate: bool,
+        shard_rows: int,
+        upload_part_size: int,
+        match_logic: str,
+        validation_options: Optional[validation.ValidationOptions],
+    ):
+        if not 0 < shard_rows <= validation.MAX_ROWS:
+            raise Exception(f"shard_rows must be from 1 to {validation.MAX_ROWS:,}")
+
+        csv_args = self._upload_csv_args(csv_args, upload_part_size, match_logic)
+
+        # The file is only over the row limit as a whole
+        validation_options = copy.copy(
+            validation_options or validation.ValidationOptions()
+        )
+        validation_options.max_rows = None
+        rows = self._validate_upload(
+            csv_args, validate, match_logic, validation_options
+        )
+
+        return csv_args, rows
+
+    def upload_sharded_dataset_file(
+        self,
+        dataset_name: str,
+        dataset_file_name: str,
+        csv_args,
+        validate: bool = True,
+        shard_rows: int = validation.MAX_ROWS,
+        include_households: bool = False,
+        match_logic: str = "OPPORTUNISTIC",
+        upload_part_size: int = 100,
+        concurrent_uploads: int = 4,
+        max_upload_rate: Optional[float] = None,
+        validation_options: Optional[validation.ValidationOptions] = None,
+    ) -> List[dict]:
+        """Split a CSV of any length into new dataset-files of at most
+        shard_rows records, named dataset_file_name_1, _2 and so on, and
+        upload them.
+
+        The shards share concurrent_uploads and max_upload_rate (bytes
+        per second). Returns the status of each shard, a failed shard
+        doesn't undo the ones already complete. An error before the first
+        shard, like a bad header in piped input, is raised.
+        """
+        csv_args, rows = self._prepare_sharded_upload(
+            csv_args,
+            validate,
+            shard_rows,
+            upload_part_size,
+            match_logic,
+            validation_options,
+        )
+
+        loop = asyncio.new_event_loop()
+        try:
+            shards = loop.run_until_complete(
+                upload.manage_sharded_uploads(
+                    self,
+                    dataset_name,
+                    dataset_file_name,
+                    csv_args,
+                    shard_rows,
+                    upload_part_size,
+                    concurrent_uploads,
+                    upload.UploadBudget(concurrent_uploads, max_upload_rate),
+                    include_households=include_households,
+                    match_logic=match_logic,
+                    rows=rows,
+                )
+            )
+        finally:
+            loop.close()
+
+        return [shard.to_dict() for shard in shards]
+
+    def upload_dataset_files(
+        self, dataset_name: str, files: List[Tuple[str, str]], **kwargs
+    ) -> List[dict]:
+        """Upload many files to new dataset-files in one event loop, see
+        AsyncMatchingClient.upload_dataset_files()."""
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(
+                AsyncMatchingClient(client=self).upload_dataset_files(
+                    dataset_name, files, **kwargs
+                )
+            )
+        finally:
+            loop.close()
+
+    def _download(self, download_url: str, fd: io.BufferedIOBase):
+        with metrics.timer("download") as span:
+            try:
+                download_req = self.session.get(download_url, stream=True)
+            except requests.exceptions.RequestException as e:
+                raise Exception(f"Unable to download file: {e}") from None
+
+            content_length = download_req.headers.get("Content-Length")
+            progress.start(
+                "downloading", int(content_length) if content_length else None
+            )
+            try:
+                for chunk in download_req.iter_content(chunk_size=1024 * 1024):
+                    fd.write(chunk)
+                    span.nbytes += len(chunk)
+                    progress.advance(len(chunk))
+            finally:
+                progress.finish()
+
+    def download_dataset_file(
+        self, dataset_name: str, dataset_file_name: str, fd: io.BufferedIOBase
+    ):
+        dataset_file_id = self.get_dataset_file_id(dataset_name, dataset_file_name)
+
+        resp_obj = self.api_call("get", f"/v1/dataset-file/{dataset_file_id}/")
+        if resp_obj["download_url"] is None:
+            raise Exception("Dataset file is not ready for download.")
+
+        self._download(resp_obj["download_url"], fd)
+
+    def wait_for_dataset_files(
+        self,
+        dataset_name: str,
+        dataset_file_names: List[str],
+        timeout: Optional[float] = None,
+        poll_interval: float = 5.0,
+        max_poll_interval: float = 300.0,
+        on_finished=None,
+        upload_grace: Optional[float] = None,
+    ) -> dict:
+        """Poll until each of the dataset's files in dataset_file_names is
+        in one of TERMINAL_STATUSES, or until timeout seconds have passed.
+        A file still to be uploaded is waited for as FinishedCheck says.
+
+        Every poll is one paginated list of the dataset's files, however
+        many are watched. The wait between polls grows while nothing
+        changes, up to max_poll_interval, and goes back to poll_interval
+        when a file changes status. on_finished(dataset_file) is called as
+        each file reaches a terminal status. Returns the last seen state
+        of every file by name.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        interval = poll_interval
+        pending = set(dataset_file_names)
+        last_seen = {}
+        check = FinishedCheck(upload_grace)
+
+        while True:
+            now = time.monotonic()
+            dataset_files = {
+                dataset_file["name"]: dataset_file
+                for dataset_file in self.list_dataset_files(dataset_name)
+            }
+
+            changed = False
+            for name in sorted(pending):
+                try:
+                    dataset_file = dataset_files[name]
+                except KeyError:
+                    raise Exception(
+                        f"No dataset file with name '{name}' found"
+                    ) from None
+
+                status = dataset_file["status"]
+                previous = last_seen.get(name)
+                if previous is None or previous["status"] != status:
+                    logger.info(f"Dataset file {name}: {status}")
+                    if previous is not None:
+                        changed = True
+                last_seen[name] = dataset_file
+
+                if check.finished(dataset_file, now):
+                    pending.remove(name)
+                    if on_finished is not None:
+                        on_finished(dataset_file)
+
+            if not pending:
+                return last_seen
+
+            if changed:
+                interval = poll_interval
+            sleep_for = interval
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return last_seen
+                sleep_for = min(interval, remaining)
+            grace_left = check.grace_left(pending, now)
+            if grace_left is not None:
+                # Check again as a grace period runs out
+                sleep_for = min(sleep_for, grace_left)
+
+            time.sleep(sleep_for)
+            interval = min(interval * POLL_BACKOFF, max_poll_interval)
+
+    #
+    # dataset-file delta and trigger files
+    #
+
+    def _list_daily_files(
+        self, route: str, dataset_name: str, dataset_file_name: str
+    ) -> list:
+        dataset_params = {
+            "dataset_name": dataset_name,
+            "dataset_file_name": dataset_file_name,
+        }
+        return self.paginated_api_call("get", route, params=dataset_params)
+
+    def _download_daily_file(
+        self,
+        route: str,
+        dataset_name: str,
+        dataset_file_name: str,
+        fd: io.BufferedIOBase,
+    ):
+        dataset_params = {
+            "dataset_name": dataset_name,
+            "dataset_file_name": dataset_file_name,
+        }
+        resp_obj = self.api_call("get", route, params=dataset_params)
+
+        self._download(resp_obj["download_url"], fd)
+
+    def list_dataset_file_deltas(
+        self, dataset_name: str, dataset_file_name: str
+    ) -> list:
+        return self._list_daily_files(
+            "/v1/dataset-delta-file/", dataset_name, dataset_file_name
+        )
+
+    def download_dataset_file_delta(
+        self, dataset_name: str, dataset_file_name: str, fd: io.BufferedIOBase
+    ):
+        self._download_daily_file(
+            "/v1/dataset-delta-file/", dataset_name, dataset_file_name, fd
+        )
+
+    def list_dataset_trigger_files(
+        self, dataset_name: str, dataset_file_name: str
+    ) -> list:
+        return self._list_daily_files(
+            "/v1/trigger-file/", dataset_name, dataset_file_name
+        )
+
+    def download_dataset_trigger_file(
+        self, dataset_name: str, dataset_file_name: str, fd: io.BufferedIOBase
+    ):
+        self._download_daily_file(
+            "/v1/trigger-file/", dataset_name, dataset_file_name, fd
+        )
+
+
+class AsyncMatchingClient:
+    """asyncio flavour of MatchingClient.
+
+    Control-plane calls run on the default executor over the wrapped
+    client's pooled session. Uploads run their part pipeline directly on
+    the caller's event loop, so several can share one loop.
+    """
+
+    def __init__(
+        self,
+        email: Optional[str] = None,
+        password: Optional[str] = None,
+        client: Optional[MatchingClient] = None,
+    ):
+        self.client = client or MatchingClient(email, password)
+
+    async def _run(self, fn, *args, **kwargs):
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+    async def get_token(self) -> str:
+        return await self._run(self.client.get_token)
+
+    async def get_dataset_id(self, dataset_name: str) -> str:
+        return await self._run(self.client.get_dataset_id, dataset_name)
+
+    async def get_dataset_file(self, dataset_name: str, dataset_file_name: str):
+        return await self._run(
+            self.client.get_dataset_file, dataset_name, dataset_file_name
+        )
+
+    async def list_datasets(self) -> list:
+        return await self._run(self.client.list_datasets)
+
+    async def create_dataset(self, name: str) -> dict:
+        return await self._run(self.client.create_dataset, name)
+
+    async def delete_dataset(self, name: str):
+        return await self._run(self.client.delete_dataset, name)
+
+    async def list_dataset_files(self, dataset_name: str) -> list:
+        return await self._run(self.client.list_dataset_files, dataset_name)
+
+    async def create_dataset_file(
+        self,
+        dataset_name: str,
+        dataset_file_name: str,
+        include_households: bool = False,
+        match_logic: str = "OPPORTUNISTIC",
+    ) -> dict:
+        return await self._run(
+            self.client.create_dataset_file,
+            dataset_name,
+            dataset_file_name,
+            include_households,
+            match_logic,
+        )
+
+    async def abort_dataset_file(self, dataset_name: str, dataset_file_name: str):
+        return await self._run(
+            self.client.abort_dataset_file, dataset_name, dataset_file_name
+        )
+
+    async def delete_dataset_file(self, dataset_name: str, dataset_file_name: str):
+        return await self._run(
+            self.client.delete_dataset_file, dataset_name, dataset_file_name
+        )
+
+    async def upload_dataset_file(
+        self,
+        dataset_name: str,
+        dataset_file_name: str,
+        csv_args,
+        validate: bool = True,
+        upload_part_size: int = 100,
+        concurrent_uploads: int = 4,
+        validation_options: Optional[validation.ValidationOptions] = None,
+        budget: Optional[upload.UploadBudget] = None,
+    ) -> dict:
+        """budget shares limits between uploads on this loop, its
+        concurrent uploads are used rather than concurrent_uploads."""
+        dataset_file_id, csv_args, rows = await self._run(
+            self.client._prepare_upload,
+            dataset_name,
+            dataset_file_name,
+            csv_args,
+            validate,
+            upload_part_size,
+            validation_options,
+        )
+
+        try:
+            await upload.manage_uploads(
+                self.client,
+                dataset_file_id,
+                csv_args,
+                upload_part_size,
+                concurrent_uploads,
+                budget=budget,
+                rows=rows,
+            )
+        except:  # noqa: E722
+            await self._run(
+                self.client.api_call,
+                "post",
+                f"/v1/dataset-file/{dataset_file_id}/abort-upload/",
+            )
+            raise
+
+        async with budget.api_call() if budget else contextlib.nullcontext():
+            return await self._run(self.client._complete_upload, dataset_file_id)
+
+    async def upload_dataset_files(
+        self,
+        dataset_name: str,
+        files: List[Tuple[str, str]],
+        validate: bool = True,
+        include_households: bool = False,
+        match_logic: str = "OPPORTUNISTIC",
+        upload_part_size: int = 100,
+        concurrent_uploads: int = 4,
+        concurrent_files: int = 2,
+        max_upload_rate: Optional[float] = None,
+        max_buffered_bytes: Optional[int] = None,
+        concurrent_api_calls: Optional[int] = None,
+        validation_options: Optional[validation.ValidationOptions] = None,
+        make_csv_args=validation.make_csv_args,
+    ) -> List[dict]:
+        """Create a dataset-file for each (dataset_file_name, path) of files
+        and validate and upload the file at path to it, concurrent_files
+        at a time. make_csv_args(fd) reads the open file.
+
+        Every file shares one budget: concurrent_uploads parts uploading,
+        max_upload_rate bytes per second, max_buffered_bytes of parts in
+        memory (by default twice what can be uploading) and
+        concurrent_api_calls control-plane calls. Returns the status of
+        each file, a failed file doesn't stop the others. A validation
+        report is written for each file, see file_report_path().
+        """
+        if max_buffered_bytes is None:
+            max_buffered_bytes = 2 * concurrent_uploads * upload_part_size * 1024**2
+        budget = upload.UploadBudget(
+            concurrent_uploads,
+            max_upload_rate,
+            max_buffered_bytes,
+            concurrent_api_calls,
+        )
+        file_slots = asyncio.Semaphore(concurrent_files)
+
+        def file_options(dataset_file_name: str):
+            if validation_options is None or validation_options.report_path is None:
+                return validation_options
+            # Files validating at once would write over each other's report
+            options = copy.copy(validation_options)
+            options.report_path = file_report_path(
+                validation_options.report_path, dataset_file_name
+            )
+            return options
+
+        async def upload_file(dataset_file_name: str, path: str) -> dict:
+            status = {
+                "dataset_file_name": dataset_file_name,
+                "path": path,
+                "dataset_file_id": None,
+                "status": "COMPLETE",
+                "error": None,
+            }
+            async with file_slots:
+                logger.info(f"Uploading {path} to {dataset_file_name}")
+                try:
+                    async with budget.api_call():
+                        dataset_file = await self.create_dataset_file(
+                            dataset_name,
+                            dataset_file_name,
+                            include_households=include_households,
+                            match_logic=match_logic,
+                        )
+                    status["dataset_file_id"] = dataset_file["dataset_file_id"]
+
+                    with open(path, "rb") as fd:
+                        csv_args = await self._run(make_csv_args, fd)
+                        await self.upload_dataset_file(
+                            dataset_name,
+                            dataset_file_name,
+                            csv_args,
+                            validate=validate,
+                            upload_part_size=upload_part_size,
+                            # A file uploading alone can use every slot
+                            concurrent_uploads=concurrent_uploads,
+                            validation_options=file_options(dataset_file_name),
+                            budget=budget,
+                        )
+                except Exception as e:
+                    logger.info(f"Upload of {path} failed: {e}")
+                    status.update(status="FAILED", error=str(e))
+            return status
+
+        return list(
+            await asyncio.gather(*(upload_file(name, path) for name, path in files))
+        )
+
+    async def upload_sharded_dataset_file(
+        self,
+        dataset_name: str,
+        dataset_file_name: str,
+        csv_args,
+        validate: bool = True,
+        shard_rows: int = validation.MAX_ROWS,
+        include_households: bool = False,
+        match_logic: str = "OPPORTUNISTIC",
+        upload_part_size: int = 100,
+        concurrent_uploads: int = 4,
+        max_upload_rate: Optional[float] = None,
+        validation_options: Optional[validation.ValidationOptions] = None,
+    ) -> List[dict]:
+        csv_args, rows = await self._run(
+            self.client._prepare_sharded_upload,
+            csv_args,
+            validate,
+            shard_rows,
+            upload_part_size,
+            match_logic,
+            validation_options,
+        )
+
+        shards = await upload.manage_sharded_uploads(
+            self.client,
+            dataset_name,
+            dataset_file_name,
+            csv_args,
+            shard_rows,
+            upload_part_size,
+            concurrent_uploads,
+            upload.UploadBudget(concurrent_uploads, max_upload_rate),
+            include_households=include_households,
+            match_logic=match_logic,
+            rows=rows,
+        )
+        return [shard.to_dict() for shard in shards]
+
+    async def download_dataset_file(
+        self, dataset_name: str, dataset_file_name: str, fd: io.BufferedIOBase
+    ):
+        return await self._run(
+            self.client.download_dataset_file, dataset_name, dataset_file_name, fd
+        )
+
+    async def wait_for_dataset_files(
+        self, dataset_name: str, dataset_file_names: List[str], **kwargs
+    ) -> dict:
+        return await self._run(
+            self.client.wait_for_dataset_files,
+            dataset_name,
+            dataset_file_names,
+            **kwargs,
+        )
+
+    async def list_dataset_file_deltas(
+        self, dataset_name: str, dataset_file_name: str
+    ) -> list:
+        return await self._run(
+            self.client.list_dataset_file_deltas, dataset_name, dataset_file_name
+        )
+
+    async def download_dataset_file_delta(
+        self, dataset_name: str, dataset_file_name: str, fd: io.BufferedIOBase
+    ):
+        return await self._run(
+            self.client.download_dataset_file_delta,
+            dataset_name,
+            dataset_file_name,
+            fd,
+        )
+
+    async def list_dataset_trigger_files(
+        self, dataset_name: str, dataset_file_name: str
+    ) -> list:
+        return await self._run(
+            self.client.list_dataset_trigger_files, dataset_name, dataset_file_name
+        )
+
+    async def download_dataset_trigger_file(
+        self, dataset_name: str, dataset_file_name: str, fd: io.BufferedIOBase
+    ):
+        return await self._run(
+            self.client.download_dataset_trigger_file,
+            dataset_name,
+            dataset_file_name,
+            fd,
+        )
+
+
+_cli_clients = {}
+
+
+def file_report_path(report_path: str, dataset_file_name: str) -> str:
+    """report_path with the dataset-file's name added before its extension,
+    report.csv becomes report_customers.csv for customers."""
+    root, ext = os.path.splitext(report_path)
+    return f"{root}_{dataset_file_name.replace('/', '_')}{ext}"
+
+
+def from_args(args) -> MatchingClient:
+    """Client for the CLI's credentials. Clients are kept per credential
+    pair, sharing the module token service and its per-account tokens, so
+    a long-running daemon reuses their connections and ID cache between
+    commands."""
+    key = (args.email, args.password)
+    try:
+        return _cli_clients[key]
+    except KeyError:
+        pass
+
+    client = MatchingClient(
+        args.email, args.password, token_service=token.token_service
+    )
+    _cli_clients[key] = client
+    return client
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import bz2
+import gzip
+import io
+import lzma
+import re
+from typing import Optional
+
+
+SKIP_BLOCK_SIZE = 1024 * 1024
+
+# bzip2 is only "BZh", so the block size digit and the magic of the first
+# block (or of the end of an empty stream) are checked too.
+_MAGIC_RES = [
+    ("gzip", re.compile(rb"\x1f\x8b")),
+    (
+        "bz2",
+        re.compile(rb"BZh[1-9](\x31\x41\x59\x26\x53\x59|\x17\x72\x45\x38\x50\x90)"),
+    ),
+    ("xz", re.compile(rb"\xfd7zXZ\x00")),
+    ("zstd", re.compile(rb"\x28\xb5\x2f\xfd")),
+]
+MAGIC_SIZE = 10
+
+
+def detect_compression(raw_fd) -> Optional[str]:
+    """Compression format from the magic bytes at the current position, or
+    None for uncompressed and unseekable files."""
+    try:
+        position = raw_fd.tell()
+        head = raw_fd.read(MAGIC_SIZE)
+        raw_fd.seek(position)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+
+    for compression, magic_re in _MAGIC_RES:
+        if magic_re.match(head):
+            return compression
+
+    return None
+
+
+def _open_zstd(raw_fd):
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception(
+            "Reading zstd compressed files requires the zstandard package, "
+            "install it with 'pip install aidentified-matching-api[zstd]'"
+        ) from None
+
+    return zstandard.ZstdDecompressor().stream_reader(
+        raw_fd, read_across_frames=True, closefd=False
+    )
+
+
+def _zstd_error():
+    import zstandard
+
+    return zstandard.ZstdError
+
+
+# The file object passed in is never closed by these.
+_OPENERS = {
+    "gzip": lambda raw_fd: gzip.GzipFile(fileobj=raw_fd, mode="rb"),
+    "bz2": bz2.BZ2File,
+    "xz": lzma.LZMAFile,
+    "zstd": _open_zstd,
+}
+
+
+class DecompressedFile(io.RawIOBase):
+    """Read-only decompressed view of a compressed file.
+
+    Seeking backwards starts decompressing again from the start of the
+    compressed file, seeking forwards decompresses and discards. There is
+    no fileno() or name, so the compressed bytes are never memory mapped or
+    split between parallel validation workers.
+    """
+
+    def __init__(self, compressed_fd, compression: str):
+        self.compressed_fd = compressed_fd
+        self.compression = compression
+        self._start = compressed_fd.tell()
+        self._reopen()
+        self._errors = (EOFError, OSError, lzma.LZMAError)
+        if compression == "zstd":
+            self._errors += (_zstd_error(),)
+
+    def _reopen(self):
+        self.compressed_fd.seek(self._start)
+        self._stream = _OPENERS[self.compression](self.compressed_fd)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return self.compressed_fd.seekable()
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        try:
+            data = self._stream.read(size)
+        except self._errors as e:
+            raise Exception(f"Bad {self.compression} compressed data: {e}") from None
+
+        self._position += len(data)
+        return data
+
+    def readinto(self, buf) -> int:
+        data = self.read(len(buf))
+        buf[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Can't seek from the end of compressed data")
+
+        if offset < self._position:
+            self._reopen()
+        while self._position < offset:
+            if not self.read(min(SKIP_BLOCK_SIZE, offset - self._position)):
+                break
+
+        return self._position
+
+    def close(self):
+        if not self.closed:
+            self._stream.close()
+        super().close()
+
+
+def open_decompressed(raw_fd):
+    """raw_fd itself, or a DecompressedFile if it starts with the magic
+    bytes of a compression format."""
+    compression = detect_compression(raw_fd)
+    if compression is None:
+        return raw_fd
+
+    return DecompressedFile(raw_fd, compression)
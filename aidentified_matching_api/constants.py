@@ -20,6 +20,9 @@ AIDENTIFIED_URL = os.environ.get(
     "AIDENTIFIED_URL", "https://matching-api.aidentified.com"
 )
 
+LOG_FORMAT = "%(asctime)s %(levelname)-8s %(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
+
 
 def pretty(obj):
     print(json.dumps(obj, indent=4, sort_keys=True))
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextlib
+import io
+import json
+import logging
+import os
+import socket
+import socketserver
+import sys
+import threading
+import time
+import zlib
+
+import appdirs
+
+import aidentified_matching_api.constants as constants
+
+
+logger = logging.getLogger("matching_api_cli")
+
+# Commands that take or write a local file are always run in-process: the
+# file was already opened (or truncated) by the CLI's argparse and the
+# daemon may not share the CLI's working directory. So are commands that
+# report progress on the CLI's stderr, and commands that set in_process.
+LOCAL_ONLY_ARGS = (
+    "dataset_file_path",
+    "download_dir",
+    "in_process",
+    "metrics_file",
+    "profile_cpu",
+    "profile_memory",
+    "progress",
+    "trace_file",
+)
+
+
+def get_socket_path() -> str:
+    dirs = appdirs.AppDirs(
+        appname="aidentified_match", appauthor="Aidentified", version="1.0"
+    )
+    os.makedirs(dirs.user_cache_dir, exist_ok=True)
+    endpoint_hash = hex(zlib.crc32(constants.AIDENTIFIED_URL.encode("utf-8")))[2:]
+    return os.path.join(dirs.user_cache_dir, f"daemon_{endpoint_hash}.sock")
+
+
+def _send_request(request: dict) -> dict:
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.connect(get_socket_path())
+        sock.sendall(json.dumps(request).encode("UTF-8") + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+
+        with sock.makefile("rb") as fd:
+            return json.loads(fd.readline())
+
+
+def _can_forward(args) -> bool:
+    if getattr(args, "no_daemon", False) or getattr(args, "daemon_command", False):
+        return False
+
+    return not any(getattr(args, arg, None) for arg in LOCAL_ONLY_ARGS)
+
+
+def try_forward(args, argv):
+    """Run the command on a running daemon. Returns None when there is no
+    daemon to talk to and the command should run in-process."""
+    if not _can_forward(args) or not os.path.exists(get_socket_path()):
+        return None
+
+    request = {
+        "command": "run",
+        "argv": argv,
+        # Resolved here so the CLI's own flags and environment win over the
+        # environment the daemon was started with.
+        "email": args.email,
+        "password": args.password,
+    }
+    try:
+        resp = _send_request(request)
+    except (ConnectionRefusedError, FileNotFoundError):
+        logger.info("Daemon socket is stale, running in-process")
+        return None
+
+    if resp["stdout"]:
+        print(resp["stdout"], end="")
+    # Absent from daemons started before stderr was forwarded
+    if resp.get("stderr"):
+        print(resp["stderr"], end="", file=sys.stderr)
+
+    if resp["error"] is not None:
+        print(f"Error: {resp['error']}", file=sys.stderr)
+
+    return resp["exit_code"]
+
+
+@contextlib.contextmanager
+def _command_logging(verbose: bool, stream):
+    """--verbose for a command run on the daemon, logging to the stderr
+    it returns rather than the daemon's own."""
+    if not verbose:
+        yield
+        return
+
+    root = logging.getLogger()
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(
+        logging.Formatter(constants.LOG_FORMAT, constants.LOG_DATE_FORMAT)
+    )
+    old_level = root.level
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    try:
+        yield
+    finally:
+        root.removeHandler(handler)
+        root.setLevel(old_level)
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        command = request["command"]
+
+        if command == "run":
+            resp = self.server.run_command(request)
+        elif command == "status":
+            resp = self.server.status()
+        elif command == "stop":
+            resp = {"stopping": True}
+            # shutdown() blocks until serve_forever() returns, so it can't
+            # be called from the serving thread.
+            threading.Thread(target=self.server.shutdown).start()
+        else:
+            resp = {"error": f"Unknown daemon command '{command}'"}
+
+        self.wfile.write(json.dumps(resp).encode("UTF-8") + b"\n")
+
+
+class DaemonServer(socketserver.UnixStreamServer):
+    # Requests are served one at a time: commands print their results, and
+    # stdout can only be captured for one command at once.
+
+    def __init__(self, socket_path: str):
+        self.started_at = time.time()
+        self.request_count = 0
+        # Socket is only reachable by the user who started the daemon.
+        old_umask = os.umask(0o177)
+        try:
+            super().__init__(socket_path, _RequestHandler)
+        finally:
+            os.umask(old_umask)
+
+    def status(self) -> dict:
+        return {
+            "pid": os.getpid(),
+            "endpoint": constants.AIDENTIFIED_URL,
+            "uptime": int(time.time() - self.started_at),
+            "requests": self.request_count,
+        }
+
+    def run_command(self, request: dict) -> dict:
+        # Imported late, the parser lives in the package __init__ which
+        # imports this module.
+        from aidentified_matching_api import parser
+
+        self.request_count += 1
+        stdout = io.StringIO()
+        stderr = io.StringIO()
+        error = None
+        exit_code = 0
+
+        try:
+            with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+                args = parser.parse_args(request["argv"])
+                args.email = request["email"]
+                args.password = request["password"]
+                with _command_logging(args.verbose, stderr):
+                    exit_code = args.func(args) or 0
+        except SystemExit as e:
+            exit_code = e.code if isinstance(e.code, int) else 1
+        except Exception as e:
+            logger.exception("Daemon command failed")
+            error = str(e)
+            exit_code = 1
+
+        return {
+            "stdout": stdout.getvalue(),
+            "stderr": stderr.getvalue(),
+            "error": error,
+            "exit_code": exit_code,
+        }
+
+
+def run_daemon(args):
+    socket_path = get_socket_path()
+
+    if os.path.exists(socket_path):
+        try:
+            _send_request({"command": "status"})
+        except (ConnectionRefusedError, FileNotFoundError):
+            os.remove(socket_path)
+        else:
+            raise Exception(f"Daemon already running on {socket_path}")
+
+    server = DaemonServer(socket_path)
+    logger.info(f"Daemon listening on {socket_path}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(socket_path)
+
+
+def _daemon_request(command: str) -> dict:
+    try:
+        return _send_request({"command": command})
+    except (ConnectionRefusedError, FileNotFoundError):
+        raise Exception("Daemon is not running") from None
+
+
+def daemon_status(args):
+    constants.pretty(_daemon_request("status"))
+
+
+def stop_daemon(args):
+    constants.pretty(_daemon_request("stop"))
@@ -12,285 +12,208 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
-import asyncio
-import base64
-import codecs
-import contextlib
-import csv
-import functools
-import hashlib
-import io
-import logging
-import threading
-
-import requests
+import copy
+import glob
+import os
 
+import aidentified_matching_api.client as client
 import aidentified_matching_api.constants as constants
-import aidentified_matching_api.get_id as get_id
-import aidentified_matching_api.token_service as token
 import aidentified_matching_api.validation as validation
 
-logger = logging.getLogger("matching_api_cli")
-
-
-UPLOAD_CANCELLED = threading.Event()
-
 
 def list_dataset_files(args):
-    dataset_file_params = {
-        "dataset_name": args.dataset_name,
-    }
-    resp_obj = token.token_service.paginated_api_call(
-        args, requests.get, "/v1/dataset-file/", params=dataset_file_params
-    )
-    constants.pretty(resp_obj)
+    constants.pretty(client.from_args(args).list_dataset_files(args.dataset_name))
 
 
 def abort_dataset_file(args):
-    dataset_file_id = get_id.get_dataset_file_id_from_dataset_file_name(args)
-    resp_obj = token.token_service.api_call(
-        args, requests.post, f"/v1/dataset-file/{dataset_file_id}/abort-upload/"
+    constants.pretty(
+        client.from_args(args).abort_dataset_file(
+            args.dataset_name, args.dataset_file_name
+        )
     )
-    constants.pretty(resp_obj)
 
 
 def create_dataset_file(args):
-    # create files under name.
-    dataset_id = get_id.get_dataset_id_from_dataset_name(args)
-
-    dataset_file_payload = {
-        "dataset_id": dataset_id,
-        "name": args.dataset_file_name,
-        "include_households": args.include_households,
-        "match_logic": args.match_logic,
-    }
-    resp_obj = token.token_service.api_call(
-        args, requests.post, "/v1/dataset-file/", json=dataset_file_payload
-    )
-
-    constants.pretty(resp_obj)
-
-
-async def file_uploader(args, dataset_file_id: str, part_queue: asyncio.Queue):
-    loop = asyncio.get_event_loop()
-
-    while True:
-        part_idx, part_data = await part_queue.get()
-        aws_part_number = part_idx + 1
-
-        logger.info(f"Starting upload part {aws_part_number} hash")
-        md5 = await loop.run_in_executor(
-            None, lambda data: base64.b64encode(hashlib.md5(data).digest()), part_data
-        )
-
-        upload_part_payload = {
-            "dataset_file_id": dataset_file_id,
-            "part_number": aws_part_number,
-            "md5": md5.decode("UTF-8"),
-        }
-        upload_part_callable = functools.partial(
-            token.token_service.api_call,
-            args,
-            requests.post,
-            "/v1/dataset-file-upload-part/",
-            json=upload_part_payload,
-        )
-        resp = await loop.run_in_executor(None, upload_part_callable)
-        upload_url = resp["upload_url"]
-        dataset_file_upload_part_id = resp["dataset_file_upload_part_id"]
-
-        logger.info(f"Starting upload part {aws_part_number} upload")
-        put_part_callable = functools.partial(
-            requests.put,
-            upload_url,
-            data=part_data,
-            headers={"content-md5": md5},
+    constants.pretty(
+        client.from_args(args).create_dataset_file(
+            args.dataset_name,
+            args.dataset_file_name,
+            include_households=args.include_households,
+            match_logic=args.match_logic,
         )
-        try:
-            upload_resp = await loop.run_in_executor(None, put_part_callable)
-        except requests.exceptions.RequestException as e:
-            raise Exception(f"Unable to upload file part: {e}") from None
-
-        try:
-            upload_resp.raise_for_status()
-        except requests.exceptions.RequestException:
-            # S3 returns XML. If it fails, let's just spew it.
-            raise Exception(
-                f"Unable to upload file part: {upload_resp.status_code} {upload_resp.text}"
-            ) from None
-
-        patch_etag_callable = functools.partial(
-            token.token_service.api_call,
-            args,
-            requests.patch,
-            f"/v1/dataset-file-upload-part/{dataset_file_upload_part_id}/",
-            json={"etag": upload_resp.headers["ETag"]},
-        )
-        await loop.run_in_executor(None, patch_etag_callable)
-
-        part_queue.task_done()
-        logger.info(f"Finished upload part {aws_part_number}")
-
-
-@contextlib.contextmanager
-def upload_abort_ctxmgr(args, dataset_file_id: str):
-    try:
-        yield
-    except:  # noqa: E722
-        token.token_service.api_call(
-            args, requests.post, f"/v1/dataset-file/{dataset_file_id}/abort-upload/"
-        )
-        raise
-
-
-SENTINEL = object()
-
-
-async def rewrite_csv(
-    csv_args: validation.CsvArgs, part_size_bytes: int, part_queue: asyncio.Queue
-):
-    loop = asyncio.get_event_loop()
-
-    part_idx = 0
-    utf_8_info = codecs.lookup("UTF-8")
-
-    out_buf = b""
-    out_bytes_fd = io.BytesIO()
-    out_text_fd = utf_8_info.streamwriter(out_bytes_fd)
-
-    read_fd = csv_args.codec_info.streamreader(csv_args.raw_fd)
-
-    reader = csv.reader(
-        read_fd,
-        delimiter=csv_args.delimiter,
-        doublequote=csv_args.doublequotes,
-        escapechar=csv_args.escapechar,
-        quotechar=csv_args.quotechar,
-        quoting=csv_args.quoting,
-        skipinitialspace=csv_args.skipinitialspace,
-        strict=True,
     )
-    writer = csv.writer(out_text_fd, quoting=csv.QUOTE_MINIMAL)
 
-    while True:
-        row = await loop.run_in_executor(None, next, reader, SENTINEL)
-        if row is SENTINEL:
-            out_buf += out_bytes_fd.getvalue()
-            break
 
-        writer.writerow(row)
-
-        if out_bytes_fd.tell() < part_size_bytes:
-            continue
-
-        out_buf += out_bytes_fd.getvalue()
-
-        out_bytes_fd.seek(0)
-        out_bytes_fd.truncate()
+def upload_dataset_file(args):
+    if args.upload_part_size < 5:
+        raise Exception("--upload-part-size must be greater than 5 Mb")
 
-        logger.info(f"Putting upload part {part_idx + 1}")
-        await part_queue.put((part_idx, out_buf[:part_size_bytes]))
-        out_buf = out_buf[part_size_bytes:]
-        part_idx += 1
+    complete_resp = client.from_args(args).upload_dataset_file(
+        args.dataset_name,
+        args.dataset_file_name,
+        validation.csv_args_from_args(args),
+        validate=args.validate,
+        validation_options=validation.validation_options_from_args(args),
+        upload_part_size=args.upload_part_size,
+        concurrent_uploads=args.concurrent_uploads,
+    )
+    constants.pretty(complete_resp)
 
-    if len(out_buf) > 0:
-        logger.info(f"Putting final upload part {part_idx + 1}")
-        await part_queue.put((part_idx, out_buf))
 
+def upload_dataset_file_shards(args):
+    if args.upload_part_size < 5:
+        raise Exception("--upload-part-size must be greater than 5 Mb")
 
-async def manage_uploads(args, dataset_file_id: str, csv_args: validation.CsvArgs):
-    part_queue = asyncio.Queue(maxsize=args.concurrent_uploads)
-    part_size_bytes = args.upload_part_size * 1024 * 1024
+    max_upload_rate = None
+    if args.max_upload_rate is not None:
+        max_upload_rate = args.max_upload_rate * 1024 * 1024
+
+    shards = client.from_args(args).upload_sharded_dataset_file(
+        args.dataset_name,
+        args.dataset_file_name,
+        validation.csv_args_from_args(args),
+        validate=args.validate,
+        shard_rows=args.shard_rows,
+        include_households=args.include_households,
+        match_logic=args.match_logic,
+        upload_part_size=args.upload_part_size,
+        concurrent_uploads=args.concurrent_uploads,
+        max_upload_rate=max_upload_rate,
+        validation_options=validation.validation_options_from_args(args),
+    )
+    constants.pretty(shards)
 
-    uploader_tasks = []
+    if not shards or any(shard["status"] != "COMPLETE" for shard in shards):
+        return 1
 
-    for _ in range(args.concurrent_uploads):
-        uploader_tasks.append(
-            asyncio.create_task(file_uploader(args, dataset_file_id, part_queue))
-        )
 
-    async def part_queue_joiner():
-        await rewrite_csv(csv_args, part_size_bytes, part_queue)
-        # now that everything is queued, join() for work to finish
-        await part_queue.join()
-
-        # now that everything is done, cancel() the otherwise idle workers
-        for uploader_task in uploader_tasks:
-            uploader_task.cancel()
-
-    tasks = [asyncio.create_task(part_queue_joiner()), *uploader_tasks]
-
-    # await on all tasks in case any of them raise an exception, so you
-    # can kill them all
-    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
-
-    # if pending, an exception hit us
-    for pending_fut in pending:
-        pending_fut.cancel()
-
-    had_exception = [
-        future.exception()
-        for future in done
-        if not future.cancelled() and future.exception() is not None
-    ]
-    if had_exception:
-        exc_strings = ", ".join(
-            f"Task {fut_idx}: {exc}" for fut_idx, exc in enumerate(had_exception)
-        )
-        raise Exception(f"Error(s) while uploading file: {exc_strings}")
+def _expand_paths(paths) -> list:
+    """The files in each directory, matching each glob pattern, or each
+    path itself."""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            matches = [os.path.join(path, name) for name in os.listdir(path)]
+        else:
+            matches = glob.glob(path)
+            if not matches:
+                raise Exception(f"No files match {path}")
+        files.extend(sorted(match for match in matches if os.path.isfile(match)))
+    return files
 
 
-def upload_dataset_file(args):
+def upload_many_dataset_files(args):
     if args.upload_part_size < 5:
         raise Exception("--upload-part-size must be greater than 5 Mb")
 
-    dataset_file = get_id.get_dataset_file_from_dataset_file_name(args)
-    dataset_file_id = dataset_file["dataset_file_id"]
-    match_logic = dataset_file["match_logic"]
-
-    logger.info("Starting validation")
-    csv_args = validation.validate(args, match_logic)
-    logger.info("Validation complete")
-
-    token.token_service.api_call(
-        args, requests.post, f"/v1/dataset-file/{dataset_file_id}/initiate-upload/"
+    files = {}
+    for path in _expand_paths(args.dataset_file_paths):
+        name = os.path.basename(path)
+        if name in files:
+            raise Exception(f"{files[name]} and {path} would have the same name")
+        files[name] = path
+
+    def make_csv_args(fd):
+        file_args = copy.copy(args)
+        file_args.dataset_file_path = fd
+        return validation.csv_args_from_args(file_args)
+
+    max_upload_rate = max_buffered_bytes = None
+    if args.max_upload_rate is not None:
+        max_upload_rate = args.max_upload_rate * 1024 * 1024
+    if args.max_buffered_mb is not None:
+        max_buffered_bytes = args.max_buffered_mb * 1024 * 1024
+
+    statuses = client.from_args(args).upload_dataset_files(
+        args.dataset_name,
+        list(files.items()),
+        validate=args.validate,
+        include_households=args.include_households,
+        match_logic=args.match_logic,
+        upload_part_size=args.upload_part_size,
+        concurrent_uploads=args.concurrent_uploads,
+        concurrent_files=args.concurrent_files,
+        max_upload_rate=max_upload_rate,
+        max_buffered_bytes=max_buffered_bytes,
+        concurrent_api_calls=args.max_api_calls,
+        validation_options=validation.validation_options_from_args(args),
+        make_csv_args=make_csv_args,
     )
+    constants.pretty(statuses)
+
+    if any(status["status"] != "COMPLETE" for status in statuses):
+        return 1
 
-    loop = asyncio.new_event_loop()
-    with upload_abort_ctxmgr(args, dataset_file_id):
-        loop.run_until_complete(manage_uploads(args, dataset_file_id, csv_args))
 
-    complete_resp = token.token_service.api_call(
-        args, requests.post, f"/v1/dataset-file/{dataset_file_id}/complete-upload/"
+def validate_dataset_file(args):
+    validation.validate_csv(
+        validation.csv_args_from_args(args),
+        args.match_logic,
+        validation.validation_options_from_args(args),
     )
-    constants.pretty(complete_resp)
-    loop.stop()
-    loop.close()
+    args.dataset_file_path.close()
+    print("File is valid")
 
 
 def download_dataset_file(args):
-    dataset_file_id = get_id.get_dataset_file_id_from_dataset_file_name(args)
-
-    resp_obj = token.token_service.api_call(
-        args, requests.get, f"/v1/dataset-file/{dataset_file_id}/"
+    client.from_args(args).download_dataset_file(
+        args.dataset_name, args.dataset_file_name, args.dataset_file_path
     )
-    if resp_obj["download_url"] is None:
-        raise Exception("Dataset file is not ready for download.")
+    args.dataset_file_path.close()
 
-    try:
-        download_req = requests.get(resp_obj["download_url"])
-    except requests.exceptions.RequestException as e:
-        raise Exception(f"Unable to download file: {e}") from None
 
-    for chunk in download_req.iter_content(chunk_size=1024 * 1024 * 1024):
-        args.dataset_file_path.write(chunk)
+# Exit codes of dataset-file wait by final status. When the files end up in
+# different ones, the highest code wins.
+WAIT_EXIT_CODES = {
+    "MATCHING_FINISHED": 0,
+    "VALIDATION_ERROR": 3,
+    "MATCHING_ERROR": 4,
+    # Aborted, or not started within --upload-grace
+    "UPLOAD_NOT_STARTED": 5,
+}
+WAIT_TIMEOUT_EXIT_CODE = 6
+
+
+def wait_dataset_files(args):
+    if args.download_dir is not None and not os.path.isdir(args.download_dir):
+        raise Exception(f"--download-dir {args.download_dir} is not a directory")
+
+    matching_client = client.from_args(args)
+    # A file still waiting for its upload is UPLOAD_NOT_STARTED too
+    finished = set()
+
+    def on_finished(dataset_file: dict):
+        finished.add(dataset_file["name"])
+        if args.download_dir is None or dataset_file["status"] != "MATCHING_FINISHED":
+            return
+        path = os.path.join(args.download_dir, dataset_file["name"].replace("/", "_"))
+        with open(path, "wb") as fd:
+            matching_client.download_dataset_file(
+                args.dataset_name, dataset_file["name"], fd
+            )
+
+    dataset_files = matching_client.wait_for_dataset_files(
+        args.dataset_name,
+        args.dataset_file_name,
+        timeout=args.timeout,
+        poll_interval=args.poll_interval,
+        max_poll_interval=args.max_poll_interval,
+        on_finished=on_finished,
+        upload_grace=args.upload_grace,
+    )
+    constants.pretty([dataset_files[name] for name in sorted(dataset_files)])
 
-    args.dataset_file_path.close()
+    return max(
+        (
+            WAIT_EXIT_CODES[dataset_file["status"]]
+            if name in finished
+            else WAIT_TIMEOUT_EXIT_CODE
+        )
+        for name, dataset_file in dataset_files.items()
+    )
 
 
 def delete_dataset_file(args):
-    dataset_file_id = get_id.get_dataset_file_id_from_dataset_file_name(args)
-
-    token.token_service.api_call(
-        args, requests.delete, f"/v1/dataset-file/{dataset_file_id}/"
+    client.from_args(args).delete_dataset_file(
+        args.dataset_name, args.dataset_file_name
     )
@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import codecs
+import io
+import json
+from typing import List
+
+# Readers for files that aren't CSVs. Like a csv.reader they produce the
+# header row and then each record as a list of strings, so the validator
+# and the uploader don't need to know what the file was.
+
+INPUT_FORMATS = ["auto", "csv", "jsonl", "parquet"]
+PARQUET_MAGIC = b"PAR1"
+PARQUET_BATCH_ROWS = 64 * 1024
+FORMAT_SAMPLE_SIZE = 1024
+
+
+class InputFormatError(Exception):
+    """A record that couldn't be read, reading carries on with the next."""
+
+
+def detect_format(raw_fd) -> str:
+    """Input format from the start of the file: Parquet by its magic bytes,
+    JSON lines if the first thing in it is an object, otherwise CSV."""
+    try:
+        position = raw_fd.tell()
+        head = raw_fd.read(FORMAT_SAMPLE_SIZE)
+        raw_fd.seek(position)
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return "csv"
+
+    if head.startswith(PARQUET_MAGIC):
+        return "parquet"
+
+    if head.startswith(codecs.BOM_UTF8):
+        head = head[3:]
+    if head.lstrip().startswith(b"{"):
+        return "jsonl"
+
+    return "csv"
+
+
+_JSON_DECODER = json.JSONDecoder()
+
+
+def _to_str(value) -> str:
+    if type(value) is int:
+        return str(value)
+    if value is None:
+        return ""
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    return json.dumps(value, ensure_ascii=False, separators=(",", ":"))
+
+
+class JsonlReader:
+    """Rows from one JSON object per line. The header is the keys of the
+    first object, later objects can leave keys out but not add new ones."""
+
+    def __init__(self, lines):
+        self.lines = iter(lines)
+        self.line_num = 0
+        self.headers = None
+        self._header_idxes = None
+        self._header_tuple = None
+        self._first_record = None
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> List[str]:
+        if self.headers is None:
+            self._first_record = self._read_record()
+            self.headers = list(self._first_record)
+            self._header_tuple = tuple(self.headers)
+            self._header_idxes = {
+                header: idx for idx, header in enumerate(self.headers)
+            }
+            return list(self.headers)
+
+        if self._first_record is not None:
+            record, self._first_record = self._first_record, None
+        else:
+            record = self._read_record()
+
+        # Usually every line has the same keys in the same order
+        if tuple(record) == self._header_tuple:
+            return [
+                value if type(value) is str else _to_str(value)
+                for value in record.values()
+            ]
+
+        row = [""] * len(self.headers)
+        header_idxes = self._header_idxes
+        for key, value in record.items():
+            try:
+                idx = header_idxes[key]
+            except KeyError:
+                raise InputFormatError(
+                    f"line {self.line_num} has key '{key}' that isn't in the first line"
+                ) from None
+            row[idx] = value if type(value) is str else _to_str(value)
+
+        return row
+
+    def _read_record(self) -> dict:
+        line = ""
+        while not line.strip():
+            line = next(self.lines)
+            self.line_num += 1
+            # Text is also split on \x85, \u2028 and \u2029, which JSON
+            # strings can contain unescaped.
+            while not line.endswith(("\n", "\r")):
+                try:
+                    line += next(self.lines)
+                except StopIteration:
+                    break
+
+        try:
+            record = _JSON_DECODER.decode(line)
+        except json.JSONDecodeError as e:
+            raise InputFormatError(
+                f"line {self.line_num} is not valid JSON: {e}"
+            ) from None
+
+        if type(record) is not dict:
+            raise InputFormatError(f"line {self.line_num} is not a JSON object")
+
+        return record
+
+
+def _arrow_strings(column) -> List[str]:
+    import pyarrow
+    import pyarrow.compute
+
+    try:
+        strings = pyarrow.compute.cast(column, pyarrow.string())
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowNotImplementedError):
+        # Lists, structs and the like
+        return [_to_str(value) for value in column.to_pylist()]
+
+    return pyarrow.compute.fill_null(strings, "").to_pylist()
+
+
+def parquet_rows(raw_fd):
+    """Rows of a Parquet file, read a record batch at a time."""
+    try:
+        import pyarrow.parquet
+    except ImportError:
+        raise Exception(
+            "Reading Parquet files requires the pyarrow package, "
+            "install it with 'pip install aidentified-matching-api[arrow]'"
+        ) from None
+
+    if not raw_fd.seekable():
+        raise Exception("Parquet files can't be read from a pipe")
+
+    raw_fd.seek(0)
+    parquet_file = pyarrow.parquet.ParquetFile(raw_fd)
+    yield list(parquet_file.schema_arrow.names)
+
+    for batch in parquet_file.iter_batches(batch_size=PARQUET_BATCH_ROWS):
+        columns = [_arrow_strings(column) for column in batch.columns]
+        yield from map(list, zip(*columns))
@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import concurrent.futures
+import contextlib
+import functools
+import json
+import logging
+import sys
+from typing import List
+from typing import Optional
+
+import aidentified_matching_api.client as client
+import aidentified_matching_api.tracing as tracing
+
+# Every dataset, its dataset-files and optionally their delta and trigger
+# files, listed with up to concurrent_requests API calls at once and
+# written as one JSON object per line as each listing comes back. After a
+# listing's first page, its other pages are fetched at once too.
+
+logger = logging.getLogger("matching_api_cli")
+
+DAILY_FILE_ROUTES = {
+    "delta_file": "/v1/dataset-delta-file/",
+    "trigger_file": "/v1/trigger-file/",
+}
+
+
+class Inventory:
+    def __init__(
+        self,
+        matching_client: client.MatchingClient,
+        out,
+        concurrent_requests: int = 16,
+        include_deltas: bool = False,
+        include_triggers: bool = False,
+    ):
+        self.matching_client = matching_client
+        self.out = out
+        self.concurrent_requests = concurrent_requests
+        self.daily_file_types = [
+            record_type
+            for record_type, included in [
+                ("delta_file", include_deltas),
+                ("trigger_file", include_triggers),
+            ]
+            if included
+        ]
+        self.semaphore = None
+        self.executor = None
+        self.errors = 0
+
+    def _emit(self, records: List[dict]):
+        # Only ever called on the event loop, lines are never interleaved
+        for record in records:
+            self.out.write(json.dumps(record, default=str))
+            self.out.write("\n")
+        self.out.flush()
+
+    def _error(self, listing: str, exc: Exception, **names):
+        self.errors += 1
+        logger.info(f"Listing {listing} {names} failed: {exc}")
+        self._emit([{"type": "error", "listing": listing, **names, "error": str(exc)}])
+
+    async def _call(self, fn, *args, **kwargs):
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self.executor, functools.partial(fn, *args, **kwargs)
+            )
+
+    async def _get(self, url: str, **kwargs) -> dict:
+        return await self._call(
+            tracing.wrap(self.matching_client.api_call, "GET", url=url),
+            "get",
+            url,
+            **kwargs,
+        )
+
+    async def _list(self, url: str, **kwargs) -> list:
+        paged = await self._get(url, **kwargs)
+        results = list(paged["results"])
+
+        page_urls = self.matching_client.next_page_urls(url, paged)
+        if page_urls is None:
+            # Not paged by number, follow the next links one by one
+            next_url = self.matching_client.next_page_url(url, paged)
+            while next_url is not None:
+                paged = await self._get(next_url, **kwargs)
+                results.extend(paged["results"])
+                next_url = self.matching_client.next_page_url(url, paged)
+            return results
+
+        pages = await asyncio.gather(
+            *(self._get(page_url, **kwargs) for page_url in page_urls)
+        )
+        for page in pages:
+            results.extend(page["results"])
+        return results
+
+    async def _datasets(self, dataset_names: Optional[List[str]]) -> list:
+        if not dataset_names:
+            return await self._list("/v1/dataset/")
+
+        async def find(dataset_name: str) -> list:
+            resp = await self._get("/v1/dataset/", params={"name": dataset_name})
+            if resp["count"] == 0:
+                raise Exception(f"No dataset with name '{dataset_name}' found")
+            return resp["results"][:1]
+
+        datasets = []
+        for dataset_name, found in zip(
+            dataset_names,
+            await asyncio.gather(
+                *(find(dataset_name) for dataset_name in dataset_names),
+                return_exceptions=True,
+            ),
+        ):
+            if isinstance(found, Exception):
+                self._error("dataset", found, dataset_name=dataset_name)
+            else:
+                datasets.extend(found)
+        return datasets
+
+    async def _daily_files(
+        self, record_type: str, dataset_name: str, dataset_file_name: str
+    ):
+        names = {"dataset_name": dataset_name, "dataset_file_name": dataset_file_name}
+        try:
+            daily_files = await self._list(DAILY_FILE_ROUTES[record_type], params=names)
+        except Exception as e:
+            self._error(record_type, e, **names)
+            return
+
+        self._emit(
+            [{"type": record_type, **names, **daily_file} for daily_file in daily_files]
+        )
+
+    async def _dataset(self, dataset: dict):
+        dataset_name = dataset["name"]
+        try:
+            dataset_files = await self._list(
+                "/v1/dataset-file/", params={"dataset_name": dataset_name}
+            )
+        except Exception as e:
+            self._error("dataset_file", e, dataset_name=dataset_name)
+            return
+
+        self._emit(
+            [
+                {"type": "dataset_file", "dataset_name": dataset_name, **dataset_file}
+                for dataset_file in dataset_files
+            ]
+        )
+        await asyncio.gather(
+            *(
+                self._daily_files(record_type, dataset_name, dataset_file["name"])
+                for dataset_file in dataset_files
+                for record_type in self.daily_file_types
+            )
+        )
+
+    async def run(self, dataset_names: Optional[List[str]] = None) -> int:
+        """Write the inventory, returning how many listings failed."""
+        self.semaphore = asyncio.Semaphore(self.concurrent_requests)
+        # A thread for every request allowed at once, the default executor
+        # may have fewer
+        with concurrent.futures.ThreadPoolExecutor(
+            self.concurrent_requests
+        ) as self.executor:
+            try:
+                datasets = await self._datasets(dataset_names)
+            except Exception as e:
+                self._error("dataset", e)
+                return self.errors
+
+            self._emit([{"type": "dataset", **dataset} for dataset in datasets])
+            await asyncio.gather(*(self._dataset(dataset) for dataset in datasets))
+        return self.errors
+
+
+def list_inventory(args):
+    if args.output is None:
+        out = contextlib.nullcontext(sys.stdout)
+    else:
+        out = open(args.output, "w")
+
+    with out as fd:
+        inventory = Inventory(
+            client.from_args(args),
+            fd,
+            concurrent_requests=args.concurrent_requests,
+            include_deltas=args.include_deltas,
+            include_triggers=args.include_triggers,
+        )
+        errors = asyncio.run(inventory.run(args.dataset_name))
+
+    if errors:
+        return 1
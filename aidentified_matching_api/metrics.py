@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import bisect
+import contextlib
+import datetime
+import json
+import threading
+import time
+
+# Timings, counters and gauges for every phase of an operation, for
+# --metrics-file. Recording is off until enable() and costs one attribute
+# check per call while off. Executor threads record too, so updates take
+# a lock.
+
+# Upper bounds in seconds of the latency histogram buckets
+BUCKETS = [
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    25.0,
+    60.0,
+    150.0,
+    float("inf"),
+]
+
+
+class Span:
+    """What a timer yields, set nbytes when the size is only known once the
+    phase is done."""
+
+    __slots__ = ["nbytes"]
+
+    def __init__(self, nbytes: int = 0):
+        self.nbytes = nbytes
+
+
+class Timer:
+    __slots__ = ["count", "errors", "total", "min", "max", "nbytes", "buckets"]
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.min = float("inf")
+        self.max = 0.0
+        self.nbytes = 0
+        self.buckets = [0] * len(BUCKETS)
+
+    def record(self, seconds: float, nbytes: int, error: bool):
+        self.count += 1
+        self.errors += error
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.nbytes += nbytes
+        self.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def to_dict(self) -> dict:
+        timer = {
+            "count": self.count,
+            "errors": self.errors,
+            "total_seconds": self.total,
+            "min_seconds": self.min,
+            "max_seconds": self.max,
+            "mean_seconds": self.total / self.count,
+            "histogram": {
+                str(bound): count
+                for bound, count in zip(BUCKETS, self.buckets)
+                if count
+            },
+        }
+        if self.nbytes:
+            timer["bytes"] = self.nbytes
+            if self.total:
+                timer["mb_per_second"] = self.nbytes / 1024 / 1024 / self.total
+        return timer
+
+
+class Gauge:
+    __slots__ = ["count", "total", "max", "last"]
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.max = 0
+        self.last = 0
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        self.max = max(self.max, value)
+        self.last = value
+
+    def to_dict(self) -> dict:
+        return {
+            "samples": self.count,
+            "mean": self.total / self.count,
+            "max": self.max,
+            "last": self.last,
+        }
+
+
+class Metrics:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.started_at = time.time()
+        self.timers = {}
+        self.counters = {}
+        self.gauges = {}
+
+    def record(self, name: str, seconds: float, nbytes: int = 0, error=False):
+        with self.lock:
+            try:
+                timer = self.timers[name]
+            except KeyError:
+                timer = self.timers[name] = Timer()
+            timer.record(seconds, nbytes, error)
+
+    @contextlib.contextmanager
+    def timer(self, name: str, nbytes: int = 0):
+        span = Span(nbytes)
+        error = False
+        start = time.perf_counter()
+        try:
+            yield span
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, span.nbytes, error)
+
+    def add(self, name: str, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value):
+        with self.lock:
+            try:
+                gauge = self.gauges[name]
+            except KeyError:
+                gauge = self.gauges[name] = Gauge()
+            gauge.record(value)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {
+                "started_at": datetime.datetime.fromtimestamp(
+                    self.started_at, tz=datetime.timezone.utc
+                ).isoformat(),
+                "elapsed_seconds": time.time() - self.started_at,
+                "timers": {
+                    name: timer.to_dict() for name, timer in sorted(self.timers.items())
+                },
+                "counters": dict(sorted(self.counters.items())),
+                "gauges": {
+                    name: gauge.to_dict() for name, gauge in sorted(self.gauges.items())
+                },
+            }
+
+
+registry = Metrics()
+_NULL_TIMER = contextlib.nullcontext(Span())
+
+
+def enable():
+    registry.reset()
+    registry.enabled = True
+
+
+def disable():
+    registry.enabled = False
+
+
+def timer(name: str, nbytes: int = 0):
+    """Context manager timing a phase under name, nbytes is what it moved.
+    Failures count as errors of the phase."""
+    if not registry.enabled:
+        return _NULL_TIMER
+    return registry.timer(name, nbytes)
+
+
+def add(name: str, value=1):
+    if registry.enabled:
+        registry.add(name, value)
+
+
+def gauge(name: str, value):
+    if registry.enabled:
+        registry.gauge(name, value)
+
+
+def write(path: str):
+    with open(path, "w") as fd:
+        json.dump(registry.to_dict(), fd, indent=4)
+        fd.write("\n")
@@ -0,0 +1,478 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import contextlib
+import datetime
+import json
+import logging
+import os
+import time
+from typing import List
+from typing import Optional
+
+import aidentified_matching_api.client as client
+import aidentified_matching_api.constants as constants
+import aidentified_matching_api.upload as upload
+import aidentified_matching_api.validation as validation
+
+# Runs the create, upload, wait and download steps of every dataset-file in
+# a manifest in one process, one file's steps after another and the files
+# side by side. Each step finished is written to a checkpoint file and
+# skipped when the manifest is run again. The steps also check what the API
+# already has, so a run stopped between a step and its checkpoint picks up
+# from the right place too.
+
+logger = logging.getLogger("matching_api_cli")
+
+DEFAULTS = {
+    "concurrent_files": 2,
+    "concurrent_uploads": 4,
+    "upload_part_size": 100,
+    "max_upload_rate": None,
+    "poll_interval": 5.0,
+    "max_poll_interval": 300.0,
+    "wait_timeout": None,
+    "upload_grace": None,
+}
+FILE_DEFAULTS = {
+    "path": None,
+    "match_logic": "OPPORTUNISTIC",
+    "include_households": False,
+    "validate": True,
+    "csv": {},
+    "wait": True,
+    "download": None,
+    "delta": None,
+    "trigger": None,
+}
+DOWNLOAD_STEPS = ("download", "delta", "trigger")
+# The make_csv_args settings a manifest can give, as dataset-file upload's
+# --csv flags do
+CSV_OPTIONS = (
+    "encoding",
+    "delimiter",
+    "doublequotes",
+    "escapechar",
+    "quotechar",
+    "quoting",
+    "skipinitialspace",
+    "input_format",
+    "csv_engine",
+    "auto_dialect",
+)
+
+
+def _load_yaml(fd):
+    try:
+        import yaml
+    except ImportError:
+        raise Exception(
+            "YAML manifests require the PyYAML package, "
+            "install it with 'pip install aidentified-matching-api[yaml]'"
+        ) from None
+
+    return yaml.safe_load(fd)
+
+
+def load_manifest(path: str) -> dict:
+    """The manifest at path with defaults filled in and its file paths
+    relative to the manifest's directory."""
+    with open(path) as fd:
+        if path.endswith((".yaml", ".yml")):
+            manifest = _load_yaml(fd)
+        else:
+            manifest = json.load(fd)
+
+    if not isinstance(manifest, dict) or not isinstance(manifest.get("datasets"), list):
+        raise Exception(f"Manifest {path} has no list of datasets")
+
+    unknown = set(manifest) - set(DEFAULTS) - {"datasets"}
+    if unknown:
+        raise Exception(f"Unknown manifest settings: {', '.join(sorted(unknown))}")
+    manifest = {**DEFAULTS, **manifest}
+
+    base_dir = os.path.dirname(os.path.abspath(path))
+    names = set()
+    for dataset in manifest["datasets"]:
+        if "name" not in dataset:
+            raise Exception("Every dataset in the manifest needs a name")
+        files = dataset.setdefault("files", [])
+        for idx, spec in enumerate(files):
+            if "name" not in spec:
+                raise Exception(f"File {idx + 1} of {dataset['name']} needs a name")
+            unknown = set(spec) - set(FILE_DEFAULTS) - {"name"}
+            if unknown:
+                raise Exception(
+                    f"Unknown settings for {spec['name']}: "
+                    f"{', '.join(sorted(unknown))}"
+                )
+            if (dataset["name"], spec["name"]) in names:
+                raise Exception(f"{dataset['name']}/{spec['name']} is listed twice")
+            names.add((dataset["name"], spec["name"]))
+
+            spec = files[idx] = {**FILE_DEFAULTS, **spec}
+            if not isinstance(spec["csv"], dict):
+                raise Exception(f"The csv settings of {spec['name']} aren't a mapping")
+            unknown = set(spec["csv"]) - set(CSV_OPTIONS)
+            if unknown:
+                raise Exception(
+                    f"Unknown csv settings for {spec['name']}: "
+                    f"{', '.join(sorted(unknown))}"
+                )
+            for key in ("path", *DOWNLOAD_STEPS):
+                if spec[key] is not None:
+                    spec[key] = os.path.join(base_dir, spec[key])
+            if not spec["wait"] and any(spec[step] for step in DOWNLOAD_STEPS):
+                raise Exception(f"{spec['name']} can't download without waiting")
+
+    return manifest
+
+
+def file_steps(spec: dict) -> List[str]:
+    steps = ["create"]
+    if spec["path"] is not None:
+        steps.append("upload")
+    if spec["wait"]:
+        steps.append("wait")
+    steps.extend(step for step in DOWNLOAD_STEPS if spec[step] is not None)
+    return steps
+
+
+class Checkpoint:
+    """Steps finished so far, saved after each one."""
+
+    def __init__(self, path: str):
+        self.path = path
+        try:
+            with open(path) as fd:
+                self.steps = json.load(fd)["steps"]
+        except FileNotFoundError:
+            self.steps = {}
+
+    def get(self, key: str) -> Optional[dict]:
+        return self.steps.get(key)
+
+    def record(self, key: str, result: Optional[dict] = None):
+        self.steps[key] = {
+            "finished_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            "result": result,
+        }
+        # Replaced whole, a crash mid-write leaves the previous checkpoint
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as fd:
+            json.dump({"steps": self.steps}, fd, indent=4, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+class DatasetWatcher:
+    """Waits on any number of a dataset's files with one list of the
+    dataset per poll, backing off like MatchingClient.wait_for_dataset_files().
+    A file that starts waiting resets the backoff."""
+
+    def __init__(self, async_client, dataset_name: str, manifest: dict):
+        self.async_client = async_client
+        self.dataset_name = dataset_name
+        self.poll_interval = manifest["poll_interval"]
+        self.max_poll_interval = manifest["max_poll_interval"]
+        self.check = client.FinishedCheck(manifest["upload_grace"])
+        self.waiting = {}
+        self.woken = asyncio.Event()
+        self.task = None
+
+    async def wait(self, dataset_file_name: str, uploaded: bool = False) -> dict:
+        """The dataset-file once it's finished. If this run uploaded it,
+        UPLOAD_NOT_STARTED can only mean the upload was aborted."""
+        if uploaded:
+            self.check.mark_uploaded(dataset_file_name)
+        future = asyncio.get_running_loop().create_future()
+        self.waiting[dataset_file_name] = future
+        self.woken.set()
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._poll())
+        return await future
+
+    def _resolve(self, dataset_files: dict) -> bool:
+        now = time.monotonic()
+        changed = False
+        for name, future in list(self.waiting.items()):
+            if future.done():
+                # Cancelled, by a timeout
+                del self.waiting[name]
+                continue
+
+            dataset_file = dataset_files.get(name)
+            if dataset_file is None:
+                future.set_exception(
+                    Exception(f"No dataset file with name '{name}' found")
+                )
+            elif self.check.finished(dataset_file, now):
+                future.set_result(dataset_file)
+            else:
+                continue
+            del self.waiting[name]
+            changed = True
+        return changed
+
+    async def _poll(self):
+        interval = self.poll_interval
+        statuses = {}
+        while self.waiting:
+            self.woken.clear()
+            try:
+                dataset_files = {
+                    dataset_file["name"]: dataset_file
+                    for dataset_file in await self.async_client.list_dataset_files(
+                        self.dataset_name
+                    )
+                }
+            except Exception as e:
+                for future in self.waiting.values():
+                    if not future.done():
+                        future.set_exception(e)
+                self.waiting.clear()
+                return
+
+            changed = self._resolve(dataset_files)
+            for name in self.waiting:
+                status = dataset_files[name]["status"]
+                changed = changed or statuses.get(name, status) != status
+                statuses[name] = status
+            if changed:
+                interval = self.poll_interval
+
+            sleep_for = interval
+            grace_left = self.check.grace_left(self.waiting, time.monotonic())
+            if grace_left is not None:
+                # Check again as a grace period runs out
+                sleep_for = min(sleep_for, grace_left)
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self.woken.wait(), sleep_for)
+            if self.woken.is_set():
+                interval = self.poll_interval
+            else:
+                interval = min(interval * client.POLL_BACKOFF, self.max_poll_interval)
+
+
+class PipelineRun:
+    def __init__(self, matching_client, manifest: dict, checkpoint: Checkpoint):
+        self.matching_client = matching_client
+        self.async_client = client.AsyncMatchingClient(client=matching_client)
+        self.manifest = manifest
+        self.checkpoint = checkpoint
+        self.budget = upload.UploadBudget(
+            manifest["concurrent_uploads"],
+            manifest["max_upload_rate"] and manifest["max_upload_rate"] * 1024**2,
+        )
+        self.file_slots = asyncio.Semaphore(manifest["concurrent_files"])
+        self.datasets = {}
+        self.watchers = {}
+
+    def _dataset(self, dataset_name: str) -> dict:
+        resp = self.matching_client.api_call(
+            "get", "/v1/dataset/", params={"name": dataset_name}
+        )
+        if resp["count"]:
+            return resp["results"][0]
+        return self.matching_client.create_dataset(dataset_name)
+
+    async def _ensure_dataset(self, dataset_name: str):
+        # Every file of the dataset waits on the same lookup
+        if dataset_name not in self.datasets:
+            self.datasets[dataset_name] = asyncio.ensure_future(
+                self._run_step(
+                    f"{dataset_name}/create", self._create_dataset, dataset_name
+                )
+            )
+        await self.datasets[dataset_name]
+
+    async def _create_dataset(self, dataset_name: str) -> dict:
+        dataset = await asyncio.to_thread(self._dataset, dataset_name)
+        return {"dataset_id": dataset["dataset_id"]}
+
+    async def _run_step(self, key: str, fn, *args):
+        if self.checkpoint.get(key) is not None:
+            logger.info(f"Skipping {key}, done before")
+            return
+
+        logger.info(f"Starting {key}")
+        result = await fn(*args)
+        self.checkpoint.record(key, result)
+        logger.info(f"Finished {key}")
+
+    #
+    # steps
+    #
+
+    def _dataset_file(self, dataset_name: str, spec: dict) -> dict:
+        resp = self.matching_client.api_call(
+            "get",
+            "/v1/dataset-file/",
+            params={"dataset_name": dataset_name, "name": spec["name"]},
+        )
+        if resp["count"]:
+            return resp["results"][0]
+        return self.matching_client.create_dataset_file(
+            dataset_name,
+            spec["name"],
+            include_households=spec["include_households"],
+            match_logic=spec["match_logic"],
+        )
+
+    async def create(self, dataset_name: str, spec: dict) -> dict:
+        dataset_file = await asyncio.to_thread(self._dataset_file, dataset_name, spec)
+        return {"dataset_file_id": dataset_file["dataset_file_id"]}
+
+    def _open_csv_args(self, fd, spec: dict):
+        csv_options = dict(spec["csv"])
+        auto_dialect = csv_options.pop("auto_dialect", False)
+        csv_args = validation.make_csv_args(fd, **csv_options)
+        return validation.detect_csv_args(csv_args) if auto_dialect else csv_args
+
+    async def upload(self, dataset_name: str, spec: dict) -> dict:
+        create = self.checkpoint.get(f"{dataset_name}/{spec['name']}/create")
+        dataset_file_id = create["result"]["dataset_file_id"]
+        dataset_file = await asyncio.to_thread(
+            self.matching_client.api_call, "get", f"/v1/dataset-file/{dataset_file_id}/"
+        )
+        status = dataset_file["status"]
+        if status not in ("UPLOAD_NOT_STARTED", "UPLOAD_IN_PROGRESS"):
+            logger.info(f"{spec['name']} was already uploaded, it's {status}")
+            return {"status": status}
+
+        async with self.file_slots:
+            if status == "UPLOAD_IN_PROGRESS":
+                # Left over from a run that stopped partway
+                await self.async_client.abort_dataset_file(dataset_name, spec["name"])
+
+            with open(spec["path"], "rb") as fd:
+                csv_args = await asyncio.to_thread(self._open_csv_args, fd, spec)
+                resp = await self.async_client.upload_dataset_file(
+                    dataset_name,
+                    spec["name"],
+                    csv_args,
+                    validate=spec["validate"],
+                    upload_part_size=self.manifest["upload_part_size"],
+                    concurrent_uploads=self.manifest["concurrent_uploads"],
+                    budget=self.budget,
+                )
+        return {"status": resp["status"]}
+
+    async def wait(self, dataset_name: str, spec: dict) -> dict:
+        if dataset_name not in self.watchers:
+            self.watchers[dataset_name] = DatasetWatcher(
+                self.async_client, dataset_name, self.manifest
+            )
+        try:
+            dataset_file = await asyncio.wait_for(
+                self.watchers[dataset_name].wait(
+                    spec["name"], uploaded=spec["path"] is not None
+                ),
+                self.manifest["wait_timeout"],
+            )
+        except asyncio.TimeoutError:
+            raise Exception("Timed out waiting for matching") from None
+
+        if dataset_file["status"] != "MATCHING_FINISHED":
+            raise Exception(f"Dataset file is {dataset_file['status']}")
+        return {"status": dataset_file["status"]}
+
+    async def _download_to(self, path: str, fn, dataset_name: str, spec: dict):
+        # Written beside and moved into place, never left half-downloaded
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "wb") as fd:
+            await asyncio.to_thread(fn, dataset_name, spec["name"], fd)
+        os.replace(tmp_path, path)
+        return {"path": path}
+
+    async def download(self, dataset_name: str, spec: dict) -> dict:
+        return await self._download_to(
+            spec["download"],
+            self.matching_client.download_dataset_file,
+            dataset_name,
+            spec,
+        )
+
+    async def delta(self, dataset_name: str, spec: dict) -> dict:
+        return await self._download_to(
+            spec["delta"],
+            self.matching_client.download_dataset_file_delta,
+            dataset_name,
+            spec,
+        )
+
+    async def trigger(self, dataset_name: str, spec: dict) -> dict:
+        return await self._download_to(
+            spec["trigger"],
+            self.matching_client.download_dataset_trigger_file,
+            dataset_name,
+            spec,
+        )
+
+    async def run_file(self, dataset_name: str, spec: dict) -> dict:
+        summary = {
+            "dataset_name": dataset_name,
+            "dataset_file_name": spec["name"],
+            "steps_done": [],
+            "error": None,
+        }
+        step = "create dataset"
+        try:
+            await self._ensure_dataset(dataset_name)
+            for step in file_steps(spec):
+                await self._run_step(
+                    f"{dataset_name}/{spec['name']}/{step}",
+                    getattr(self, step),
+                    dataset_name,
+                    spec,
+                )
+                summary["steps_done"].append(step)
+        except Exception as e:
+            logger.info(f"{dataset_name}/{spec['name']} failed at {step}: {e}")
+            summary["error"] = f"{step}: {e}"
+        return summary
+
+    async def run(self) -> List[dict]:
+        return list(
+            await asyncio.gather(
+                *(
+                    self.run_file(dataset["name"], spec)
+                    for dataset in self.manifest["datasets"]
+                    for spec in dataset["files"]
+                )
+            )
+        )
+
+
+def run_pipeline(matching_client, manifest: dict, checkpoint: Checkpoint) -> List[dict]:
+    """Run every file's steps, returns a summary of each file: the steps
+    done and the error that stopped it."""
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(
+            PipelineRun(matching_client, manifest, checkpoint).run()
+        )
+    finally:
+        loop.close()
+
+
+def run_manifest(args):
+    manifest = load_manifest(args.manifest)
+    checkpoint = Checkpoint(args.checkpoint or f"{args.manifest}.checkpoint.json")
+
+    summaries = run_pipeline(client.from_args(args), manifest, checkpoint)
+    constants.pretty(summaries)
+
+    if any(summary["error"] is not None for summary in summaries):
+        return 1
@@ -0,0 +1,139 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import contextlib
+import cProfile
+import io
+import logging
+import pstats
+import sys
+import threading
+import tracemalloc
+from typing import Optional
+
+# --profile-cpu and --profile-memory, for running a command under cProfile
+# or tracemalloc without wrapping the CLI by hand. Validation worker
+# processes aren't profiled.
+
+logger = logging.getLogger("matching_api_cli")
+
+TRACEMALLOC_FRAMES = 25
+TOP_STATS = 50
+
+
+class CpuProfiler:
+    """cProfile for this thread and every thread started while it runs, such
+    as the executor threads of an upload.
+
+    Before Python 3.12 a profiler only sees the thread that enabled it, so
+    each new thread enables its own. From 3.12 a profiler sees every
+    thread, and only one can be enabled at a time.
+    """
+
+    def __init__(self):
+        self.profiles = []
+        self.lock = threading.Lock()
+        self.per_thread = sys.version_info < (3, 12)
+
+    def _new_profile(self) -> cProfile.Profile:
+        profile = cProfile.Profile()
+        with self.lock:
+            self.profiles.append(profile)
+        return profile
+
+    def _start_thread(self, frame, event, arg):
+        # Called on a new thread's first event, the profiler takes over.
+        sys.setprofile(None)
+        self._new_profile().enable()
+
+    def start(self):
+        if self.per_thread:
+            threading.setprofile(self._start_thread)
+        self._new_profile().enable()
+
+    def stop(self):
+        if self.per_thread:
+            threading.setprofile(None)
+        # Threads still running are idle by now, their profiles are read
+        # as they are.
+        for profile in self.profiles:
+            profile.disable()
+
+    def stats(self) -> Optional[pstats.Stats]:
+        profiles = [profile for profile in self.profiles if profile.getstats()]
+        if not profiles:
+            return None
+        return pstats.Stats(*profiles)
+
+    def write(self, path: str):
+        """pstats data to path, for pstats or snakeviz, and the top
+        functions by cumulative time to path.txt."""
+        stats = self.stats()
+        if stats is None:
+            return
+        stats.dump_stats(path)
+
+        with open(f"{path}.txt", "w") as fd:
+            stats.stream = fd
+            fd.write(f"{len(self.profiles)} threads profiled\n")
+            stats.sort_stats(pstats.SortKey.CUMULATIVE).print_stats(TOP_STATS)
+
+
+def write_memory_report(snapshot: tracemalloc.Snapshot, peak: int, path: str):
+    out = io.StringIO()
+    out.write(f"Peak traced memory: {peak / 1024 / 1024:.1f} MB\n\n")
+
+    out.write(f"Top {TOP_STATS} lines by memory allocated at the end:\n")
+    for stat in snapshot.statistics("lineno")[:TOP_STATS]:
+        out.write(f"{stat}\n")
+
+    out.write("\nTop 10 tracebacks:\n")
+    for stat in snapshot.statistics("traceback")[:10]:
+        out.write(f"\n{stat}\n")
+        for line in stat.traceback.format():
+            out.write(f"{line}\n")
+
+    with open(path, "w") as fd:
+        fd.write(out.getvalue())
+
+
+@contextlib.contextmanager
+def profile(cpu_path: Optional[str] = None, memory_path: Optional[str] = None):
+    """Profile what runs inside, writing the results when it's done, even
+    if it failed."""
+    cpu_profiler = None
+    if cpu_path is not None:
+        cpu_profiler = CpuProfiler()
+    if memory_path is not None:
+        tracemalloc.start(TRACEMALLOC_FRAMES)
+    if cpu_profiler is not None:
+        cpu_profiler.start()
+
+    try:
+        yield
+    finally:
+        if cpu_profiler is not None:
+            cpu_profiler.stop()
+
+        # Before writing the CPU profile, which allocates plenty
+        if memory_path is not None:
+            snapshot = tracemalloc.take_snapshot()
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            write_memory_report(snapshot, peak, memory_path)
+            logger.info(f"Wrote memory profile to {memory_path}")
+
+        if cpu_profiler is not None:
+            cpu_profiler.write(cpu_path)
+            logger.info(f"Wrote CPU profile to {cpu_path}")
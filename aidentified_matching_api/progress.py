@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import os
+import stat
+import threading
+import time
+from typing import Optional
+
+# Progress of the current phase (validating, uploading, downloading) for
+# --progress. Updates are counter increments from whichever thread did the
+# work, at most once a block, batch or part, and only every so often one of
+# them also writes a report: a status line rewritten in place on a
+# terminal, otherwise a JSON line.
+
+TTY_INTERVAL = 0.5
+LINE_INTERVAL = 10.0
+
+
+def _size(nbytes: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if nbytes < 1024:
+            return f"{nbytes:.1f} {unit}"
+        nbytes /= 1024
+    return f"{nbytes:.1f} TB"
+
+
+def _duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{seconds % 3600 // 60:02d}m"
+    if seconds >= 60:
+        return f"{seconds // 60}m{seconds % 60:02d}s"
+    return f"{seconds}s"
+
+
+class Progress:
+    def __init__(self):
+        self.enabled = False
+        self.stream = None
+        self.tty = False
+        self.interval = LINE_INTERVAL
+        self.lock = threading.Lock()
+        self.start("")
+
+    def start(self, phase: str, total: Optional[int] = None):
+        self.phase = phase
+        self.total = total
+        self.started_at = time.monotonic()
+        self.reported_at = self.started_at
+        self.nbytes = 0
+        self.rows = 0
+        self.parts_in_flight = 0
+        self.parts_done = 0
+        self.part_bytes = 0
+
+    def maybe_report(self):
+        if time.monotonic() - self.reported_at >= self.interval:
+            self.report()
+
+    def snapshot(self) -> dict:
+        elapsed = time.monotonic() - self.started_at
+        rate = self.nbytes / elapsed if elapsed else 0.0
+        status = {
+            "phase": self.phase,
+            "elapsed_seconds": round(elapsed, 1),
+            "bytes": self.nbytes,
+            "total_bytes": self.total,
+            "bytes_per_second": round(rate),
+            "eta_seconds": None,
+            "rows": self.rows,
+            "parts_in_flight": self.parts_in_flight,
+            "parts_done": self.parts_done,
+            "part_bytes": self.part_bytes,
+        }
+        if self.total and rate:
+            status["eta_seconds"] = round(max(self.total - self.nbytes, 0) / rate, 1)
+        return status
+
+    def _line(self, status: dict) -> str:
+        line = f"{status['phase']}: {_size(status['bytes'])}"
+        if status["total_bytes"]:
+            percent = 100 * status["bytes"] / status["total_bytes"]
+            line += f" of {_size(status['total_bytes'])} ({percent:.0f}%)"
+        line += f", {_size(status['bytes_per_second'])}/s"
+        if status["rows"]:
+            line += f", {status['rows']:,} rows"
+        if status["parts_done"] or status["parts_in_flight"]:
+            line += (
+                f", {status['parts_done']} parts done"
+                f" {status['parts_in_flight']} uploading"
+            )
+        if status["eta_seconds"] is not None:
+            line += f", ETA {_duration(status['eta_seconds'])}"
+        else:
+            line += f", {_duration(status['elapsed_seconds'])} elapsed"
+        return line
+
+    def report(self, final: bool = False):
+        with self.lock:
+            self.reported_at = time.monotonic()
+            status = self.snapshot()
+            if self.tty:
+                # \x1b[K clears what's left of a longer previous line
+                end = "\n" if final else ""
+                self.stream.write(f"\r{self._line(status)}\x1b[K{end}")
+            else:
+                status["final"] = final
+                self.stream.write(json.dumps(status) + "\n")
+            self.stream.flush()
+
+
+reporter = Progress()
+
+
+def enable(stream):
+    reporter.stream = stream
+    try:
+        reporter.tty = stream.isatty()
+    except (AttributeError, ValueError):
+        reporter.tty = False
+    reporter.interval = TTY_INTERVAL if reporter.tty else LINE_INTERVAL
+    reporter.enabled = True
+
+
+def disable():
+    reporter.enabled = False
+
+
+def start(phase: str, total: Optional[int] = None):
+    """Begin a phase, total is its size in bytes if it's known."""
+    if reporter.enabled:
+        reporter.start(phase, total)
+
+
+def finish():
+    if reporter.enabled and reporter.phase:
+        reporter.report(final=True)
+        reporter.start("")
+
+
+def advance(nbytes: int):
+    if reporter.enabled:
+        reporter.nbytes += nbytes
+        reporter.maybe_report()
+
+
+def reached(position: int):
+    """For readers that only know how far into the input they are."""
+    if reporter.enabled:
+        reporter.nbytes = position
+        reporter.maybe_report()
+
+
+def add_rows(rows: int):
+    if reporter.enabled:
+        reporter.rows += rows
+        reporter.maybe_report()
+
+
+def part_started():
+    if reporter.enabled:
+        reporter.parts_in_flight += 1
+
+
+def part_done(nbytes: int):
+    if reporter.enabled:
+        reporter.parts_in_flight -= 1
+        reporter.parts_done += 1
+        reporter.part_bytes += nbytes
+        reporter.maybe_report()
+
+
+def input_size(raw_fd) -> Optional[int]:
+    """Size of a local, uncompressed input. The bytes read from anything
+    else don't say how far along it is."""
+    try:
+        stat_result = os.fstat(raw_fd.fileno())
+    except (AttributeError, OSError, ValueError):
+        return None
+    return stat_result.st_size if stat.S_ISREG(stat_result.st_mode) else None
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import io
+
+import aidentified_matching_api.compression as compression
+
+
+# Enough to detect compression and sniff the CSV dialect of a pipe, see
+# validation.SNIFF_SAMPLE_SIZE.
+HEAD_BUFFER_SIZE = 256 * 1024
+
+
+class HeadBuffer(io.RawIOBase):
+    """Keeps the first head_size bytes read from a pipe, so it can be
+    rewound until more than that has been read.
+
+    It still says it isn't seekable, so callers know they only get one
+    full pass over it.
+    """
+
+    def __init__(self, raw_fd, head_size: int = HEAD_BUFFER_SIZE):
+        self.raw_fd = raw_fd
+        self.head_size = head_size
+        # None once more than head_size bytes have been read.
+        self._head = bytearray()
+        self._position = 0
+        self._raw_position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    def tell(self) -> int:
+        return self._position
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None:
+            size = -1
+
+        data = b""
+        if self._position < self._raw_position:
+            end = self._raw_position
+            if size >= 0:
+                end = min(end, self._position + size)
+                size -= end - self._position
+            data = bytes(self._head[self._position : end])
+            self._position = end
+            if size == 0:
+                return data
+
+        raw_data = self.raw_fd.read(size)
+        self._raw_position += len(raw_data)
+        if self._head is not None:
+            if self._raw_position <= self.head_size:
+                self._head += raw_data
+            else:
+                self._head = None
+
+        self._position += len(raw_data)
+        return data + raw_data
+
+    def readinto(self, buf) -> int:
+        data = self.read(len(buf))
+        buf[: len(data)] = data
+        return len(data)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("Can't seek from the end of a pipe")
+
+        if offset < self._raw_position and self._head is None:
+            raise io.UnsupportedOperation(
+                f"Can't rewind a pipe after reading more than {self.head_size} bytes"
+            )
+
+        self._position = min(offset, self._raw_position)
+        while self._position < offset:
+            if not self.read(offset - self._position):
+                break
+
+        return self._position
+
+
+def _seekable(raw_fd) -> bool:
+    try:
+        return raw_fd.seekable()
+    except (AttributeError, ValueError):
+        return False
+
+
+def open_input(raw_fd):
+    """raw_fd, decompressed if it's compressed, and with its start kept
+    around for rewinding if it's a pipe."""
+    if _seekable(raw_fd):
+        return compression.open_decompressed(raw_fd)
+
+    head_fd = HeadBuffer(raw_fd, HEAD_BUFFER_SIZE)
+    raw_fd = compression.open_decompressed(head_fd)
+    if raw_fd is head_fd:
+        return raw_fd
+
+    # Rewinding the decompressed data can't rewind the compressed pipe
+    # once the decompressor read past its head.
+    return HeadBuffer(raw_fd, HEAD_BUFFER_SIZE)
@@ -23,17 +23,25 @@ import appdirs
 import requests
 
 import aidentified_matching_api.constants as constants
+import aidentified_matching_api.metrics as metrics
 
 
 logger = logging.getLogger("api")
 
 
 class TokenService:
-    __slots__ = ["expires_at", "token", "cache_file"]
+    __slots__ = ["tokens", "cache_file", "session"]
 
     def __init__(self):
-        self.expires_at = 0
-        self.token = ""
+        # (token, expires_at) by the email they were issued to, one process
+        # (the daemon) can run commands for several accounts.
+        self.tokens = {}
+        # One pooled session for every API, S3 and download request so
+        # connections (and their TLS handshakes) are reused across calls.
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=32)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         dirs = appdirs.AppDirs(
             appname="aidentified_match", appauthor="Aidentified", version="1.0"
         )
@@ -43,28 +51,50 @@ class TokenService:
             dirs.user_cache_dir, f"token_cache_{endpoint_hash}"
         )
 
-    def _read_token_cache(self):
+    def _load_token_cache(self) -> dict:
         try:
             with open(self.cache_file, "rb") as fd:
                 token_cache = pickle.load(fd)
-                self.token = token_cache.get("token", "")
-                self.expires_at = token_cache.get("expires_at", 0)
         except FileNotFoundError:
-            pass
+            return {}
+
+        # Caches from before tokens were kept by email don't say whose token
+        # they hold, and aren't used.
+        return token_cache.get("tokens", {})
+
+    def _read_token_cache(self, email: str):
+        cached = self._load_token_cache().get(email)
+        if cached is not None:
+            self.tokens[email] = cached
 
-    def _write_token_cache(self):
-        cache_value = {"token": self.token, "expires_at": self.expires_at}
+    def _write_token_cache(self, email: str):
+        tokens = self._load_token_cache()
+        tokens[email] = self.tokens[email]
         with open(self.cache_file, "wb") as fd:
-            pickle.dump(cache_value, fd, protocol=pickle.HIGHEST_PROTOCOL)
+            pickle.dump({"tokens": tokens}, fd, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _token_valid(self, email: str) -> bool:
+        _, expires_at = self.tokens.get(email, ("", 0))
+        return datetime.datetime.now(tz=datetime.timezone.utc).timestamp() < expires_at
+
+    def clear_token(self):
+        self.tokens.clear()
+        try:
+            os.remove(self.cache_file)
+        except FileNotFoundError:
+            pass
 
     def get_token(self, args) -> str:
-        self._read_token_cache()
+        # Long-lived processes (the daemon) keep a valid token in memory,
+        # only go to the cache file when it's missing or expired.
+        email = args.email
+        if self._token_valid(email):
+            return self.tokens[email][0]
 
-        if (
-            datetime.datetime.now(tz=datetime.timezone.utc).timestamp()
-            < self.expires_at
-        ):
-            return self.token
+        self._read_token_cache(email)
+
+        if self._token_valid(email):
+            return self.tokens[email][0]
 
         # N.B. these are read from envvars AID_EMAIL and
         # AID_PASSWORD by default
@@ -75,9 +105,10 @@ class TokenService:
 
         logger.info("get_token /login")
         try:
-            resp = requests.post(
-                f"{constants.AIDENTIFIED_URL}/login", json=login_payload
-            )
+            with metrics.timer("token.fetch"):
+                resp = self.session.post(
+                    f"{constants.AIDENTIFIED_URL}/login", json=login_payload
+                )
         except requests.exceptions.RequestException as e:
             raise Exception(f"Unable to connect to API: {e}") from None
 
@@ -97,12 +128,10 @@ class TokenService:
             seconds=resp_payload["expires_in"]
         ) + datetime.datetime.now(tz=datetime.timezone.utc)
 
-        self.expires_at = expires_at_dt.timestamp()
-        self.token = resp_payload["bearer_token"]
-
-        self._write_token_cache()
+        self.tokens[email] = (resp_payload["bearer_token"], expires_at_dt.timestamp())
+        self._write_token_cache(email)
 
-        return self.token
+        return self.tokens[email][0]
 
     def get_auth_headers(self, args) -> dict:
         return {"Authorization": f"Bearer {self.get_token(args)}"}
@@ -140,30 +169,51 @@ class TokenService:
 
         return resp_obj
 
+    @staticmethod
+    def _page_url(url, query: str) -> str:
+        return urllib.parse.urlparse(url)._replace(query=query).geturl()
+
     def paginated_api_call(self, args, fn, url, **kwargs):
         resp = []
         fetch_url = url
-        parsed_orig_url = urllib.parse.urlparse(url)
 
         while True:
             paged = self.api_call(args, fn, fetch_url, **kwargs)
             resp.extend(paged["results"])
-            if paged["next"] is None:
+            fetch_url = self.next_page_url(url, paged)
+            if fetch_url is None:
                 break
 
-            parsed_page_url = urllib.parse.urlparse(paged["next"])
-            parsed_orig_url = parsed_orig_url._replace(query=parsed_page_url.query)
-            fetch_url = parsed_orig_url.geturl()
-
         return resp
 
+    def next_page_url(self, url, paged: dict):
+        """URL of the page of url after paged, None if paged is the last."""
+        if paged["next"] is None:
+            return None
+
+        return self._page_url(url, urllib.parse.urlparse(paged["next"]).query)
+
+    def next_page_urls(self, url, paged: dict):
+        """URLs of every page of url after paged, its first page, worked out
+        from the count and page size so they can be fetched at once. None if
+        the next link isn't paged by page number."""
+        if paged["next"] is None:
+            return []
+
+        query = urllib.parse.parse_qs(urllib.parse.urlparse(paged["next"]).query)
+        if query.get("page") != ["2"] or not paged["results"]:
+            return None
+
+        page_count = -(-paged["count"] // len(paged["results"]))
+        return [
+            self._page_url(url, urllib.parse.urlencode(dict(query, page=[page]), True))
+            for page in range(2, page_count + 1)
+        ]
+
 
 def get_token(args):
     if args.clear_cache:
-        try:
-            os.remove(token_service.cache_file)
-        except FileNotFoundError:
-            pass
+        token_service.clear_token()
 
     print(token_service.get_token(args))
 
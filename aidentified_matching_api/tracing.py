@@ -0,0 +1,168 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import contextlib
+import json
+import os
+import threading
+import time
+
+# A timeline of what every upload task and executor thread was doing, for
+# --trace-file, as Chrome trace events for chrome://tracing or Perfetto.
+# Spans on the event loop go on a track per asyncio task, the rest on a
+# track per thread. Like metrics, recording is off until enable() and costs
+# one attribute check per call while off.
+
+
+class Tracer:
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.pid = os.getpid()
+        self.started_at = time.perf_counter()
+        self.events = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": self.pid,
+                "tid": 0,
+                "args": {"name": "aidentified_match"},
+            }
+        ]
+        self.tracks = {}
+
+    def now(self) -> float:
+        """Microseconds since enable(), the trace's clock."""
+        return (time.perf_counter() - self.started_at) * 1e6
+
+    def _track(self) -> int:
+        try:
+            task = asyncio.current_task()
+        except RuntimeError:
+            task = None
+        if task is not None:
+            key = (id(task), task.get_name())
+        else:
+            thread = threading.current_thread()
+            key = (thread.ident, thread.name)
+
+        with self.lock:
+            tid = self.tracks.get(key)
+            if tid is None:
+                tid = self.tracks[key] = len(self.tracks) + 1
+                self.events.append(
+                    {
+                        "name": "thread_name",
+                        "ph": "M",
+                        "pid": self.pid,
+                        "tid": tid,
+                        "args": {"name": key[1]},
+                    }
+                )
+        return tid
+
+    def record(self, name: str, start: float, args: dict, tid=None):
+        event = {
+            "name": name,
+            "ph": "X",
+            "pid": self.pid,
+            "tid": tid or self._track(),
+            "ts": start,
+            "dur": self.now() - start,
+        }
+        if args:
+            event["args"] = args
+        with self.lock:
+            self.events.append(event)
+
+    @contextlib.contextmanager
+    def span(self, name: str, args: dict):
+        tid = self._track()
+        start = self.now()
+        try:
+            yield
+        finally:
+            self.record(name, start, args, tid)
+
+    def counter(self, name: str, value):
+        event = {
+            "name": name,
+            "ph": "C",
+            "pid": self.pid,
+            "ts": self.now(),
+            "args": {name: value},
+        }
+        with self.lock:
+            self.events.append(event)
+
+    def to_dict(self) -> dict:
+        with self.lock:
+            return {"traceEvents": list(self.events), "displayTimeUnit": "ms"}
+
+
+tracer = Tracer()
+_NULL_SPAN = contextlib.nullcontext()
+
+
+def enable():
+    tracer.reset()
+    tracer.enabled = True
+
+
+def disable():
+    tracer.enabled = False
+
+
+def now() -> float:
+    return tracer.now() if tracer.enabled else 0.0
+
+
+def span(name: str, **args):
+    """Context manager recording a span of the current task or thread."""
+    if not tracer.enabled:
+        return _NULL_SPAN
+    return tracer.span(name, args)
+
+
+def record(name: str, start: float, **args):
+    """A span from start, a now() of the same task or thread, until now."""
+    if tracer.enabled:
+        tracer.record(name, start, args)
+
+
+def counter(name: str, value):
+    if tracer.enabled:
+        tracer.counter(name, value)
+
+
+def wrap(fn, name: str, **args):
+    """fn recording a span on whichever thread calls it, for executor tasks.
+    fn itself while tracing is off."""
+    if not tracer.enabled:
+        return fn
+
+    def traced(*fn_args, **fn_kwargs):
+        with tracer.span(name, args):
+            return fn(*fn_args, **fn_kwargs)
+
+    return traced
+
+
+def write(path: str):
+    with open(path, "w") as fd:
+        json.dump(tracer.to_dict(), fd)
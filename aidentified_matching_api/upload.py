@@ -0,0 +1,705 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import base64
+import collections
+import contextlib
+import csv
+import functools
+import hashlib
+import io
+import itertools
+import logging
+from typing import List
+from typing import Optional
+
+import requests
+
+import aidentified_matching_api.arrow_csv as arrow_csv
+import aidentified_matching_api.metrics as metrics
+import aidentified_matching_api.progress as progress
+import aidentified_matching_api.tracing as tracing
+import aidentified_matching_api.validation as validation
+
+logger = logging.getLogger("matching_api_cli")
+
+
+async def file_uploader(
+    client, dataset_file_id: str, part_queue: asyncio.Queue, budget: "UploadBudget"
+):
+    while True:
+        # Waiting here is waiting on the reader
+        with tracing.span("queue get"):
+            part_idx, part_data = await part_queue.get()
+        metrics.gauge("upload.queue_depth", part_queue.qsize())
+        tracing.counter("part_queue", part_queue.qsize())
+        try:
+            async with budget.part(len(part_data)):
+                progress.part_started()
+                await _upload_part(client, dataset_file_id, part_idx, part_data, budget)
+                progress.part_done(len(part_data))
+        finally:
+            budget.release(len(part_data))
+        part_queue.task_done()
+
+
+def _md5(data: bytes) -> bytes:
+    return base64.b64encode(hashlib.md5(data).digest())
+
+
+async def _upload_part(
+    client, dataset_file_id: str, part_idx: int, part_data: bytes, budget
+):
+    with tracing.span("part", part=part_idx + 1, bytes=len(part_data)):
+        await _upload_part_stages(client, dataset_file_id, part_idx, part_data, budget)
+
+
+async def _upload_part_stages(
+    client, dataset_file_id: str, part_idx: int, part_data: bytes, budget
+):
+    loop = asyncio.get_event_loop()
+    aws_part_number = part_idx + 1
+
+    logger.info(f"Starting upload part {aws_part_number} hash")
+    with metrics.timer("upload.md5", len(part_data)), tracing.span("hash"):
+        md5 = await loop.run_in_executor(
+            None, tracing.wrap(_md5, "hash", part=aws_part_number), part_data
+        )
+
+    upload_part_payload = {
+        "dataset_file_id": dataset_file_id,
+        "part_number": aws_part_number,
+        "md5": md5.decode("UTF-8"),
+    }
+    upload_part_callable = functools.partial(
+        client.api_call,
+        "post",
+        "/v1/dataset-file-upload-part/",
+        json=upload_part_payload,
+    )
+    async with budget.api_call():
+        with metrics.timer("upload.register_part"), tracing.span("register"):
+            resp = await loop.run_in_executor(
+                None,
+                tracing.wrap(upload_part_callable, "register", part=aws_part_number),
+            )
+    upload_url = resp["upload_url"]
+    dataset_file_upload_part_id = resp["dataset_file_upload_part_id"]
+
+    logger.info(f"Starting upload part {aws_part_number} upload")
+    put_part_callable = functools.partial(
+        client.session.put,
+        upload_url,
+        data=part_data,
+        headers={"content-md5": md5},
+    )
+    with metrics.timer("upload.put", len(part_data)), tracing.span("PUT"):
+        try:
+            upload_resp = await loop.run_in_executor(
+                None, tracing.wrap(put_part_callable, "PUT", part=aws_part_number)
+            )
+        except requests.exceptions.RequestException as e:
+            raise Exception(f"Unable to upload file part: {e}") from None
+
+        try:
+            upload_resp.raise_for_status()
+        except requests.exceptions.RequestException:
+            # S3 returns XML. If it fails, let's just spew it.
+            raise Exception(
+                "Unable to upload file part: "
+                f"{upload_resp.status_code} {upload_resp.text}"
+            ) from None
+
+    patch_etag_callable = functools.partial(
+        client.api_call,
+        "patch",
+        f"/v1/dataset-file-upload-part/{dataset_file_upload_part_id}/",
+        json={"etag": upload_resp.headers["ETag"]},
+    )
+    async with budget.api_call():
+        with metrics.timer("upload.patch_etag"), tracing.span("PATCH"):
+            await loop.run_in_executor(
+                None, tracing.wrap(patch_etag_callable, "PATCH", part=aws_part_number)
+            )
+
+    metrics.add("upload.parts")
+    logger.info(f"Finished upload part {aws_part_number}")
+
+
+@contextlib.contextmanager
+def upload_abort_ctxmgr(client, dataset_file_id: str):
+    try:
+        yield
+    except:  # noqa: E722
+        client.api_call("post", f"/v1/dataset-file/{dataset_file_id}/abort-upload/")
+        raise
+
+
+SENTINEL = object()
+
+
+class UploadBudget:
+    """Limits shared by every file uploading in the process: how many parts
+    are uploading at once and, optionally, bytes per second, bytes of parts
+    held in memory and control-plane calls at once. Bandwidth is a token
+    bucket charged a whole part before it's sent, so it evens out over
+    several parts rather than within one."""
+
+    def __init__(
+        self,
+        concurrent_uploads: int,
+        bytes_per_second=None,
+        max_buffered_bytes=None,
+        concurrent_api_calls=None,
+    ):
+        self.semaphore = asyncio.Semaphore(concurrent_uploads)
+        self.bytes_per_second = bytes_per_second
+        self.tokens = bytes_per_second or 0
+        self.updated_at = None
+
+        self.max_buffered_bytes = max_buffered_bytes
+        self.buffered_bytes = 0
+        self.buffer_released = asyncio.Event()
+
+        self.api_calls = None
+        if concurrent_api_calls:
+            self.api_calls = asyncio.Semaphore(concurrent_api_calls)
+
+    async def _throttle(self, size: int):
+        if not self.bytes_per_second:
+            return
+
+        now = asyncio.get_event_loop().time()
+        if self.updated_at is not None:
+            self.tokens = min(
+                self.bytes_per_second,
+                self.tokens + (now - self.updated_at) * self.bytes_per_second,
+            )
+        self.updated_at = now
+
+        # Going into debt lets parts bigger than a second's worth through,
+        # the wait pays it back.
+        self.tokens -= size
+        if self.tokens < 0:
+            with tracing.span("throttle"):
+                await asyncio.sleep(-self.tokens / self.bytes_per_second)
+
+    @contextlib.asynccontextmanager
+    async def part(self, size: int):
+        with tracing.span("budget"):
+            await self.semaphore.acquire()
+        try:
+            await self._throttle(size)
+            yield
+        finally:
+            self.semaphore.release()
+
+    async def hold(self, size: int):
+        """Wait until a part of size bytes fits in memory, from when it's
+        built until release() once it's uploaded. A part bigger than the
+        whole budget goes when nothing else is held."""
+        if self.max_buffered_bytes is None:
+            return
+
+        with tracing.span("memory budget"):
+            while (
+                self.buffered_bytes
+                and self.buffered_bytes + size > self.max_buffered_bytes
+            ):
+                self.buffer_released.clear()
+                await self.buffer_released.wait()
+        self.buffered_bytes += size
+
+    def release(self, size: int):
+        if self.max_buffered_bytes is None:
+            return
+
+        self.buffered_bytes -= size
+        self.buffer_released.set()
+
+    @contextlib.asynccontextmanager
+    async def api_call(self):
+        if self.api_calls is None:
+            yield
+            return
+
+        with tracing.span("api budget"):
+            await self.api_calls.acquire()
+        try:
+            yield
+        finally:
+            self.api_calls.release()
+
+
+ROWS_PER_BATCH = 10_000
+
+
+def _read_batches(csv_args: validation.CsvArgs, rows=None):
+    """The header row, then lists of records a batch at a time. Arrow reads
+    them when it can, and the csv module carries on from the same record
+    when it can't."""
+    if rows is None:
+        rows = validation.read_rows(csv_args)
+        # Turning Arrow's columns back into rows for the csv writer costs
+        # about what the csv module does reading them, so only on request.
+        use_arrow = csv_args.csv_engine == "arrow" and arrow_csv.can_read(csv_args)
+    else:
+        use_arrow = False
+
+    headers = next(rows, None)
+    if headers is None:
+        return
+    yield headers
+
+    if use_arrow:
+        record_count = 0
+        try:
+            for batch in arrow_csv.row_batches(csv_args, headers):
+                yield batch
+                record_count += len(batch)
+            return
+        except arrow_csv.ArrowCsvError as e:
+            logger.info(f"Arrow couldn't read the CSV, using the csv module: {e}")
+
+        # Arrow moved the file along, start over after what it read
+        rows = validation.read_rows(csv_args)
+        next(rows)
+        collections.deque(itertools.islice(rows, record_count), maxlen=0)
+
+    while True:
+        batch = list(itertools.islice(rows, ROWS_PER_BATCH))
+        if not batch:
+            return
+        yield batch
+
+
+def _encode_rows(rows, project=None) -> bytes:
+    text_fd = io.StringIO()
+    writer = csv.writer(text_fd, quoting=csv.QUOTE_MINIMAL)
+    writer.writerows(rows if project is None else map(project, rows))
+    return text_fd.getvalue().encode("UTF-8")
+
+
+def _short_row_offset(rows, project) -> int:
+    for offset, row in enumerate(rows):
+        try:
+            project(row)
+        except IndexError:
+            return offset
+    return 0
+
+
+async def rewrite_csv(
+    csv_args: validation.CsvArgs,
+    part_size_bytes: int,
+    part_queue: Optional[asyncio.Queue],
+    shard_rows: Optional[int] = None,
+    next_part_queue=None,
+    rows=None,
+    budget: Optional[UploadBudget] = None,
+):
+    """Re-encode the CSV as UTF-8 with standard quoting and put it on
+    part_queue in parts of part_size_bytes.
+
+    With shard_rows, every shard_rows records start a new file, each with
+    the header row, with its parts put on the queue returned by awaiting
+    next_part_queue(). part_queue can be None to get the first one from
+    next_part_queue() as well.
+
+    rows is an iterator of the file's rows to use instead of reading it,
+    such as validation.validated_rows().
+
+    Every part is held in budget's memory until its uploader releases it.
+    """
+    loop = asyncio.get_event_loop()
+
+    progress.start("uploading", progress.input_size(csv_args.raw_fd))
+    # Records are read and encoded a batch at a time off the event loop.
+    batches = _read_batches(csv_args, rows)
+    read_batch = tracing.wrap(next, "read")
+    encode_rows = tracing.wrap(_encode_rows, "encode")
+    headers = await loop.run_in_executor(None, read_batch, batches, SENTINEL)
+    if headers is SENTINEL:
+        return
+
+    if part_queue is None:
+        part_queue = await next_part_queue()
+
+    project = None
+    if csv_args.projection is not None:
+        headers, source_idxes = csv_args.projection.select(headers)
+        if source_idxes is not None:
+            project = validation.row_projector(source_idxes)
+
+    header_data = _encode_rows([headers])
+    out_buf = bytearray(header_data)
+    part_idx = 0
+    shard_row_count = 0
+    record_idx = 2
+    built_at = tracing.now()
+
+    async def put_part(part_data: bytes):
+        nonlocal built_at
+        tracing.record("build", built_at, part=part_idx + 1, bytes=len(part_data))
+        if budget is not None:
+            await budget.hold(len(part_data))
+        try:
+            # Waiting here is waiting on the uploaders
+            with tracing.span("queue put", part=part_idx + 1):
+                await part_queue.put((part_idx, part_data))
+        except BaseException:
+            if budget is not None:
+                budget.release(len(part_data))
+            raise
+        built_at = tracing.now()
+
+    while True:
+        with metrics.timer("rewrite.read"), tracing.span("read"):
+            batch = await loop.run_in_executor(None, read_batch, batches, SENTINEL)
+        if batch is SENTINEL:
+            break
+
+        while batch:
+            if shard_rows is not None and shard_row_count == shard_rows:
+                logger.info(f"Putting final upload part {part_idx + 1} of shard")
+                await put_part(bytes(out_buf))
+
+                with tracing.span("next shard"):
+                    part_queue = await next_part_queue()
+                part_idx = 0
+                out_buf = bytearray(header_data)
+                shard_row_count = 0
+
+            chunk = batch
+            if shard_rows is not None:
+                chunk = batch[: shard_rows - shard_row_count]
+                shard_row_count += len(chunk)
+            batch = batch[len(chunk) :]
+
+            try:
+                with metrics.timer("rewrite.encode") as span, tracing.span("encode"):
+                    data = await loop.run_in_executor(None, encode_rows, chunk, project)
+                    span.nbytes = len(data)
+            except IndexError:
+                row_idx = record_idx + _short_row_offset(chunk, project)
+                raise Exception(
+                    f"Row {row_idx} has fewer columns than the header"
+                ) from None
+            out_buf += data
+            record_idx += len(chunk)
+            metrics.add("rewrite.rows", len(chunk))
+            progress.add_rows(len(chunk))
+
+            while len(out_buf) >= part_size_bytes:
+                logger.info(f"Putting upload part {part_idx + 1}")
+                await put_part(bytes(out_buf[:part_size_bytes]))
+                del out_buf[:part_size_bytes]
+                part_idx += 1
+
+    if len(out_buf) > 0:
+        logger.info(f"Putting final upload part {part_idx + 1}")
+        await put_part(bytes(out_buf))
+
+
+async def _wait_for_tasks(tasks):
+    """Wait for every task, or until one raises. Cancels the rest and
+    raises if any task did."""
+    # await on all tasks in case any of them raise an exception, so you
+    # can kill them all
+    done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+
+    # if pending, an exception hit us
+    for pending_fut in pending:
+        pending_fut.cancel()
+
+    had_exception = [
+        future.exception()
+        for future in done
+        if not future.cancelled() and future.exception() is not None
+    ]
+    if had_exception:
+        exc_strings = ", ".join(
+            f"Task {fut_idx}: {exc}" for fut_idx, exc in enumerate(had_exception)
+        )
+        raise Exception(f"Error(s) while uploading file: {exc_strings}")
+
+
+def _release_queued(part_queue: asyncio.Queue, budget: UploadBudget):
+    """Parts no uploader will take after a failure, so that files still
+    uploading can have their memory."""
+    while not part_queue.empty():
+        _, part_data = part_queue.get_nowait()
+        budget.release(len(part_data))
+
+
+def _start_uploaders(client, dataset_file_id, part_queue, concurrent_uploads, budget):
+    return [
+        asyncio.create_task(
+            file_uploader(client, dataset_file_id, part_queue, budget),
+            name=f"uploader {uploader_idx + 1}",
+        )
+        for uploader_idx in range(concurrent_uploads)
+    ]
+
+
+async def manage_uploads(
+    client,
+    dataset_file_id: str,
+    csv_args: validation.CsvArgs,
+    upload_part_size: int,
+    concurrent_uploads: int,
+    budget: Optional[UploadBudget] = None,
+    rows=None,
+):
+    budget = budget or UploadBudget(concurrent_uploads)
+    part_queue = asyncio.Queue(maxsize=concurrent_uploads)
+    part_size_bytes = upload_part_size * 1024 * 1024
+
+    uploader_tasks = _start_uploaders(
+        client, dataset_file_id, part_queue, concurrent_uploads, budget
+    )
+
+    async def part_queue_joiner():
+        await rewrite_csv(
+            csv_args, part_size_bytes, part_queue, rows=rows, budget=budget
+        )
+        # now that everything is queued, join() for work to finish
+        await part_queue.join()
+
+        # now that everything is done, cancel() the otherwise idle workers
+        for uploader_task in uploader_tasks:
+            uploader_task.cancel()
+
+    try:
+        await _wait_for_tasks(
+            [asyncio.create_task(part_queue_joiner(), name="reader"), *uploader_tasks]
+        )
+    except BaseException:
+        _release_queued(part_queue, budget)
+        raise
+    finally:
+        progress.finish()
+
+
+#
+# sharded uploads
+#
+
+
+class ShardUpload:
+    """One dataset-file of a sharded upload and how far it got."""
+
+    __slots__ = [
+        "dataset_file_name",
+        "dataset_file_id",
+        "status",
+        "error",
+        "part_queue",
+        "all_parts_queued",
+    ]
+
+    def __init__(self, dataset_file_name: str, part_queue: asyncio.Queue):
+        self.dataset_file_name = dataset_file_name
+        self.dataset_file_id = None
+        self.status = "CREATING"
+        self.error = None
+        self.part_queue = part_queue
+        self.all_parts_queued = asyncio.Event()
+
+    def set_status(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        logger.info(f"Shard {self.dataset_file_name}: {status}")
+
+    def to_dict(self) -> dict:
+        return {
+            "dataset_file_name": self.dataset_file_name,
+            "dataset_file_id": self.dataset_file_id,
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+def shard_name(dataset_file_name: str, shard_idx: int) -> str:
+    return f"{dataset_file_name}_{shard_idx + 1}"
+
+
+async def _upload_shard(client, shard: ShardUpload, concurrent_uploads, budget):
+    loop = asyncio.get_event_loop()
+    uploader_tasks = _start_uploaders(
+        client, shard.dataset_file_id, shard.part_queue, concurrent_uploads, budget
+    )
+
+    async def part_queue_joiner():
+        await shard.all_parts_queued.wait()
+        await shard.part_queue.join()
+
+        for uploader_task in uploader_tasks:
+            uploader_task.cancel()
+
+    try:
+        await _wait_for_tasks(
+            [asyncio.create_task(part_queue_joiner()), *uploader_tasks]
+        )
+    except Exception as e:
+        shard.error = str(e)
+        _release_queued(shard.part_queue, budget)
+        raise
+
+    await loop.run_in_executor(
+        None,
+        tracing.wrap(client._complete_upload, "complete"),
+        shard.dataset_file_id,
+    )
+    shard.set_status("COMPLETE")
+
+
+async def manage_sharded_uploads(
+    client,
+    dataset_name: str,
+    dataset_file_name: str,
+    csv_args: validation.CsvArgs,
+    shard_rows: int,
+    upload_part_size: int,
+    concurrent_uploads: int,
+    budget: Optional[UploadBudget] = None,
+    include_households: bool = False,
+    match_logic: str = "OPPORTUNISTIC",
+    rows=None,
+) -> List[ShardUpload]:
+    """Stream the CSV into dataset-files of at most shard_rows records
+    each, named dataset_file_name_1, _2 and so on, created as the file is
+    read. A shard uploads while the next one is being read, all of them
+    sharing one budget.
+
+    Returns every shard's status. When a shard fails, the shards still
+    uploading are aborted and the ones already complete are kept. Raises
+    the error instead if the file failed before any shard was created.
+    """
+    loop = asyncio.get_event_loop()
+    budget = budget or UploadBudget(concurrent_uploads)
+    part_size_bytes = upload_part_size * 1024 * 1024
+    shards = []
+    shard_tasks = []
+
+    async def next_part_queue():
+        if shards:
+            shards[-1].all_parts_queued.set()
+
+        shard = ShardUpload(
+            shard_name(dataset_file_name, len(shards)),
+            asyncio.Queue(maxsize=concurrent_uploads),
+        )
+        shards.append(shard)
+
+        dataset_file = await loop.run_in_executor(
+            None,
+            tracing.wrap(
+                functools.partial(
+                    client.create_dataset_file,
+                    dataset_name,
+                    shard.dataset_file_name,
+                    include_households=include_households,
+                    match_logic=match_logic,
+                ),
+                "create dataset-file",
+            ),
+        )
+        shard.dataset_file_id = dataset_file["dataset_file_id"]
+        await loop.run_in_executor(
+            None,
+            tracing.wrap(client.api_call, "initiate upload"),
+            "post",
+            f"/v1/dataset-file/{shard.dataset_file_id}/initiate-upload/",
+        )
+        shard.set_status("UPLOADING")
+
+        shard_task = asyncio.create_task(
+            _upload_shard(client, shard, concurrent_uploads, budget),
+            name=shard.dataset_file_name,
+        )
+        shard_task.add_done_callback(shard_done)
+        shard_tasks.append(shard_task)
+        return shard.part_queue
+
+    def shard_done(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            failed.set()
+
+    async def read_shards():
+        await rewrite_csv(
+            csv_args,
+            part_size_bytes,
+            None,
+            shard_rows=shard_rows,
+            next_part_queue=next_part_queue,
+            rows=rows,
+            budget=budget,
+        )
+        if shards:
+            shards[-1].all_parts_queued.set()
+
+    failed = asyncio.Event()
+    failed_task = asyncio.create_task(failed.wait())
+    reader_task = asyncio.create_task(read_shards(), name="reader")
+    try:
+        # A failed shard stops taking parts, which would leave the reader
+        # waiting on its queue forever.
+        await asyncio.wait(
+            [reader_task, failed_task], return_when=asyncio.FIRST_COMPLETED
+        )
+        if reader_task.done():
+            reader_task.result()
+        if shard_tasks:
+            await asyncio.wait(shard_tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in shard_tasks:
+            if task.done() and not task.cancelled() and task.exception() is not None:
+                raise task.exception()
+    except Exception as e:
+        reader_task.cancel()
+        for task in shard_tasks:
+            task.cancel()
+        for shard in shards:
+            if shard.status != "COMPLETE":
+                await _abort_shard(client, shard, f"Stopped: {e}")
+        if not shards:
+            # Failed before the first shard, no status would say so
+            raise
+    finally:
+        failed_task.cancel()
+        progress.finish()
+
+    return shards
+
+
+async def _abort_shard(client, shard: ShardUpload, stopped_error: str):
+    """The shard that failed is FAILED with its own error, the rest are
+    ABORTED with the error that stopped them."""
+    loop = asyncio.get_event_loop()
+    status = "FAILED" if shard.error else "ABORTED"
+    error = shard.error or stopped_error
+
+    if shard.status == "UPLOADING":
+        try:
+            await loop.run_in_executor(
+                None,
+                tracing.wrap(client.api_call, "abort upload"),
+                "post",
+                f"/v1/dataset-file/{shard.dataset_file_id}/abort-upload/",
+            )
+        except Exception as e:
+            error = f"{error}, then unable to abort upload: {e}"
+
+    shard.set_status(status, error)
@@ -12,12 +12,34 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import array
 import codecs
+import collections
+import concurrent.futures
 import csv
+import hashlib
 import io
+import itertools
+import json
+import logging
+import mmap
+import operator
+import os
+import re
+import stat
 from typing import List
+from typing import Optional
 
+import appdirs
+
+import aidentified_matching_api.arrow_csv as arrow_csv
 import aidentified_matching_api.constants as constants
+import aidentified_matching_api.inputs as inputs
+import aidentified_matching_api.metrics as metrics
+import aidentified_matching_api.progress as progress
+import aidentified_matching_api.stream as stream
+
+logger = logging.getLogger("matching_api_cli")
 
 # first_name - string - required
 # last_name - string - required
@@ -71,9 +93,324 @@ HEADERS_EMAIL_ONLY = {
     *[f"email_{idx}" for idx in range(1, 11)],
 }
 
+# Value checks are opt-in and only reject values the matcher can't use.
+# Empty values are left to the required header checks.
+_EMAIL_RE = re.compile(r"[^@\s]+@[^@\s]+\.[^@\s.]+")
+_PHONE_RE = re.compile(r"(?:\+?1[ .-]?)?\(?\d{3}\)?[ .-]?\d{3}[ .-]?\d{4}")
+_POSTAL_CODE_RE = re.compile(r"\d{5}(?:-?\d{4})?")
+
+STATE_CODES = {
+    "AL": "ALABAMA",
+    "AK": "ALASKA",
+    "AZ": "ARIZONA",
+    "AR": "ARKANSAS",
+    "CA": "CALIFORNIA",
+    "CO": "COLORADO",
+    "CT": "CONNECTICUT",
+    "DE": "DELAWARE",
+    "DC": "DISTRICT OF COLUMBIA",
+    "FL": "FLORIDA",
+    "GA": "GEORGIA",
+    "HI": "HAWAII",
+    "ID": "IDAHO",
+    "IL": "ILLINOIS",
+    "IN": "INDIANA",
+    "IA": "IOWA",
+    "KS": "KANSAS",
+    "KY": "KENTUCKY",
+    "LA": "LOUISIANA",
+    "ME": "MAINE",
+    "MD": "MARYLAND",
+    "MA": "MASSACHUSETTS",
+    "MI": "MICHIGAN",
+    "MN": "MINNESOTA",
+    "MS": "MISSISSIPPI",
+    "MO": "MISSOURI",
+    "MT": "MONTANA",
+    "NE": "NEBRASKA",
+    "NV": "NEVADA",
+    "NH": "NEW HAMPSHIRE",
+    "NJ": "NEW JERSEY",
+    "NM": "NEW MEXICO",
+    "NY": "NEW YORK",
+    "NC": "NORTH CAROLINA",
+    "ND": "NORTH DAKOTA",
+    "OH": "OHIO",
+    "OK": "OKLAHOMA",
+    "OR": "OREGON",
+    "PA": "PENNSYLVANIA",
+    "RI": "RHODE ISLAND",
+    "SC": "SOUTH CAROLINA",
+    "SD": "SOUTH DAKOTA",
+    "TN": "TENNESSEE",
+    "TX": "TEXAS",
+    "UT": "UTAH",
+    "VT": "VERMONT",
+    "VA": "VIRGINIA",
+    "WA": "WASHINGTON",
+    "WV": "WEST VIRGINIA",
+    "WI": "WISCONSIN",
+    "WY": "WYOMING",
+    "AS": "AMERICAN SAMOA",
+    "GU": "GUAM",
+    "MP": "NORTHERN MARIANA ISLANDS",
+    "PR": "PUERTO RICO",
+    "VI": "VIRGIN ISLANDS",
+    "AA": "ARMED FORCES AMERICAS",
+    "AE": "ARMED FORCES EUROPE",
+    "AP": "ARMED FORCES PACIFIC",
+}
+_STATES = frozenset([*STATE_CODES, *STATE_CODES.values()])
+
+
+def _is_phone(value: str) -> bool:
+    # Plain 5558675309 skips the regex, a lot cheaper than a regex call
+    return (len(value) == 10 and value.isdigit()) or bool(_PHONE_RE.fullmatch(value))
+
+
+def _is_postal_code(value: str) -> bool:
+    return (len(value) == 5 and value.isdigit()) or bool(
+        _POSTAL_CODE_RE.fullmatch(value)
+    )
+
+
+def _is_state(value: str) -> bool:
+    return value.upper() in _STATES
+
+
+VALUE_CHECKS = {
+    "email": _EMAIL_RE.fullmatch,
+    "phone": _is_phone,
+    "postal_code": _is_postal_code,
+    "state": _is_state,
+}
+
+
+def get_value_checks(headers: List[str]):
+    """(header, index, check) for every column with a value check, with the
+    checks for numbered columns such as phone_2 shared with phone."""
+    value_checks = []
+    for idx, header in enumerate(headers):
+        base_header, _, suffix = header.rpartition("_")
+        if not suffix.isdigit():
+            base_header = header
+        check = VALUE_CHECKS.get(base_header)
+        if check is not None:
+            value_checks.append((header, idx, check))
+    return value_checks
+
+
+def _template_literal(value: str) -> str:
+    # Values from the file end up in a message template
+    return value.replace("{", "{{").replace("}", "}}")
+
+
+MAX_ROWS = 500_000
+
 
 class ValidationError(Exception):
-    pass
+    def __init__(
+        self,
+        message: str,
+        row: Optional[int] = None,
+        error_type: str = "file",
+        column: Optional[str] = None,
+    ):
+        super().__init__(message)
+        self.row = row
+        self.error_type = error_type
+        self.column = column
+        # Row errors keep their message template so chunks validated on
+        # their own can be renumbered to their absolute row.
+        self.template = None
+
+    @classmethod
+    def for_row(
+        cls, template: str, row: int, error_type: str, column: Optional[str] = None
+    ):
+        exc = cls(template.format(row=row), row, error_type, column)
+        exc.template = template
+        return exc
+
+    def shifted(self, offset: int):
+        return self.for_row(
+            self.template, self.row + offset, self.error_type, self.column
+        )
+
+    def __reduce__(self):
+        # Keep the attributes when passed back from a worker process.
+        return _restore_validation_error, (
+            str(self),
+            self.row,
+            self.error_type,
+            self.column,
+            self.template,
+        )
+
+
+def _restore_validation_error(message, row, error_type, column, template):
+    exc = ValidationError(message, row, error_type, column)
+    exc.template = template
+    return exc
+
+
+def _row_limit_error():
+    return ValidationError(
+        "CSV has more than 500,000 data rows", error_type="row_limit"
+    )
+
+
+def _raise(error: ValidationError):
+    raise error
+
+
+class ErrorReport:
+    """Streams validation errors to a CSV, or JSON Lines when the path ends
+    in .jsonl, keeping per-error-type counts. Only the first max_errors are
+    written, the counts cover every error."""
+
+    FIELDS = ["row", "column", "error_type", "message"]
+
+    def __init__(self, path: str, max_errors: int):
+        self.path = path
+        self.max_errors = max_errors
+        self.counts = collections.Counter()
+        self.total = 0
+        self.jsonl = path.endswith((".jsonl", ".ndjson"))
+        self.fd = open(path, "w", encoding="UTF-8", newline="")
+        if not self.jsonl:
+            self.writer = csv.writer(self.fd)
+            self.writer.writerow(self.FIELDS)
+
+    def add(self, error: ValidationError):
+        self.counts[error.error_type] += 1
+        self.total += 1
+        if self.total > self.max_errors:
+            return
+
+        values = [error.row, error.column, error.error_type, str(error)]
+        if self.jsonl:
+            self.fd.write(json.dumps(dict(zip(self.FIELDS, values))) + "\n")
+        else:
+            self.writer.writerow(values)
+
+    def close(self):
+        self.fd.close()
+
+    def summary(self) -> str:
+        written = min(self.total, self.max_errors)
+        lines = [
+            f"Validation found {self.total} errors, "
+            f"{written} written to {self.path}:",
+            *(
+                f"  {error_type}: {count}"
+                for error_type, count in self.counts.most_common()
+            ),
+        ]
+        return "\n".join(lines)
+
+
+_DIGEST_MASK = 0xFFFF_FFFF_FFFF_FFFF
+
+
+def stable_id_digest(value: str) -> int:
+    """64-bit digest of an ID that's the same in every process."""
+    digest = hashlib.blake2b(
+        value.encode("UTF-8", "surrogatepass"), digest_size=8
+    ).digest()
+    return int.from_bytes(digest, "little")
+
+
+class CompactIdSet:
+    """Set of IDs for duplicate detection that stores 8 byte digests in an
+    open-addressing table instead of the ID strings themselves.
+
+    This keeps memory at about 16 bytes per ID however long the IDs are.
+    Two different IDs sharing a 64-bit digest would be reported as a
+    duplicate, with 500,000 IDs the odds of that are about 1 in 10^8.
+
+    The default digest is the built-in str hash, which is fast but differs
+    between processes; use stable_id_digest when digests are compared
+    across processes.
+    """
+
+    __slots__ = ["_table", "_mask", "_size", "_grow_at", "digest"]
+
+    def __init__(self, digest=hash, capacity: int = 1 << 16):
+        self.digest = digest
+        self._table = array.array("Q", bytes(8 * capacity))
+        self._mask = capacity - 1
+        self._size = 0
+        self._grow_at = capacity // 2
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value: str) -> bool:
+        """Add value, returns False if it was already in the set."""
+        return self.add_digest(self.digest(value))
+
+    def add_digest(self, digest: int) -> bool:
+        # 0 marks an empty slot
+        digest = (digest & _DIGEST_MASK) or 1
+        table = self._table
+        mask = self._mask
+        idx = digest & mask
+
+        while True:
+            slot = table[idx]
+            if slot == 0:
+                break
+            if slot == digest:
+                return False
+            idx = (idx + 1) & mask
+
+        table[idx] = digest
+        self._size += 1
+        if self._size > self._grow_at:
+            self._grow()
+
+        return True
+
+    def add_all(self, values) -> bool:
+        """Add every value, stopping at the first one already in the set.
+        Returns False if there was one. add, a column at a time."""
+        table = self._table
+        mask = self._mask
+
+        for digest in map(self.digest, values):
+            digest = (digest & _DIGEST_MASK) or 1
+            idx = digest & mask
+            while True:
+                slot = table[idx]
+                if slot == 0:
+                    break
+                if slot == digest:
+                    return False
+                idx = (idx + 1) & mask
+
+            table[idx] = digest
+            self._size += 1
+            if self._size > self._grow_at:
+                self._grow()
+                table = self._table
+                mask = self._mask
+
+        return True
+
+    def _grow(self):
+        old_table = self._table
+        capacity = len(old_table) * 2
+        table = self._table = array.array("Q", bytes(8 * capacity))
+        mask = self._mask = capacity - 1
+        self._grow_at = capacity // 2
+
+        for digest in old_table:
+            if digest:
+                idx = digest & mask
+                while table[idx]:
+                    idx = (idx + 1) & mask
+                table[idx] = digest
 
 
 class CsvArgs:
@@ -86,6 +423,9 @@ class CsvArgs:
         "quotechar",
         "quoting",
         "skipinitialspace",
+        "projection",
+        "input_format",
+        "csv_engine",
     ]
 
     def __init__(
@@ -98,6 +438,9 @@ class CsvArgs:
         quotechar: str,
         quoting: int,
         skipinitialspace: bool,
+        projection: Optional["ColumnProjection"] = None,
+        input_format: str = "csv",
+        csv_engine: str = "python",
     ):
         self.raw_fd = raw_fd
         self.codec_info = codec_info
@@ -107,140 +450,809 @@ class CsvArgs:
         self.quotechar = quotechar
         self.quoting = quoting
         self.skipinitialspace = skipinitialspace
+        self.projection = projection
+        # csv, jsonl or parquet, the dialect only applies to csv
+        self.input_format = input_format
+        # auto, python or arrow, see arrow_csv.can_read
+        self.csv_engine = csv_engine
+
+
+class ColumnProjection:
+    """Renames and drops columns as the file is read, so exports with extra
+    or differently named columns can be uploaded without rewriting them
+    first. header_map maps source header to uploaded header, drop_columns
+    are source headers. With drop_unknown, columns not in valid_headers
+    (after renaming) are dropped too."""
+
+    __slots__ = ["header_map", "drop_columns", "drop_unknown", "valid_headers"]
+
+    def __init__(
+        self,
+        header_map: Optional[dict] = None,
+        drop_columns=(),
+        drop_unknown: bool = False,
+        valid_headers=None,
+    ):
+        self.header_map = header_map or {}
+        self.drop_columns = frozenset(drop_columns)
+        self.drop_unknown = drop_unknown
+        self.valid_headers = valid_headers
+
+    def key(self) -> tuple:
+        return (
+            sorted(self.header_map.items()),
+            sorted(self.drop_columns),
+            self.drop_unknown,
+        )
+
+    def select(self, headers: List[str], valid_headers=None):
+        """Returns the projected headers and the source index of each, or
+        None for the indexes when every column is kept in place."""
+        valid_headers = valid_headers or self.valid_headers or HEADERS
+        out_headers = []
+        source_idxes = []
+
+        for idx, header in enumerate(headers):
+            if header in self.drop_columns:
+                continue
+            header = self.header_map.get(header, header)
+            if self.drop_unknown and header not in valid_headers:
+                continue
+            out_headers.append(header)
+            source_idxes.append(idx)
+
+        if len(source_idxes) == len(headers):
+            source_idxes = None
+        return out_headers, source_idxes
+
+
+def row_projector(source_idxes: List[int]):
+    """Callable picking the projected fields out of a source row."""
+    if len(source_idxes) == 1:
+        idx = source_idxes[0]
+        return lambda row: (row[idx],)
+    return operator.itemgetter(*source_idxes)
+
+
+def parse_header_map(header_maps: List[str]) -> dict:
+    header_map = {}
+    for header_mapping in header_maps:
+        source, sep, destination = header_mapping.partition("=")
+        if not sep or not source or not destination:
+            raise ValidationError(
+                f"Bad csv-header-map '{header_mapping}', expected SOURCE=DESTINATION"
+            )
+        header_map[source] = destination
+    return header_map
+
+
+class ValidationOptions:
+    """How validation runs. With a report_path every error is collected into
+    that report instead of stopping at the first one."""
+
+    __slots__ = [
+        "workers",
+        "report_path",
+        "max_errors",
+        "check_values",
+        "use_cache",
+        "max_rows",
+    ]
+
+    def __init__(
+        self,
+        workers: int = 1,
+        report_path: Optional[str] = None,
+        max_errors: int = 100_000,
+        check_values: bool = False,
+        use_cache: bool = True,
+        max_rows: Optional[int] = MAX_ROWS,
+    ):
+        self.workers = workers
+        self.report_path = report_path
+        self.max_errors = max_errors
+        self.check_values = check_values
+        self.use_cache = use_cache
+        # None for files that will be sharded
+        self.max_rows = max_rows
+
+
+READ_BLOCK_SIZE = 1024 * 1024
+
+
+def open_text(csv_args: CsvArgs):
+    """Decoded lines of the file from the start, without a UTF-8 BOM.
+
+    Local files are memory mapped and decoded a block at a time, so every
+    pass over the file reads the same page cache pages with no buffering
+    layers on top. Anything else, including decompressed files, is read in
+    blocks of the same size.
+    """
+    raw_fd = csv_args.raw_fd
+    try:
+        mapped = mmap.mmap(raw_fd.fileno(), 0, access=mmap.ACCESS_READ)
+    except (AttributeError, OSError, ValueError, io.UnsupportedOperation):
+        # Not a file, or an empty one
+        mapped = None
+
+    if mapped is not None:
+        start = 3 if mapped[:3] == codecs.BOM_UTF8 else 0
+        return _decode_lines(_mmap_blocks(mapped, start), csv_args.codec_info, start)
+
+    raw_fd.seek(0)
+    return _decode_lines(_read_blocks(raw_fd), csv_args.codec_info)
+
+
+def _mmap_blocks(mapped: mmap.mmap, start: int):
+    try:
+        with memoryview(mapped) as view:
+            for block_start in range(start, len(mapped), READ_BLOCK_SIZE):
+                with view[block_start : block_start + READ_BLOCK_SIZE] as block:
+                    progress.advance(len(block))
+                    yield block
+    finally:
+        mapped.close()
+
+
+def _read_blocks(raw_fd):
+    block = raw_fd.read(READ_BLOCK_SIZE)
+    # Python drops the BOM from UTF16/UTF32 but not UTF8
+    if block[:3] == codecs.BOM_UTF8:
+        block = block[3:]
+    while block:
+        progress.advance(len(block))
+        yield block
+        block = raw_fd.read(READ_BLOCK_SIZE)
+
+
+def _decode_lines(blocks, codec_info: codecs.CodecInfo, offset: int = 0):
+    decoder = codec_info.incrementaldecoder()
+    carry = ""
+
+    # The empty block at the end flushes the decoder.
+    for block in itertools.chain(blocks, [b""]):
+        pending = len(decoder.getstate()[0])
+        try:
+            text = decoder.decode(block, not block)
+        except UnicodeDecodeError as e:
+            # Report the offset in the file, not in the block
+            block_offset = offset - pending
+            raise UnicodeDecodeError(
+                e.encoding,
+                e.object,
+                e.start + block_offset,
+                e.end + block_offset,
+                e.reason,
+            ) from None
+        offset += len(block)
+
+        lines = (carry + text).splitlines(keepends=True)
+        # The last line is always carried over, even with its line break,
+        # in case it's a \r with the \n in the next block.
+        carry = lines.pop() if lines else ""
+        yield from lines
+
+    if carry:
+        yield carry
+
+
+def make_csv_reader(csv_args: CsvArgs, text_fd):
+    return csv.reader(
+        text_fd,
+        delimiter=csv_args.delimiter,
+        doublequote=csv_args.doublequotes,
+        escapechar=csv_args.escapechar,
+        quotechar=csv_args.quotechar,
+        quoting=csv_args.quoting,
+        skipinitialspace=csv_args.skipinitialspace,
+        strict=True,
+    )
+
+
+def read_rows(csv_args: CsvArgs):
+    """Iterator of the file's rows as lists of strings, header first, for
+    any input_format."""
+    if csv_args.input_format == "jsonl":
+        return inputs.JsonlReader(open_text(csv_args))
+    if csv_args.input_format == "parquet":
+        return inputs.parquet_rows(csv_args.raw_fd)
+    return make_csv_reader(csv_args, open_text(csv_args))
 
 
 def _csv_read(csv_reader, record_idx):
     try:
         return next(csv_reader)
     except csv.Error as e:
-        raise ValidationError(f"Bad CSV format in row {record_idx}: {e}") from None
+        raise ValidationError.for_row(
+            f"Bad CSV format in row {{row}}: {e}", record_idx, "csv_format"
+        ) from None
+    except inputs.InputFormatError as e:
+        raise ValidationError.for_row(
+            f"Bad record in row {{row}}: {e}", record_idx, "csv_format"
+        ) from None
     except UnicodeError as e:
-        raise ValidationError(f"Bad character encoding at byte {e.start}") from None
+        raise _encoding_error(e.start) from None
 
 
-def validate(args, match_logic) -> CsvArgs:
+def _encoding_error(byte: int) -> ValidationError:
+    exc = ValidationError(
+        f"Bad character encoding at byte {byte}", error_type="encoding"
+    )
+    exc.byte = byte
+    return exc
+
+
+def make_csv_args(
+    raw_fd: io.BytesIO,
+    encoding: str = "UTF-8",
+    delimiter: str = csv.excel.delimiter,
+    doublequotes: bool = csv.excel.doublequote,
+    escapechar: str = csv.excel.escapechar,
+    quotechar: str = csv.excel.quotechar,
+    quoting: str = "minimal",
+    skipinitialspace: bool = csv.excel.skipinitialspace,
+    projection: Optional[ColumnProjection] = None,
+    input_format: str = "auto",
+    csv_engine: str = "auto",
+) -> CsvArgs:
     # Validate choice of csv encoding, even if they don't do
     # the rest of the validation.
     try:
-        codec_info = codecs.lookup(args.csv_encoding)
+        codec_info = codecs.lookup(encoding)
     except LookupError:
-        raise ValidationError(f"Unknown csv-encoding '{args.csv_encoding}'") from None
+        raise ValidationError(f"Unknown csv-encoding '{encoding}'") from None
 
-    csv_args = CsvArgs(
-        args.dataset_file_path,
+    if input_format not in inputs.INPUT_FORMATS:
+        raise ValidationError(f"Unknown input-format '{input_format}'")
+    arrow_csv.check_engine(csv_engine)
+
+    raw_fd = stream.open_input(raw_fd)
+    if input_format == "auto":
+        input_format = inputs.detect_format(raw_fd)
+
+    return CsvArgs(
+        raw_fd,
         codec_info,
+        delimiter,
+        doublequotes,
+        escapechar,
+        quotechar,
+        constants.QUOTE_METHODS[quoting],
+        skipinitialspace,
+        projection,
+        input_format,
+        csv_engine,
+    )
+
+
+def projection_from_args(args) -> Optional[ColumnProjection]:
+    if not (args.csv_header_map or args.csv_drop_column or args.csv_drop_unknown):
+        return None
+
+    return ColumnProjection(
+        parse_header_map(args.csv_header_map or []),
+        args.csv_drop_column or (),
+        args.csv_drop_unknown,
+    )
+
+
+def csv_args_from_args(args) -> CsvArgs:
+    csv_args = make_csv_args(
+        args.dataset_file_path,
+        args.csv_encoding,
         args.csv_delimiter,
         args.csv_no_doublequotes,
         args.csv_escapechar,
         args.csv_quotechar,
-        constants.QUOTE_METHODS[args.csv_quoting],
+        args.csv_quoting,
         args.csv_skip_initial_space,
+        projection_from_args(args),
+        args.input_format,
+        args.csv_engine,
     )
+    if args.auto_dialect:
+        csv_args = detect_csv_args(csv_args)
+    return csv_args
+
+
+#
+# dialect detection
+#
+
+SNIFF_SAMPLE_SIZE = 64 * 1024
+SNIFF_DELIMITERS = ",\t;|"
+
+# UTF-32 LE starts with the UTF-16 LE BOM, so it's checked first. Python
+# drops the BOM for these, the UTF-8 one is skipped by the readers.
+_BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32"),
+    (codecs.BOM_UTF32_BE, "utf-32"),
+    (codecs.BOM_UTF16_LE, "utf-16"),
+    (codecs.BOM_UTF16_BE, "utf-16"),
+    (codecs.BOM_UTF8, "utf-8"),
+]
+
+
+def _detect_encoding(sample: bytes, at_eof: bool) -> str:
+    for bom, encoding in _BOMS:
+        if sample.startswith(bom):
+            return encoding
 
-    if not args.validate:
+    try:
+        # The sample can end partway through a character
+        codecs.getincrementaldecoder("utf-8")().decode(sample, at_eof)
+        return "utf-8"
+    except UnicodeDecodeError:
+        pass
+
+    try:
+        import charset_normalizer
+    except ImportError:
+        raise ValidationError(
+            "Unable to detect csv-encoding, install charset-normalizer or pass --csv-encoding"
+        ) from None
+
+    match = charset_normalizer.from_bytes(sample).best()
+    if match is None:
+        raise ValidationError("Unable to detect csv-encoding")
+    return match.encoding
+
+
+def detect_csv_args(csv_args: CsvArgs) -> CsvArgs:
+    """Fill in the encoding, delimiter, quotechar and skipinitialspace from
+    the first SNIFF_SAMPLE_SIZE bytes of the file, keeping the rest of
+    csv_args."""
+    if csv_args.input_format == "parquet":
         return csv_args
 
+    raw_fd = csv_args.raw_fd
+    sample = raw_fd.read(SNIFF_SAMPLE_SIZE)
+    at_eof = len(sample) < SNIFF_SAMPLE_SIZE
+    raw_fd.seek(0)
+
+    encoding = _detect_encoding(sample, at_eof)
+    codec_info = codecs.lookup(encoding)
+    text = codec_info.incrementaldecoder(errors="replace").decode(sample, at_eof)
+    if not at_eof:
+        # Don't let the sniffer see a partial record
+        text = text[: text.rfind("\n") + 1] or text
+
+    delimiter = csv_args.delimiter
+    quotechar = csv_args.quotechar
+    skipinitialspace = csv_args.skipinitialspace
+    try:
+        dialect = csv.Sniffer().sniff(text, delimiters=SNIFF_DELIMITERS)
+    except csv.Error:
+        # Usually a single column, nothing to split on
+        logger.info("Unable to detect CSV delimiter, using the csv arguments")
+    else:
+        delimiter = dialect.delimiter
+        quotechar = dialect.quotechar
+        skipinitialspace = dialect.skipinitialspace
+
+    logger.info(
+        f"Detected csv-encoding {codec_info.name}, delimiter {delimiter!r}, "
+        f"quotechar {quotechar!r}"
+    )
+
+    return CsvArgs(
+        raw_fd,
+        codec_info,
+        delimiter,
+        csv_args.doublequotes,
+        csv_args.escapechar,
+        quotechar,
+        csv_args.quoting,
+        skipinitialspace,
+        csv_args.projection,
+        csv_args.input_format,
+        csv_args.csv_engine,
+    )
+
+
+def validation_options_from_args(args) -> ValidationOptions:
+    return ValidationOptions(
+        workers=args.validate_workers,
+        report_path=args.validation_report,
+        max_errors=args.validation_report_limit,
+        check_values=args.validate_values,
+        use_cache=not args.revalidate,
+    )
+
+
+def get_validator_class(match_logic: str):
     if match_logic == "OPPORTUNISTIC":
-        validator = OpportunisticCsvValidator(csv_args)
+        return OpportunisticCsvValidator
     elif match_logic == "ADDRESS":
-        validator = AddressCsvValidator(csv_args)
+        return AddressCsvValidator
     elif match_logic == "EMAIL":
-        validator = EmailCsvValidator(csv_args)
+        return EmailCsvValidator
+    else:
+        raise ValidationError(f"Unknown match_logic '{match_logic}'")
+
+
+def validate_csv(
+    csv_args: CsvArgs,
+    match_logic: str,
+    options: Optional[ValidationOptions] = None,
+):
+    options = options or ValidationOptions()
+    validator_class = get_validator_class(match_logic)
+
+    cache_key = None
+    if options.use_cache:
+        cache_key = validation_cache_key(csv_args, match_logic, options)
+    # A report was asked for, so it has to be written even for a known file.
+    if (
+        cache_key is not None
+        and options.report_path is None
+        and _validation_cached(cache_key)
+    ):
+        logger.info("File unchanged since it last passed validation, skipping")
+        metrics.add("validation.cached")
+        csv_args.raw_fd.seek(0)
+        return
+
+    if options.report_path is None:
+        fail = _raise
+        report = None
     else:
-        raise ValidationError(f"Unknown match_logic '{args.match_logic}'")
+        report = ErrorReport(options.report_path, options.max_errors)
+        fail = report.add
 
-    validator.validate()
+    if options.workers > 1 and can_validate_in_parallel(csv_args):
+        validator = ParallelCsvValidator(csv_args, validator_class, options.workers)
+    else:
+        validator = validator_class(csv_args)
+    validator.fail = fail
+    validator.check_values = options.check_values
+    validator.max_rows = options.max_rows
+
+    progress.start("validating", progress.input_size(csv_args.raw_fd))
+    try:
+        with metrics.timer("validation"):
+            validator.validate()
+    except ValidationError as e:
+        if report is None:
+            raise
+        # Header and encoding errors stop validation even when collecting.
+        report.add(e)
+    finally:
+        progress.finish()
+        if report is not None:
+            report.close()
+
+    if report is not None and report.total:
+        raise ValidationError(report.summary())
+
+    if cache_key is not None:
+        _cache_validation(cache_key)
+
+    # Pipes can't be read again anyway
+    if csv_args.raw_fd.seekable():
+        csv_args.raw_fd.seek(0)
+
+
+def validated_rows(
+    csv_args: CsvArgs,
+    match_logic: str,
+    options: Optional[ValidationOptions] = None,
+):
+    """The header row and then the records of the file, validated as they
+    are read, for input that can only be read once.
+
+    Fails like validate_csv, but only once the bad row (or with a report,
+    the end of the file) is reached, after the rows before it were used.
+    """
+    options = options or ValidationOptions()
+    validator = get_validator_class(match_logic)(csv_args)
+    validator.check_values = options.check_values
+    validator.max_rows = options.max_rows
 
-    args.dataset_file_path.seek(0)
+    report = None
+    if options.report_path is not None:
+        report = ErrorReport(options.report_path, options.max_errors)
+        validator.fail = report.add
+
+    try:
+        yield validator.read_headers()
+        yield from validator.checked_records(2)
+    except ValidationError as e:
+        if report is None:
+            raise
+        report.add(e)
+    finally:
+        if report is not None:
+            report.close()
+
+    if report is not None and report.total:
+        raise ValidationError(report.summary())
+
+
+def validate(args, match_logic) -> CsvArgs:
+    csv_args = csv_args_from_args(args)
+
+    if args.validate:
+        validate_csv(csv_args, match_logic, validation_options_from_args(args))
 
     return csv_args
 
 
+#
+# validation cache
+#
+
+# Bump when validation rules change so files that passed the old rules are
+# checked again.
+VALIDATION_CACHE_VERSION = 1
+VALIDATION_CACHE_ENTRIES = 500
+FINGERPRINT_BLOCK_SIZE = 64 * 1024
+FINGERPRINT_SAMPLES = 16
+
+
+def get_validation_cache_dir() -> str:
+    dirs = appdirs.AppDirs(
+        appname="aidentified_match", appauthor="Aidentified", version="1.0"
+    )
+    cache_dir = os.path.join(dirs.user_cache_dir, "validation")
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def file_fingerprint(raw_fd) -> Optional[str]:
+    """Hash of a regular file's size, mtime and evenly spaced sample blocks,
+    or None for pipes and in-memory files. Reads at most 1 MB. Compressed
+    files are fingerprinted by their compressed bytes."""
+    raw_fd = getattr(raw_fd, "compressed_fd", raw_fd)
+    try:
+        st = os.fstat(raw_fd.fileno())
+    except (AttributeError, OSError, io.UnsupportedOperation):
+        return None
+    if not stat.S_ISREG(st.st_mode):
+        return None
+
+    size = st.st_size
+    fingerprint = hashlib.blake2b(f"{size}:{st.st_mtime_ns}".encode(), digest_size=16)
+    if size <= FINGERPRINT_BLOCK_SIZE * FINGERPRINT_SAMPLES:
+        offsets = range(0, size, FINGERPRINT_BLOCK_SIZE)
+    else:
+        last_offset = size - FINGERPRINT_BLOCK_SIZE
+        offsets = [
+            idx * last_offset // (FINGERPRINT_SAMPLES - 1)
+            for idx in range(FINGERPRINT_SAMPLES)
+        ]
+
+    # A decompressor may be part way through the file.
+    position = raw_fd.tell()
+    for offset in offsets:
+        raw_fd.seek(offset)
+        fingerprint.update(raw_fd.read(FINGERPRINT_BLOCK_SIZE))
+    raw_fd.seek(position)
+
+    return fingerprint.hexdigest()
+
+
+def validation_cache_key(
+    csv_args: CsvArgs, match_logic: str, options: ValidationOptions
+) -> Optional[str]:
+    fingerprint = file_fingerprint(csv_args.raw_fd)
+    if fingerprint is None:
+        return None
+
+    key = (
+        VALIDATION_CACHE_VERSION,
+        fingerprint,
+        csv_args.codec_info.name,
+        csv_args.delimiter,
+        csv_args.doublequotes,
+        csv_args.escapechar,
+        csv_args.quotechar,
+        csv_args.quoting,
+        csv_args.skipinitialspace,
+        match_logic,
+        options.check_values,
+        options.max_rows,
+        None if csv_args.projection is None else csv_args.projection.key(),
+        csv_args.input_format,
+    )
+    return hashlib.blake2b(repr(key).encode(), digest_size=16).hexdigest()
+
+
+def _validation_cached(cache_key: str) -> bool:
+    return os.path.exists(os.path.join(get_validation_cache_dir(), cache_key))
+
+
+def _cache_validation(cache_key: str):
+    # Only passing files are cached, a failing file is usually fixed (and so
+    # changed) before it's run again.
+    try:
+        cache_dir = get_validation_cache_dir()
+        with open(os.path.join(cache_dir, cache_key), "w"):
+            pass
+
+        entries = os.listdir(cache_dir)
+        if len(entries) > VALIDATION_CACHE_ENTRIES:
+            entries = [os.path.join(cache_dir, entry) for entry in entries]
+            entries.sort(key=os.path.getmtime)
+            for entry in entries[:-VALIDATION_CACHE_ENTRIES]:
+                os.remove(entry)
+    except OSError as e:
+        logger.info(f"Unable to cache validation result: {e}")
+
+
 class CsvValidator:
     valid_headers: List[str]
     required_headers: List[str]
+    max_rows: Optional[int] = MAX_ROWS
 
     def __init__(self, csv_args: CsvArgs):
-        potential_bom = csv_args.raw_fd.read(3)
-        # Python drops the BOM from UTF16/UTF32 but not UTF8
-        if potential_bom == codecs.BOM_UTF8:
-            skip_len = 3
-        else:
-            skip_len = 0
-        csv_args.raw_fd.seek(0)
-        csv_args.raw_fd.read(skip_len)
-
-        text_fd = csv_args.codec_info.streamreader(csv_args.raw_fd)
-
-        csv_reader = csv.reader(
-            text_fd,
-            delimiter=csv_args.delimiter,
-            doublequote=csv_args.doublequotes,
-            escapechar=csv_args.escapechar,
-            quotechar=csv_args.quotechar,
-            quoting=csv_args.quoting,
-            skipinitialspace=csv_args.skipinitialspace,
-            strict=True,
-        )
-
-        self.csv_reader = csv_reader
+        self.csv_args = csv_args
+        self.csv_reader = read_rows(csv_args)
+        self.projection = csv_args.projection
         self.required_header_idxes = []
+        self.record_len = 0
+        self.id_idx = None
+        self.id_uniqueness = CompactIdSet()
+        self.headers = None
+        # Called with each row error. Raising stops validation, collecting
+        # carries on with the next row.
+        self.fail = _raise
+        self.check_values = False
+        self.value_checks = []
+        self.records_read = 0
 
     def validate(self):
         """Raises ValidationError when stuff goes wrong"""
-        record_idx = 1
+        self.read_headers()
+
+        if arrow_csv.can_read(self.csv_args):
+            if arrow_csv.records_valid(self, self.csv_args):
+                return
+            # Arrow moved the file along and saw some of the IDs, start over
+            # after the header
+            progress.reached(0)
+            self.id_uniqueness = CompactIdSet(digest=self.id_uniqueness.digest)
+            self.csv_reader = read_rows(self.csv_args)
+            next(self.csv_reader)
 
+        self.validate_records(2)
+
+    def read_headers(self) -> List[str]:
         try:
-            headers = _csv_read(self.csv_reader, record_idx)
+            headers = _csv_read(self.csv_reader, 1)
         except StopIteration:
-            raise ValidationError("No headers in file") from None
+            raise ValidationError("No headers in file", error_type="header") from None
+
+        self.validate_headers(headers)
+        self.headers = headers
+        return headers
+
+    def validate_headers(self, headers: List[str]):
+        # Records are checked as they are in the file, the projection only
+        # changes which headers are checked and where their values are.
+        self.record_len = len(headers)
+        source_idxes = None
+        if self.projection is not None:
+            headers, source_idxes = self.projection.select(headers, self.valid_headers)
 
         for header in headers:
             if header not in self.valid_headers:
-                raise ValidationError(f"Invalid header '{header}'")
+                raise ValidationError(
+                    f"Invalid header '{header}'", error_type="header", column=header
+                )
 
         self.validate_extra_attr_headers(headers)
 
-        record_len = len(headers)
-
         try:
-            id_idx = headers.index("id")
+            self.id_idx = headers.index("id")
         except ValueError:
-            id_idx = None
-        id_uniqueness = set()
+            self.id_idx = None
 
         self.calculate_required_header_idxes(headers)
 
-        record_idx += 1
+        if self.check_values:
+            self.value_checks = get_value_checks(headers)
+
+        if source_idxes is not None:
+            if self.id_idx is not None:
+                self.id_idx = source_idxes[self.id_idx]
+            self.required_header_idxes = [
+                (header, source_idxes[idx])
+                for header, idx in self.required_header_idxes
+            ]
+            self.value_checks = [
+                (header, source_idxes[idx], check)
+                for header, idx, check in self.value_checks
+            ]
+
+    def validate_records(self, record_idx: int) -> int:
+        """Validate the rest of the records, numbering them from record_idx.
+        Returns the number of records read."""
+        collections.deque(self.checked_records(record_idx), maxlen=0)
+        return self.records_read
+
+    def checked_records(self, record_idx: int):
+        """Validate the rest of the records, numbering them from record_idx,
+        and yield the ones with the right number of columns as they are
+        checked. Sets records_read at the end."""
+        first_record_idx = record_idx
+        max_record_idx = None if self.max_rows is None else self.max_rows + 1
+        record_len = self.record_len
+        id_idx = self.id_idx
+        id_uniqueness = self.id_uniqueness
+        required_header_idxes = self.required_header_idxes
+        value_checks = self.value_checks
+        fail = self.fail
 
         while True:
             try:
                 record = _csv_read(self.csv_reader, record_idx)
             except StopIteration:
                 break
+            except ValidationError as e:
+                if e.error_type != "csv_format":
+                    raise
+                # The reader drops the rest of the bad line, so a collecting
+                # pass can carry on from the next one.
+                fail(e)
+                record_idx += 1
+                continue
 
-            if record_idx > 500_001:
-                raise ValidationError("CSV has more than 500,000 data rows")
+            if max_record_idx is not None and record_idx > max_record_idx:
+                fail(_row_limit_error())
+                max_record_idx = None
 
             if len(record) != record_len:
-                raise ValidationError(f"Row {record_idx} does not match header length")
+                fail(
+                    ValidationError.for_row(
+                        "Row {row} does not match header length",
+                        record_idx,
+                        "row_length",
+                    )
+                )
+                record_idx += 1
+                continue
 
             if id_idx is not None:
                 cust_id = record[id_idx]
-                if cust_id in id_uniqueness:
-                    raise ValidationError(
-                        f"Row {record_idx} has duplicate id '{cust_id}'"
+                if not id_uniqueness.add(cust_id):
+                    fail(
+                        ValidationError.for_row(
+                            f"Row {{row}} has duplicate id '{_template_literal(cust_id)}'",
+                            record_idx,
+                            "duplicate_id",
+                            "id",
+                        )
                     )
-                id_uniqueness.add(cust_id)
 
-            for required_header, required_header_idx in self.required_header_idxes:
+            for required_header, required_header_idx in required_header_idxes:
                 if not record[required_header_idx]:
-                    raise ValidationError(
-                        f"Row {record_idx} has invalid value for {required_header}"
+                    fail(
+                        ValidationError.for_row(
+                            f"Row {{row}} has invalid value for {required_header}",
+                            record_idx,
+                            "required_value",
+                            required_header,
+                        )
                     )
 
+            for header, idx, check in value_checks:
+                value = record[idx]
+                if value and not check(value):
+                    fail(
+                        ValidationError.for_row(
+                            f"Row {{row}} has malformed {header} '{_template_literal(value)}'",
+                            record_idx,
+                            "malformed_value",
+                            header,
+                        )
+                    )
+
+            yield record
             record_idx += 1
 
+        self.records_read = record_idx - first_record_idx
+
     def validate_extra_attr_headers(self, headers: List[str]):
         sentinel = object()
         if (
@@ -254,13 +1266,18 @@ class CsvValidator:
             )
             is sentinel
         ):
-            raise ValidationError("Needs at least one of the extra attribute headers")
+            raise ValidationError(
+                "Needs at least one of the extra attribute headers",
+                error_type="header",
+            )
 
     def calculate_required_header_idxes(self, headers: List[str]):
         for required_header in self.required_headers:
             if required_header not in headers:
                 raise ValidationError(
-                    f"Required header {required_header} not in headers"
+                    f"Required header {required_header} not in headers",
+                    error_type="header",
+                    column=required_header,
                 )
 
             self.required_header_idxes.append(
@@ -295,4 +1312,329 @@ class EmailCsvValidator(CsvValidator):
                 return
 
         if not self.required_header_idxes:
-            raise ValidationError("Required header email_N not in headers")
+            raise ValidationError(
+                "Required header email_N not in headers", error_type="header"
+            )
+
+
+#
+# parallel validation
+#
+
+# Encodings where a newline or quote byte can be part of another character,
+# or that carry state across lines. Everything else can be split on record
+# boundaries found by scanning raw bytes, and each piece decoded on its own.
+_UNSPLITTABLE_CODECS = ("utf-16", "utf-32", "utf-7", "iso2022", "hz")
+PARALLEL_BLOCK_SIZE = 1024 * 1024
+PARALLEL_MAX_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def can_validate_in_parallel(csv_args: CsvArgs) -> bool:
+    if csv_args.input_format != "csv":
+        return False
+
+    path = getattr(csv_args.raw_fd, "name", None)
+    if not isinstance(path, str) or not os.path.isfile(path):
+        return False
+
+    codec_name = csv_args.codec_info.name
+    if codec_name.startswith(_UNSPLITTABLE_CODECS):
+        return False
+
+    probe = "\n" + (csv_args.quotechar or "")
+    try:
+        return probe.encode(codec_name) == probe.encode("ascii")
+    except UnicodeError:
+        return False
+
+
+def _find_record_starts(raw_fd, start: int, target_size: int, quote, limit=None):
+    """Offsets of record starts at least target_size bytes apart.
+
+    A newline only ends a record when an even number of quote bytes precede
+    it. That's a guess for files with stray quotes inside unquoted fields,
+    but a wrong guess always leaves a piece ending inside a quoted field,
+    which the strict csv reader reports, so it can't go unnoticed.
+    """
+    offsets = []
+    raw_fd.seek(start)
+    pos = start
+    in_quotes = 0
+    next_target = start + target_size
+
+    while limit is None or len(offsets) < limit:
+        block = raw_fd.read(PARALLEL_BLOCK_SIZE)
+        if not block:
+            break
+
+        search_idx = max(next_target - pos, 0)
+        while search_idx < len(block):
+            newline_idx = block.find(b"\n", search_idx)
+            if newline_idx == -1:
+                break
+
+            if quote is not None and in_quotes ^ (
+                block.count(quote, 0, newline_idx) & 1
+            ):
+                search_idx = newline_idx + 1
+                continue
+
+            offsets.append(pos + newline_idx + 1)
+            if limit is not None and len(offsets) >= limit:
+                break
+            next_target = pos + newline_idx + 1 + target_size
+            search_idx = next_target - pos
+
+        if quote is not None:
+            in_quotes ^= block.count(quote) & 1
+        pos += len(block)
+
+    return offsets
+
+
+class _RecordingIdSet(CompactIdSet):
+    """Also keeps every digest in row order, to be merged across chunks."""
+
+    __slots__ = ["digests"]
+
+    def __init__(self):
+        super().__init__(digest=stable_id_digest)
+        self.digests = array.array("Q")
+
+    def add(self, value: str) -> bool:
+        digest = self.digest(value)
+        self.digests.append(digest)
+        return self.add_digest(digest)
+
+
+def _chunk_validator(path, start, end, dialect, validator_class):
+    with open(path, "rb") as fd:
+        fd.seek(start)
+        chunk_fd = io.BytesIO(fd.read(end - start))
+
+    encoding, *dialect_args = dialect
+    return validator_class(CsvArgs(chunk_fd, codecs.lookup(encoding), *dialect_args))
+
+
+def _validate_chunk(
+    path, start, end, dialect, validator_class, headers, collect, check_values
+):
+    validator = _chunk_validator(path, start, end, dialect, validator_class)
+    # Row limits and cross-chunk uniqueness are checked when merging.
+    validator.max_rows = None
+    validator.check_values = check_values
+    validator.validate_headers(headers)
+    validator.id_uniqueness = ids = _RecordingIdSet()
+    errors = []
+    record_count = 0
+    if collect:
+        validator.fail = errors.append
+
+    try:
+        record_count = validator.validate_records(1)
+    except ValidationError as e:
+        # Nothing after the failing row was checked. The failing row's own
+        # digest stays unless it was the duplicate, the row can still
+        # duplicate an earlier chunk's id, which a serial pass reports first.
+        if not collect and e.row is not None:
+            keep = e.row - 1 if e.error_type == "duplicate_id" else e.row
+            del ids.digests[keep:]
+        if e.error_type == "encoding":
+            # Decoded from the start of the chunk, not of the file
+            e = _encoding_error(e.byte + start)
+        errors.append(e)
+
+    return record_count, ids.digests, errors
+
+
+class ParallelCsvValidator:
+    """Validates record-aligned byte ranges of a local file in a process
+    pool, then merges the per-chunk results in file order so errors are
+    the same ones, with the same absolute row numbers, as a serial pass."""
+
+    def __init__(self, csv_args: CsvArgs, validator_class, workers: int):
+        self.csv_args = csv_args
+        self.validator_class = validator_class
+        self.workers = workers
+        self.headers = None
+        self.id_idx = None
+        self.fail = _raise
+        self.check_values = False
+        self.max_rows = validator_class.max_rows
+
+    def _serial(self):
+        self.csv_args.raw_fd.seek(0)
+        validator = self.validator_class(self.csv_args)
+        validator.fail = self.fail
+        validator.check_values = self.check_values
+        validator.max_rows = self.max_rows
+        validator.validate()
+
+    def _limit_exceeded(self, row: Optional[int]) -> bool:
+        max_rows = self.max_rows
+        return max_rows is not None and row is not None and row > max_rows + 1
+
+    def validate(self):
+        csv_args = self.csv_args
+        raw_fd = csv_args.raw_fd
+        size = os.fstat(raw_fd.fileno()).st_size
+
+        raw_fd.seek(0)
+        start = 3 if raw_fd.read(3) == codecs.BOM_UTF8 else 0
+        if csv_args.quoting == csv.QUOTE_NONE:
+            quote = None
+        else:
+            quote = csv_args.quotechar.encode(csv_args.codec_info.name)
+
+        header_end = _find_record_starts(raw_fd, start, 0, quote, limit=1)
+        if not header_end:
+            return self._serial()
+        header_end = header_end[0]
+
+        target_size = (size - header_end) // (self.workers * 4)
+        target_size = max(
+            min(target_size, PARALLEL_MAX_CHUNK_SIZE), PARALLEL_BLOCK_SIZE
+        )
+        starts = [
+            header_end,
+            *_find_record_starts(raw_fd, header_end, target_size, quote),
+        ]
+        chunks = [(a, b) for a, b in zip(starts, starts[1:] + [size]) if a < b]
+        if len(chunks) < 2:
+            return self._serial()
+
+        raw_fd.seek(start)
+        header_args = CsvArgs(
+            io.BytesIO(raw_fd.read(header_end - start)),
+            *self._dialect(csv_args),
+        )
+        header_validator = self.validator_class(header_args)
+        try:
+            header_validator.validate()
+        except ValidationError as e:
+            if e.template is not None:
+                # A quoted newline in the header, let the serial pass sort it
+                return self._serial()
+            raise
+
+        self.headers = header_validator.headers
+        self.id_idx = header_validator.id_idx
+        dialect = (csv_args.codec_info.name, *self._dialect(csv_args)[1:])
+        chunks = [
+            (raw_fd.name, chunk_start, chunk_end, dialect)
+            for chunk_start, chunk_end in chunks
+        ]
+        collect = self.fail is not _raise
+        with concurrent.futures.ProcessPoolExecutor(self.workers) as executor:
+            futures = [
+                executor.submit(
+                    _validate_chunk,
+                    *chunk,
+                    self.validator_class,
+                    self.headers,
+                    collect,
+                    self.check_values,
+                )
+                for chunk in chunks
+            ]
+            try:
+                results = (
+                    (chunk, future.result()) for chunk, future in zip(chunks, futures)
+                )
+                if collect:
+                    # Nothing can be reported until it's known that no chunk
+                    # needs the serial fallback.
+                    results = list(results)
+                    if any(
+                        _has_csv_format_error(errors) for _, (_, _, errors) in results
+                    ):
+                        return self._serial()
+                self._merge(results)
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    @staticmethod
+    def _dialect(csv_args: CsvArgs):
+        return (
+            csv_args.codec_info,
+            csv_args.delimiter,
+            csv_args.doublequotes,
+            csv_args.escapechar,
+            csv_args.quotechar,
+            csv_args.quoting,
+            csv_args.skipinitialspace,
+            csv_args.projection,
+        )
+
+    def _chunk_id(self, chunk, local_row: int) -> str:
+        validator = _chunk_validator(*chunk[:4], self.validator_class)
+        for _ in range(local_row):
+            record = next(validator.csv_reader)
+        return record[self.id_idx]
+
+    def _merge(self, results):
+        seen_ids = CompactIdSet(digest=stable_id_digest)
+        fail = self.fail
+        limit_reported = False
+        # Row 1 is the header
+        row_offset = 1
+
+        for chunk, (record_count, digests, errors) in results:
+            if _has_csv_format_error(errors):
+                # May just be a chunk boundary in the wrong place.
+                return self._serial()
+
+            # Rows with the wrong length never got as far as the id check,
+            # so they have no digest.
+            skipped_rows = sorted(e.row for e in errors if e.error_type == "row_length")
+            local_duplicate_rows = {
+                e.row for e in errors if e.error_type == "duplicate_id"
+            }
+            skip_idx = 0
+            for digest_idx, digest in enumerate(digests):
+                if seen_ids.add_digest(digest):
+                    continue
+                while (
+                    skip_idx < len(skipped_rows)
+                    and skipped_rows[skip_idx] <= digest_idx + 1 + skip_idx
+                ):
+                    skip_idx += 1
+                local_row = digest_idx + 1 + skip_idx
+                if local_row in local_duplicate_rows:
+                    continue
+                cust_id = self._chunk_id(chunk, local_row)
+                errors.append(
+                    ValidationError.for_row(
+                        f"Row {{row}} has duplicate id '{_template_literal(cust_id)}'",
+                        local_row,
+                        "duplicate_id",
+                        "id",
+                    )
+                )
+
+            # File order, errors without a row stop validation so go last.
+            errors.sort(
+                key=lambda e: (
+                    e.row is None,
+                    e.row or 0,
+                    e.error_type != "duplicate_id",
+                )
+            )
+            for error in errors:
+                if error.row is None:
+                    raise error
+                error = error.shifted(row_offset)
+                if not limit_reported and self._limit_exceeded(error.row):
+                    fail(_row_limit_error())
+                    limit_reported = True
+                fail(error)
+
+            row_offset += record_count
+
+        if not limit_reported and self._limit_exceeded(row_offset):
+            fail(_row_limit_error())
+
+
+def _has_csv_format_error(errors) -> bool:
+    return any(e.error_type == "csv_format" for e in errors)
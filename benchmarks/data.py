@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Synthetic dataset-file CSVs for the benchmarks."""
+import csv
+import random
+
+HEADERS = [
+    "first_name",
+    "last_name",
+    "id",
+    "city",
+    "state",
+    "postal_code",
+    "email_1",
+    "phone_1",
+]
+
+FIRST_NAMES = ["James", "Mary", "José", "Zoë", "Wei", "Aoife", "O'Neil", "Li"]
+LAST_NAMES = ["Smith", "Müller", "García", "Nguyen", "O'Brien", "Kowalski"]
+CITIES = ["Boston", "Omaha", "Washington, DC", "San José", 'The "Big" Apple']
+STATES = ["MA", "NE", "DC", "CA", "NY"]
+
+
+# Columns for each match logic
+SCHEMAS = {
+    "OPPORTUNISTIC": HEADERS,
+    "ADDRESS": ["id", "street_address_1", "street_address_2", "postal_code", "city"],
+    "EMAIL": ["id", "email", "email_1", "email_2"],
+}
+
+STREETS = ["Main St", "Elm Street", "Avenue of the Americas", "Rue de l'Église"]
+
+
+def records(rows: int, seed: int = 0, headers=HEADERS):
+    rng = random.Random(seed)
+    for idx in range(rows):
+        first_name = rng.choice(FIRST_NAMES)
+        email = f"{first_name.lower()}{idx}@example.com"
+        values = {
+            "first_name": first_name,
+            "last_name": rng.choice(LAST_NAMES),
+            "id": str(idx),
+            "street_address_1": f"{rng.randrange(1, 10000)} {rng.choice(STREETS)}",
+            "street_address_2": rng.choice(["", "", f"Apt {rng.randrange(100)}"]),
+            "city": rng.choice(CITIES),
+            "state": rng.choice(STATES),
+            "postal_code": f"{rng.randrange(100000):05d}",
+            "email": email,
+            "email_1": email,
+            "email_2": rng.choice(["", f"{idx}@example.org"]),
+            "phone_1": f"555{rng.randrange(10000000):07d}",
+        }
+        yield [values[header] for header in headers]
+
+
+def write_csv(
+    path: str,
+    rows: int,
+    encoding: str = "UTF-8",
+    delimiter: str = ",",
+    quoting: int = csv.QUOTE_MINIMAL,
+    seed: int = 0,
+    match_logic: str = "OPPORTUNISTIC",
+):
+    """A CSV of rows records after the header, with the columns for
+    match_logic, the same every time for the same arguments."""
+    headers = SCHEMAS[match_logic]
+    with open(path, "w", encoding=encoding, newline="") as fd:
+        writer = csv.writer(fd, delimiter=delimiter, quoting=quoting)
+        writer.writerow(headers)
+        writer.writerows(records(rows, seed, headers))
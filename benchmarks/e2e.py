@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""End-to-end upload and download throughput against the fake API.
+
+    python -m benchmarks.e2e --rows 100000 500000 --part-sizes 5 20 \\
+        --concurrency 1 4 --object-store-bandwidth 20
+
+Every upload and download runs in its own process, so peak RSS is that of
+one operation and nothing is shared between runs. The fake API and object
+store run in this process.
+"""
+import argparse
+import itertools
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import uuid
+
+import benchmarks.data as data
+import benchmarks.fake_api as fake_api
+
+DATASET_NAME = "benchmark"
+
+
+def _peak_rss_bytes() -> int:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def run_operation(spec: dict) -> dict:
+    """Runs one upload or download in this process, AIDENTIFIED_URL has to
+    point at the fake API before the package is imported."""
+    import time
+
+    import aidentified_matching_api.validation as validation
+    from aidentified_matching_api.client import MatchingClient
+
+    client = MatchingClient("benchmark@example.com", "benchmark")
+    if spec["operation"] == "upload":
+        try:
+            client.get_dataset_id(DATASET_NAME)
+        except Exception:
+            client.create_dataset(DATASET_NAME)
+        client.create_dataset_file(DATASET_NAME, spec["dataset_file_name"])
+
+        start = time.perf_counter()
+        with open(spec["path"], "rb") as fd:
+            client.upload_dataset_file(
+                DATASET_NAME,
+                spec["dataset_file_name"],
+                fd,
+                validate=spec["validate"],
+                upload_part_size=spec["part_size"],
+                concurrent_uploads=spec["concurrency"],
+                validation_options=validation.ValidationOptions(use_cache=False),
+            )
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(spec["path"])
+    else:
+        start = time.perf_counter()
+        with open(spec["path"], "wb") as fd:
+            client.download_dataset_file(DATASET_NAME, spec["dataset_file_name"], fd)
+        elapsed = time.perf_counter() - start
+        size = os.path.getsize(spec["path"])
+
+    return {"seconds": elapsed, "bytes": size, "peak_rss": _peak_rss_bytes()}
+
+
+def _run_child(spec: dict, env: dict) -> dict:
+    proc = subprocess.run(
+        [sys.executable, "-m", "benchmarks.e2e", "--child", json.dumps(spec)],
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    if proc.returncode != 0:
+        error = (proc.stderr.strip().splitlines() or ["failed"])[-1]
+        return {"error": error}
+    return json.loads(proc.stdout.strip().splitlines()[-1])
+
+
+def _summarize(spec: dict, runs: list) -> dict:
+    result = {
+        key: spec[key]
+        for key in ("operation", "rows", "part_size", "concurrency")
+        if key in spec
+    }
+    errors = [run["error"] for run in runs if "error" in run]
+    runs = [run for run in runs if "error" not in run]
+    if errors:
+        result["errors"] = errors
+    if runs:
+        seconds = statistics.median(run["seconds"] for run in runs)
+        size = runs[0]["bytes"]
+        result.update(
+            {
+                "mb": size / 1024 / 1024,
+                "seconds": seconds,
+                "mb_per_second": size / 1024 / 1024 / seconds,
+                "peak_rss_mb": max(run["peak_rss"] for run in runs) / 1024 / 1024,
+            }
+        )
+    return result
+
+
+def _print_result(result: dict):
+    if "seconds" not in result:
+        print(
+            f"{result['operation']:8} {result['rows']:>9,} failed: {result['errors']}"
+        )
+        return
+    print(
+        f"{result['operation']:8} {result['rows']:>9,} {result['mb']:>8.1f}"
+        f" {result.get('part_size', ''):>8} {result.get('concurrency', ''):>5}"
+        f" {result['seconds']:>8.2f} {result['mb_per_second']:>8.1f}"
+        f" {result['peak_rss_mb']:>8.1f}"
+        + (f"  {len(result['errors'])} failed" if "errors" in result else "")
+    )
+
+
+def run(args) -> list:
+    api_faults = fake_api.Faults(latency=args.api_latency)
+    object_store_faults = fake_api.Faults(
+        latency=args.object_store_latency,
+        bandwidth=args.object_store_bandwidth and args.object_store_bandwidth * 1e6,
+        error_rate=args.error_rate,
+        seed=0,
+    )
+
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir, fake_api.FakeMatchingApi(
+        api_faults, object_store_faults
+    ) as api:
+        env = dict(
+            os.environ,
+            AIDENTIFIED_URL=api.api_url,
+            # Token cache and validation cache
+            XDG_CACHE_HOME=os.path.join(tmp_dir, "cache"),
+            PYTHONPATH=os.pathsep.join(
+                filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])
+            ),
+        )
+
+        print(
+            f"{'':8} {'rows':>9} {'MB':>8} {'part MB':>8} {'conc':>5}"
+            f" {'seconds':>8} {'MB/s':>8} {'RSS MB':>8}"
+        )
+        for rows in args.rows:
+            path = os.path.join(tmp_dir, f"input_{rows}.csv")
+            data.write_csv(path, rows)
+
+            dataset_file_name = None
+            for part_size, concurrency in itertools.product(
+                args.part_sizes, args.concurrency
+            ):
+                spec = {
+                    "operation": "upload",
+                    "rows": rows,
+                    "part_size": part_size,
+                    "concurrency": concurrency,
+                    "path": path,
+                    "validate": args.validate,
+                }
+                runs = []
+                for _ in range(args.repeat):
+                    dataset_file_name = spec["dataset_file_name"] = uuid.uuid4().hex
+                    runs.append(_run_child(spec, env))
+                results.append(_summarize(spec, runs))
+                _print_result(results[-1])
+
+            spec = {
+                "operation": "download",
+                "rows": rows,
+                "path": os.path.join(tmp_dir, "output.csv"),
+                "dataset_file_name": dataset_file_name,
+            }
+            runs = [_run_child(spec, env) for _ in range(args.repeat)]
+            results.append(_summarize(spec, runs))
+            _print_result(results[-1])
+
+    return results
+
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument(
+    "--rows", help="File sizes in rows", nargs="+", type=int, default=[100_000]
+)
+parser.add_argument(
+    "--part-sizes", help="Upload part sizes in MB", nargs="+", type=int, default=[5]
+)
+parser.add_argument(
+    "--concurrency",
+    help="Concurrent part uploads",
+    nargs="+",
+    type=int,
+    default=[1, 4],
+)
+parser.add_argument(
+    "--repeat", help="Runs of each, the median is kept", type=int, default=3
+)
+parser.add_argument(
+    "--no-validate", help="Skip validation", dest="validate", action="store_false"
+)
+parser.add_argument(
+    "--api-latency", help="Seconds added to each API call", type=float, default=0.0
+)
+parser.add_argument(
+    "--object-store-latency",
+    help="Seconds added to each object store request",
+    type=float,
+    default=0.0,
+)
+parser.add_argument(
+    "--object-store-bandwidth",
+    help="MB/s of each object store request",
+    type=float,
+)
+parser.add_argument(
+    "--error-rate",
+    help="Fraction of object store requests that fail with a 503",
+    type=float,
+    default=0.0,
+)
+parser.add_argument("--json", help="Write the results to this file as JSON")
+parser.add_argument("--child", help=argparse.SUPPRESS)
+
+
+def main():
+    args = parser.parse_args()
+    if args.child is not None:
+        print(json.dumps(run_operation(json.loads(args.child))))
+        return
+
+    results = run(args)
+    if args.json:
+        with open(args.json, "w") as fd:
+            json.dump(results, fd, indent=4)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Local stand-in for the matching API and the S3-style object store.
+
+Only what the CLI uses is implemented, state is kept in memory. Latency,
+bandwidth and error rate are configurable per server so benchmarks can
+model a slow control plane or a lossy object store.
+"""
+import base64
+import hashlib
+import http.server
+import json
+import random
+import re
+import threading
+import time
+import urllib.parse
+import uuid
+
+
+class Faults:
+    __slots__ = ["latency", "bandwidth", "error_rate", "rng"]
+
+    def __init__(self, latency=0.0, bandwidth=None, error_rate=0.0, seed=None):
+        # seconds per request, bytes per second per request, 0..1
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.error_rate = error_rate
+        self.rng = random.Random(seed)
+
+    def delay(self, nbytes=0):
+        wait = self.latency
+        if self.bandwidth and nbytes:
+            wait += nbytes / self.bandwidth
+        if wait:
+            time.sleep(wait)
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self.rng.random() < self.error_rate
+
+
+class State:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.datasets = {}
+        self.dataset_files = {}
+        self.upload_parts = {}
+        self.objects = {}
+        self.counters = {}
+
+    def count(self, name):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + 1
+
+
+def _now():
+    return time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime())
+
+
+class _Handler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self) -> State:
+        return self.server.state
+
+    @property
+    def faults(self) -> Faults:
+        return self.server.faults
+
+    def _body(self) -> bytes:
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send(self, status, payload=None, headers=None, raw=None):
+        if raw is None:
+            raw = b"" if payload is None else json.dumps(payload).encode("UTF-8")
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def _dispatch(self, method):
+        parsed = urllib.parse.urlparse(self.path)
+        query = dict(urllib.parse.parse_qsl(parsed.query))
+        body = self._body()
+        self.state.count(f"{method} {re.sub(r'[0-9a-f-]{36}', '<id>', parsed.path)}")
+
+        self.faults.delay(len(body))
+        if self.faults.should_fail():
+            self._send(503, {"detail": "injected failure"})
+            return
+
+        for pattern, handler in self.server.routes:
+            if pattern[0] != method:
+                continue
+            match = re.fullmatch(pattern[1], parsed.path)
+            if match:
+                handler(self, query, body, *match.groups())
+                return
+
+        self._send(404, {"detail": f"No route {method} {parsed.path}"})
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def do_PATCH(self):
+        self._dispatch("PATCH")
+
+    def do_DELETE(self):
+        self._dispatch("DELETE")
+
+
+def _paginate(handler, query, results):
+    page_size = handler.server.page_size
+    if handler.server.cursor_pages:
+        start = int(query.get("cursor", 0))
+    else:
+        start = (int(query.get("page", 1)) - 1) * page_size
+    next_url = None
+    if start + page_size < len(results):
+        if handler.server.cursor_pages:
+            next_query = dict(query, cursor=start + page_size)
+        else:
+            next_query = dict(query, page=start // page_size + 2)
+        next_url = f"{handler.server.url}{urllib.parse.urlparse(handler.path).path}?{urllib.parse.urlencode(next_query)}"
+    return {
+        "count": len(results),
+        "next": next_url,
+        "results": results[start : start + page_size],
+    }
+
+
+#
+# matching API routes
+#
+
+
+def login(handler, query, body):
+    handler._send(200, {"bearer_token": uuid.uuid4().hex, "expires_in": 3600})
+
+
+def list_datasets(handler, query, body):
+    results = [
+        ds
+        for ds in handler.state.datasets.values()
+        if "name" not in query or ds["name"] == query["name"]
+    ]
+    handler._send(200, _paginate(handler, query, results))
+
+
+def create_dataset(handler, query, body):
+    payload = json.loads(body)
+    dataset = {
+        "dataset_id": str(uuid.uuid4()),
+        "name": payload["name"],
+        "created_date": _now(),
+    }
+    handler.state.datasets[dataset["dataset_id"]] = dataset
+    handler._send(201, dataset)
+
+
+def delete_dataset(handler, query, body, dataset_id):
+    handler.state.datasets.pop(dataset_id, None)
+    for dataset_file_id, dataset_file in list(handler.state.dataset_files.items()):
+        if dataset_file["dataset_id"] == dataset_id:
+            del handler.state.dataset_files[dataset_file_id]
+    handler._send(204)
+
+
+def _public_dataset_file(dataset_file):
+    return {k: v for k, v in dataset_file.items() if not k.startswith("_")}
+
+
+def list_dataset_files(handler, query, body):
+    datasets = handler.state.datasets
+    results = [
+        _public_dataset_file(df)
+        for df in handler.state.dataset_files.values()
+        if (
+            "dataset_name" not in query
+            or datasets[df["dataset_id"]]["name"] == query["dataset_name"]
+        )
+        and ("name" not in query or df["name"] == query["name"])
+    ]
+    handler._send(200, _paginate(handler, query, results))
+
+
+def create_dataset_file(handler, query, body):
+    payload = json.loads(body)
+    dataset_file = {
+        "dataset_file_id": str(uuid.uuid4()),
+        "dataset_id": payload["dataset_id"],
+        "name": payload["name"],
+        "match_logic": payload.get("match_logic", "OPPORTUNISTIC"),
+        "include_households": payload.get("include_households", False),
+        "status": "UPLOAD_NOT_STARTED",
+        "download_url": None,
+        "created_date": _now(),
+        "modified_date": _now(),
+        "_parts": {},
+    }
+    handler.state.dataset_files[dataset_file["dataset_file_id"]] = dataset_file
+    handler._send(201, _public_dataset_file(dataset_file))
+
+
+def get_dataset_file(handler, query, body, dataset_file_id):
+    try:
+        dataset_file = handler.state.dataset_files[dataset_file_id]
+    except KeyError:
+        handler._send(404, {"detail": "Not found"})
+        return
+    handler._send(200, _public_dataset_file(dataset_file))
+
+
+def delete_dataset_file(handler, query, body, dataset_file_id):
+    handler.state.dataset_files.pop(dataset_file_id, None)
+    handler._send(204)
+
+
+def _set_status(dataset_file, status):
+    dataset_file["status"] = status
+    dataset_file["modified_date"] = _now()
+
+
+def initiate_upload(handler, query, body, dataset_file_id):
+    dataset_file = handler.state.dataset_files[dataset_file_id]
+    if dataset_file["status"] != "UPLOAD_NOT_STARTED":
+        handler._send(400, {"detail": f"Bad status {dataset_file['status']}"})
+        return
+    _set_status(dataset_file, "UPLOAD_IN_PROGRESS")
+    handler._send(200, _public_dataset_file(dataset_file))
+
+
+def complete_upload(handler, query, body, dataset_file_id):
+    state = handler.state
+    dataset_file = state.dataset_files[dataset_file_id]
+    parts = dataset_file["_parts"]
+    if any(part.get("etag") is None for part in parts.values()):
+        handler._send(400, {"detail": "Upload parts missing etags"})
+        return
+
+    data = b"".join(state.objects[parts[number]["key"]] for number in sorted(parts))
+    key = f"matched/{dataset_file_id}"
+    state.objects[key] = data
+    dataset_file["download_url"] = f"{handler.server.object_store_url}/{key}"
+    _set_status(dataset_file, handler.server.complete_status)
+    handler._send(200, _public_dataset_file(dataset_file))
+
+
+def abort_upload(handler, query, body, dataset_file_id):
+    dataset_file = handler.state.dataset_files[dataset_file_id]
+    dataset_file["_parts"] = {}
+    _set_status(dataset_file, "UPLOAD_NOT_STARTED")
+    handler._send(200, _public_dataset_file(dataset_file))
+
+
+def create_upload_part(handler, query, body):
+    payload = json.loads(body)
+    dataset_file = handler.state.dataset_files[payload["dataset_file_id"]]
+    part_id = str(uuid.uuid4())
+    key = f"parts/{part_id}"
+    part = {
+        "dataset_file_upload_part_id": part_id,
+        "key": key,
+        "md5": payload["md5"],
+        "etag": None,
+    }
+    dataset_file["_parts"][payload["part_number"]] = part
+    handler.state.upload_parts[part_id] = part
+    handler._send(
+        201,
+        {
+            "dataset_file_upload_part_id": part_id,
+            "upload_url": f"{handler.server.object_store_url}/{key}",
+        },
+    )
+
+
+def patch_upload_part(handler, query, body, part_id):
+    part = handler.state.upload_parts[part_id]
+    part["etag"] = json.loads(body)["etag"]
+    handler._send(200, {"dataset_file_upload_part_id": part_id})
+
+
+def _daily_file(route):
+    def handler_fn(handler, query, body):
+        state = handler.state
+        key = f"{route}/{query.get('dataset_name')}/{query.get('dataset_file_name')}"
+        state.objects.setdefault(key, b"id,first_name\n")
+        handler._send(
+            200,
+            {
+                "file_date": time.strftime("%Y-%m-%d"),
+                "download_url": f"{handler.server.object_store_url}/{key}",
+                "count": 1,
+                "next": None,
+                "results": [{"file_date": time.strftime("%Y-%m-%d")}],
+            },
+        )
+
+    return handler_fn
+
+
+UUID = r"([0-9a-f-]{36})"
+
+API_ROUTES = [
+    (("POST", r"/login"), login),
+    (("GET", r"/v1/dataset/"), list_datasets),
+    (("POST", r"/v1/dataset/"), create_dataset),
+    (("DELETE", rf"/v1/dataset/{UUID}/"), delete_dataset),
+    (("GET", r"/v1/dataset-file/"), list_dataset_files),
+    (("POST", r"/v1/dataset-file/"), create_dataset_file),
+    (("GET", rf"/v1/dataset-file/{UUID}/"), get_dataset_file),
+    (("DELETE", rf"/v1/dataset-file/{UUID}/"), delete_dataset_file),
+    (("POST", rf"/v1/dataset-file/{UUID}/initiate-upload/"), initiate_upload),
+    (("POST", rf"/v1/dataset-file/{UUID}/complete-upload/"), complete_upload),
+    (("POST", rf"/v1/dataset-file/{UUID}/abort-upload/"), abort_upload),
+    (("POST", r"/v1/dataset-file-upload-part/"), create_upload_part),
+    (("PATCH", rf"/v1/dataset-file-upload-part/{UUID}/"), patch_upload_part),
+    (("GET", r"/v1/dataset-delta-file/"), _daily_file("delta")),
+    (("GET", r"/v1/trigger-file/"), _daily_file("trigger")),
+]
+
+#
+# object store routes
+#
+
+
+def put_object(handler, query, body, key):
+    md5 = handler.headers.get("content-md5")
+    digest = hashlib.md5(body).digest()
+    if md5 is not None and base64.b64decode(md5) != digest:
+        handler._send(400, raw=b"<Error><Code>BadDigest</Code></Error>")
+        return
+    handler.state.objects[key] = body
+    handler._send(200, headers={"ETag": f'"{digest.hex()}"'}, raw=b"")
+
+
+def get_object(handler, query, body, key):
+    try:
+        data = handler.state.objects[key]
+    except KeyError:
+        handler._send(404, raw=b"<Error><Code>NoSuchKey</Code></Error>")
+        return
+    handler.faults.delay(len(data))
+    handler._send(200, headers={"Content-Type": "text/csv"}, raw=data)
+
+
+OBJECT_ROUTES = [
+    (("PUT", r"/(.+)"), put_object),
+    (("GET", r"/(.+)"), get_object),
+]
+
+
+class _Server(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, routes, state, faults, **attrs):
+        super().__init__(("127.0.0.1", 0), _Handler)
+        self.routes = routes
+        self.state = state
+        self.faults = faults
+        self.url = f"http://127.0.0.1:{self.server_address[1]}"
+        for key, value in attrs.items():
+            setattr(self, key, value)
+
+
+class FakeMatchingApi:
+    """Runs a fake matching API and object store on ephemeral ports.
+
+    Use as a context manager, then point the CLI at ``api_url`` (the
+    AIDENTIFIED_URL environment variable, or constants.AIDENTIFIED_URL).
+    complete_status is the status a dataset-file lands in after
+    complete-upload, MATCHING_FINISHED makes the uploaded file downloadable
+    straight away. With cursor_pages, list pages link to the next by an
+    offset cursor rather than a page number.
+    """
+
+    def __init__(
+        self,
+        api_faults=None,
+        object_store_faults=None,
+        page_size=100,
+        complete_status="MATCHING_FINISHED",
+        cursor_pages=False,
+    ):
+        self.state = State()
+        self.object_store = _Server(
+            OBJECT_ROUTES, self.state, object_store_faults or Faults()
+        )
+        self.api = _Server(
+            API_ROUTES,
+            self.state,
+            api_faults or Faults(),
+            object_store_url=self.object_store.url,
+            page_size=page_size,
+            complete_status=complete_status,
+            cursor_pages=cursor_pages,
+        )
+        self._threads = []
+
+    @property
+    def api_url(self) -> str:
+        return self.api.url
+
+    def __enter__(self):
+        for server in (self.api, self.object_store):
+            thread = threading.Thread(target=server.serve_forever, daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def __exit__(self, *exc_info):
+        for server in (self.api, self.object_store):
+            server.shutdown()
+            server.server_close()
+        for thread in self._threads:
+            thread.join()
@@ -0,0 +1,360 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Microbenchmarks for validation and CSV rewriting.
+
+    python -m benchmarks.micro --rows 10000 500000 --compare
+
+Each case runs on a synthetic file and the fastest of --repeat runs is
+kept, the others only differ by noise. One more run under tracemalloc
+measures peak allocations, which doesn't see what Arrow allocates in C++.
+
+--save-baselines stores the results in benchmarks/baselines.json and
+--compare reports the change from them, exiting 1 when a case got slower
+by more than --tolerance. Baselines only mean something on the machine
+that made them: the checked-in ones all come from a single Linux x86-64
+machine with Python 3.11 and pyarrow, so save your own before comparing.
+"""
+import argparse
+import asyncio
+import fnmatch
+import functools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import aidentified_matching_api.arrow_csv as arrow_csv
+import aidentified_matching_api.constants as constants
+import aidentified_matching_api.metrics as metrics
+import aidentified_matching_api.tracing as tracing
+import aidentified_matching_api.upload as upload
+import aidentified_matching_api.validation as validation
+import benchmarks.data as data
+
+BASELINES_PATH = os.path.join(os.path.dirname(__file__), "baselines.json")
+
+DIALECTS = {
+    "utf-8": {"encoding": "UTF-8", "delimiter": ",", "quoting": "minimal"},
+    "utf-16": {"encoding": "UTF-16", "delimiter": ",", "quoting": "minimal"},
+    "cp1252-tab": {"encoding": "cp1252", "delimiter": "\t", "quoting": "minimal"},
+    "utf-8-pipe-quote-all": {"encoding": "UTF-8", "delimiter": "|", "quoting": "all"},
+}
+
+
+class Case:
+    __slots__ = ["name", "path", "rows", "fn", "compared_to"]
+
+    def __init__(self, name: str, path: str, rows: int, fn, compared_to=None):
+        self.name = name
+        self.path = path
+        self.rows = rows
+        # Takes the open file
+        self.fn = fn
+        # The same case without what this one adds, for cases that measure
+        # an overhead
+        self.compared_to = compared_to
+
+
+def _csv_args(fd, dialect: str, csv_engine: str = "python"):
+    return validation.make_csv_args(fd, **DIALECTS[dialect], csv_engine=csv_engine)
+
+
+def _validate_csv(dialect: str, csv_engine: str, check_values: bool = False):
+    def fn(fd):
+        validation.validate_csv(
+            _csv_args(fd, dialect, csv_engine),
+            "OPPORTUNISTIC",
+            validation.ValidationOptions(use_cache=False, check_values=check_values),
+        )
+
+    return fn
+
+
+def _validator(match_logic: str, check_values: bool = False):
+    validator_class = validation.get_validator_class(match_logic)
+
+    def fn(fd):
+        validator = validator_class(_csv_args(fd, "utf-8"))
+        validator.check_values = check_values
+        validator.validate()
+
+    return fn
+
+
+async def _drain(part_queue: asyncio.Queue):
+    while True:
+        await part_queue.get()
+        part_queue.task_done()
+
+
+def _rewrite_csv(dialect: str):
+    async def rewrite(fd):
+        part_queue = asyncio.Queue(maxsize=2)
+        drain = asyncio.create_task(_drain(part_queue))
+        await upload.rewrite_csv(_csv_args(fd, dialect), 5 * 1024 * 1024, part_queue)
+        await part_queue.join()
+        drain.cancel()
+
+    def fn(fd):
+        asyncio.run(rewrite(fd))
+
+    return fn
+
+
+def _instrumented(fn, module):
+    """fn with module's recording on, as with --metrics-file or
+    --trace-file."""
+
+    def instrumented(fd):
+        module.enable()
+        try:
+            fn(fd)
+        finally:
+            module.disable()
+
+    return instrumented
+
+
+INSTRUMENTATION = {"metrics": metrics, "tracing": tracing}
+
+
+def _write_file(tmp_dir: str, rows: int, dialect: str, match_logic: str) -> str:
+    path = os.path.join(tmp_dir, f"{match_logic}_{dialect}_{rows}.csv")
+    if not os.path.exists(path):
+        options = DIALECTS[dialect]
+        data.write_csv(
+            path,
+            rows,
+            encoding=options["encoding"],
+            delimiter=options["delimiter"],
+            quoting=constants.QUOTE_METHODS[options["quoting"]],
+            match_logic=match_logic,
+        )
+    return path
+
+
+def cases(tmp_dir: str, row_counts, pattern: str):
+    csv_engines = ["python", "arrow"] if arrow_csv.available() else ["python"]
+    for rows in row_counts:
+        files = {}
+
+        def path(dialect, match_logic="OPPORTUNISTIC"):
+            key = (dialect, match_logic)
+            if key not in files:
+                files[key] = _write_file(tmp_dir, rows, dialect, match_logic)
+            return files[key]
+
+        candidates = []
+        for dialect in DIALECTS:
+            for csv_engine in csv_engines:
+                candidates.append(
+                    (
+                        f"validate_csv/{dialect}/{csv_engine}/{rows}",
+                        lambda dialect=dialect: path(dialect),
+                        _validate_csv(dialect, csv_engine),
+                    )
+                )
+        # --validate-values, against the same cases without it
+        for csv_engine in csv_engines:
+            candidates.append(
+                (
+                    f"validate_csv/utf-8/{csv_engine}/values/{rows}",
+                    lambda: path("utf-8"),
+                    _validate_csv("utf-8", csv_engine, check_values=True),
+                    f"validate_csv/utf-8/{csv_engine}/{rows}",
+                )
+            )
+        for match_logic in data.SCHEMAS:
+            class_name = validation.get_validator_class(match_logic).__name__
+            get_path = functools.partial(path, "utf-8", match_logic)
+            candidates.append(
+                (f"validator/{class_name}/{rows}", get_path, _validator(match_logic))
+            )
+            candidates.append(
+                (
+                    f"validator/{class_name}/values/{rows}",
+                    get_path,
+                    _validator(match_logic, check_values=True),
+                    f"validator/{class_name}/{rows}",
+                )
+            )
+        for dialect in ["utf-8", "utf-16"]:
+            candidates.append(
+                (
+                    f"rewrite_csv/{dialect}/{rows}",
+                    lambda dialect=dialect: path(dialect),
+                    _rewrite_csv(dialect),
+                )
+            )
+        # Recording on, against the same cases without it
+        for name, module in INSTRUMENTATION.items():
+            candidates.append(
+                (
+                    f"validate_csv/utf-8/python/{name}/{rows}",
+                    lambda: path("utf-8"),
+                    _instrumented(_validate_csv("utf-8", "python"), module),
+                    f"validate_csv/utf-8/python/{rows}",
+                )
+            )
+            candidates.append(
+                (
+                    f"rewrite_csv/utf-8/{name}/{rows}",
+                    lambda: path("utf-8"),
+                    _instrumented(_rewrite_csv("utf-8"), module),
+                    f"rewrite_csv/utf-8/{rows}",
+                )
+            )
+
+        for name, get_path, fn, *compared_to in candidates:
+            if fnmatch.fnmatch(name, pattern):
+                yield Case(name, get_path(), rows, fn, *compared_to)
+
+
+def _run_once(case: Case) -> float:
+    with open(case.path, "rb") as fd:
+        start = time.perf_counter()
+        case.fn(fd)
+        return time.perf_counter() - start
+
+
+def _peak_allocations(case: Case) -> int:
+    tracemalloc.start()
+    try:
+        _run_once(case)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def measure(case: Case, repeat: int, allocations: bool) -> dict:
+    # Warm up imports, the page cache and the validator pool
+    _run_once(case)
+    seconds = min(_run_once(case) for _ in range(repeat))
+    size_mb = os.path.getsize(case.path) / 1024 / 1024
+    result = {
+        "seconds": seconds,
+        "rows_per_second": case.rows / seconds,
+        "mb_per_second": size_mb / seconds,
+    }
+    if allocations:
+        result["peak_alloc_mb"] = _peak_allocations(case) / 1024 / 1024
+    return result
+
+
+def _change(result: dict, baseline: dict) -> float:
+    """Fractional change in speed, negative is slower."""
+    return result["rows_per_second"] / baseline["rows_per_second"] - 1
+
+
+parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+parser.add_argument(
+    "--rows", help="File sizes in rows", nargs="+", type=int, default=[10_000, 100_000]
+)
+parser.add_argument(
+    "--filter", help="Only cases matching this glob", default="*", dest="pattern"
+)
+parser.add_argument(
+    "--repeat", help="Runs of each case, the fastest is kept", type=int, default=5
+)
+parser.add_argument(
+    "--no-allocations",
+    help="Skip the tracemalloc run",
+    dest="allocations",
+    action="store_false",
+)
+parser.add_argument(
+    "--baselines", help="Baselines file", default=BASELINES_PATH, dest="baselines_path"
+)
+parser.add_argument(
+    "--save-baselines",
+    help="Store the results as the baselines of their cases",
+    action="store_true",
+)
+parser.add_argument(
+    "--compare", help="Compare the results to the baselines", action="store_true"
+)
+parser.add_argument(
+    "--tolerance",
+    help="Slowdown from the baseline that fails --compare",
+    type=float,
+    default=0.15,
+)
+parser.add_argument("--json", help="Write the results to this file as JSON")
+
+
+def main() -> int:
+    args = parser.parse_args()
+
+    try:
+        with open(args.baselines_path) as fd:
+            baselines = json.load(fd)
+    except FileNotFoundError:
+        baselines = {}
+
+    results = {}
+    regressions = []
+    overheads = []
+    print(f"{'':48} {'rows/s':>10} {'MB/s':>7} {'alloc MB':>9} {'change':>7}")
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for case in cases(tmp_dir, args.rows, args.pattern):
+            result = results[case.name] = measure(case, args.repeat, args.allocations)
+
+            alloc = change = ""
+            if "peak_alloc_mb" in result:
+                alloc = f"{result['peak_alloc_mb']:.1f}"
+            if args.compare and case.name in baselines:
+                fraction = _change(result, baselines[case.name])
+                change = f"{fraction:+.0%}"
+                if fraction < -args.tolerance:
+                    regressions.append(case.name)
+            print(
+                f"{case.name:48} {result['rows_per_second']:>10,.0f}"
+                f" {result['mb_per_second']:>7.1f}"
+                f" {alloc:>9} {change:>7}"
+            )
+            if case.compared_to in results:
+                baseline = results[case.compared_to]
+                overheads.append(
+                    (
+                        case.name,
+                        baseline["rows_per_second"] / result["rows_per_second"] - 1,
+                    )
+                )
+
+    if overheads:
+        print("\nOverhead, time added to the same case without it:")
+        for name, overhead in overheads:
+            print(f"{name:48} {overhead:>+7.1%}")
+
+    if args.json:
+        with open(args.json, "w") as fd:
+            json.dump(results, fd, indent=4, sort_keys=True)
+
+    if args.save_baselines:
+        baselines.update(results)
+        with open(args.baselines_path, "w") as fd:
+            json.dump(baselines, fd, indent=4, sort_keys=True)
+            fd.write("\n")
+
+    if regressions:
+        print(f"Slower than the baselines: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -29,6 +29,12 @@ setup(
     # Let's not force all the hard requirements out from requirements.txt
     # in case people are installing this thing into their system Pythons.
     install_requires=requirements,
+    # Optional features, each needs its package only when it's used.
+    extras_require={
+        "arrow": ["pyarrow"],
+        "yaml": ["pyyaml"],
+        "zstd": ["zstandard"],
+    },
     entry_points={
         "console_scripts": ["aidentified_match=aidentified_matching_api:main"]
     },
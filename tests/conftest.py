@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import pytest
+
+import aidentified_matching_api.client as client
+import aidentified_matching_api.constants as constants
+import aidentified_matching_api.daemon as daemon
+import aidentified_matching_api.token_service as token_service
+import aidentified_matching_api.validation as validation
+import benchmarks.fake_api as fake_api
+
+
+@pytest.fixture(autouse=True)
+def validation_cache_dir(tmp_path, monkeypatch):
+    """Each test gets an empty validation cache outside the user's cache
+    directory, so earlier tests' results can't stand in for validation."""
+    cache_dir = tmp_path / "validation_cache"
+    cache_dir.mkdir()
+    monkeypatch.setattr(validation, "get_validation_cache_dir", lambda: str(cache_dir))
+    return cache_dir
+
+
+@pytest.fixture
+def api(tmp_path, monkeypatch):
+    """The fake matching API, with the CLI and clients pointed at it."""
+    with fake_api.FakeMatchingApi(page_size=2) as api:
+        monkeypatch.setattr(constants, "AIDENTIFIED_URL", api.api_url)
+        monkeypatch.setattr(
+            token_service.token_service, "cache_file", str(tmp_path / "token_cache")
+        )
+        monkeypatch.setattr(client, "_cli_clients", {})
+        monkeypatch.setattr(
+            daemon, "get_socket_path", lambda: str(tmp_path / "daemon.sock")
+        )
+        monkeypatch.setenv("AID_EMAIL", "foo@example.com")
+        monkeypatch.setenv("AID_PASSWORD", "bar")
+        yield api
+
+
+@pytest.fixture
+def matching_client(api, tmp_path):
+    tokens = token_service.TokenService()
+    tokens.cache_file = str(tmp_path / "client_token_cache")
+    return client.MatchingClient("foo@example.com", "bar", tokens)
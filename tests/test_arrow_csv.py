@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import codecs
+import io
+
+import pytest
+
+import aidentified_matching_api.arrow_csv as arrow_csv
+import aidentified_matching_api.upload as upload
+import aidentified_matching_api.validation as validation
+from aidentified_matching_api.validation import AddressCsvValidator
+from aidentified_matching_api.validation import CsvArgs
+from aidentified_matching_api.validation import EmailCsvValidator
+from aidentified_matching_api.validation import OpportunisticCsvValidator
+from tests.test_validation import _validation_error
+from tests.test_validation import ADDRESS_TEST_DATA
+from tests.test_validation import EMAIL_TEST_DATA
+from tests.test_validation import ORDINARY_CSV_ARGS
+from tests.test_validation import PARALLEL_TEST_DATA
+from tests.test_validation import TEST_DATA
+
+pytest.importorskip("pyarrow")
+
+# Line breaks to str.splitlines, which the csv module path splits lines with
+LINE_BREAK_TEST_DATA = [
+    template.format(line_break).encode("UTF-8")
+    for line_break in "\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029"
+    for template in [
+        "first_name,last_name,city\nfoo{}x,bar,boston\nfoo,bar,boston\n",
+        'first_name,last_name,city\nfoo,bar,boston\n"foo{}x",bar,boston\n',
+    ]
+]
+
+ENGINE_TEST_DATA = (
+    [(buffer, OpportunisticCsvValidator) for buffer, _ in TEST_DATA]
+    + [(buffer, OpportunisticCsvValidator) for buffer in PARALLEL_TEST_DATA]
+    + [(buffer, AddressCsvValidator) for buffer, _ in ADDRESS_TEST_DATA]
+    + [(buffer, EmailCsvValidator) for buffer, _ in EMAIL_TEST_DATA]
+    + [(buffer, None) for buffer in LINE_BREAK_TEST_DATA]
+    + [
+        (b"first_name,last_name,city\nfoo,bar,boston\n\nfoo,bar,boston\n", None),
+        (b"first_name,last_name,city\r\nfoo,bar,boston\r\nfoo,bar", None),
+        (b'first_name,last_name,city\nfoo,"bar""baz",boston\n', None),
+        ("first_name,last_name,city\nJosé,bar,boston\n".encode("latin-1"), None),
+        # Quotes the csv module's strict mode rejects and Arrow reads past
+        (b'first_name,last_name,city\nfoo,bar,"abc"def\n', None),
+        (b'first_name,last_name,city\nfoo,"bar,"baz,boston\n', None),
+        (b'first_name,last_name,city\nfoo,""bar,boston\n', None),
+        (b'first_name,last_name,city\nfoo,bar,"boston', None),
+        (b'first_name,last_name,city\nfoo,b"a"r,"""boston"""\n', None),
+    ]
+)
+
+
+def _csv_args(buffer, csv_engine):
+    return CsvArgs(io.BytesIO(buffer), *ORDINARY_CSV_ARGS, csv_engine=csv_engine)
+
+
+@pytest.mark.parametrize("buffer, validator_class", ENGINE_TEST_DATA)
+def test_engines_match(buffer, validator_class):
+    validator_class = validator_class or OpportunisticCsvValidator
+    python_validator = validator_class(_csv_args(buffer, "python"))
+    arrow_validator = validator_class(_csv_args(buffer, "arrow"))
+
+    assert _validation_error(arrow_validator) == _validation_error(python_validator)
+    assert arrow_validator.records_read == python_validator.records_read
+
+
+def test_arrow_validates(monkeypatch):
+    buffer = b"first_name,last_name,id,city\n" + b"".join(
+        b'foo,"bar\nbaz",%d,boston\n' % idx for idx in range(200)
+    )
+    validator = OpportunisticCsvValidator(_csv_args(buffer, "arrow"))
+
+    def fail(*_):
+        raise AssertionError("validated with the csv module")
+
+    monkeypatch.setattr(validator, "validate_records", fail)
+    validator.validate()
+    assert validator.records_read == 200
+
+
+def test_arrow_strict_quotes(monkeypatch):
+    monkeypatch.setattr(arrow_csv, "ARROW_BLOCK_SIZE", 256)
+    buffer = (
+        b"first_name,last_name,city\n"
+        + b"".join(b'foo,"bar ""%d""",boston\n' % idx for idx in range(100))
+        + b'foo,bar,"bos"ton\n'
+    )
+    validator = OpportunisticCsvValidator(_csv_args(buffer, "auto"))
+
+    assert (
+        _validation_error(validator)
+        == "Bad CSV format in row 102: ',' expected after '\"'"
+    )
+
+
+def test_arrow_ids_streamed():
+    buffer = b"first_name,last_name,id,city\n" + b"".join(
+        b"foo,bar,%d,boston\n" % idx for idx in range(200)
+    )
+    validator = OpportunisticCsvValidator(_csv_args(buffer, "arrow"))
+
+    validator.validate()
+
+    # Checked in the validator's digest set as they were read
+    assert len(validator.id_uniqueness) == 200
+
+
+def test_arrow_duplicate_id(monkeypatch):
+    monkeypatch.setattr(arrow_csv, "ARROW_BLOCK_SIZE", 256)
+    buffer = (
+        b"first_name,last_name,id,city\n"
+        + b"".join(b"foo,bar,%d,boston\n" % idx for idx in range(200))
+        + b"foo,bar,150,boston\n"
+        + b"foo,bar,3,boston\n"
+    )
+    validator = OpportunisticCsvValidator(_csv_args(buffer, "arrow"))
+
+    assert _validation_error(validator) == "Row 202 has duplicate id '150'"
+
+
+def test_arrow_engine_unknown():
+    with pytest.raises(Exception, match="Unknown csv-engine 'fast'"):
+        validation.make_csv_args(io.BytesIO(b"first_name\n"), csv_engine="fast")
+
+
+REWRITE_TEST_DATA = [
+    b"first_name,last_name,city\n"
+    + b"".join(b'foo,"bar\nbaz",bos"ton %d\n' % idx for idx in range(200)),
+    codecs.BOM_UTF8 + b"first_name;last_name;city\nfoo;bar;boston\n\nfoo;bar;\n",
+    # The csv module takes over part of the way through
+    b"first_name,last_name,city\n"
+    + b"".join(b"foo,bar,boston %d\n" % idx for idx in range(50))
+    + b"\n"
+    + b"".join(b"foo,bar,boston %d\n" % idx for idx in range(50)),
+    # Arrow doesn't read it, the csv module does
+    b"first_name,last_name,city\nfoo,bar\n",
+    *LINE_BREAK_TEST_DATA,
+]
+
+
+@pytest.mark.parametrize("buffer", REWRITE_TEST_DATA)
+def test_rewrite_engines_match(buffer, monkeypatch):
+    monkeypatch.setattr(arrow_csv, "ARROW_BLOCK_SIZE", 256)
+    monkeypatch.setattr(upload, "ROWS_PER_BATCH", 7)
+
+    parts = {}
+    for csv_engine in ["python", "arrow"]:
+        csv_args = validation.make_csv_args(io.BytesIO(buffer), csv_engine=csv_engine)
+        csv_args = validation.detect_csv_args(csv_args)
+        part_queue = asyncio.Queue()
+        asyncio.run(upload.rewrite_csv(csv_args, 1024, part_queue))
+        parts[csv_engine] = [part_queue.get_nowait() for _ in range(part_queue.qsize())]
+
+    assert parts["arrow"] == parts["python"]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import argparse
+import asyncio
+import io
+import time
+
+import pytest
+
+import aidentified_matching_api.client as client
+import aidentified_matching_api.token_service as token_service
+import aidentified_matching_api.validation as validation
+
+
+def test_id_cache(api, matching_client, monkeypatch):
+    matching_client.create_dataset("dataset")
+    matching_client.create_dataset_file("dataset", "file")
+    matching_client._id_cache.clear()
+    api.state.counters.clear()
+
+    dataset_id = matching_client.get_dataset_id("dataset")
+    assert matching_client.get_dataset_id("dataset") == dataset_id
+    matching_client.get_dataset_file_id("dataset", "file")
+    matching_client.get_dataset_file_id("dataset", "file")
+    assert api.state.counters == {"GET /v1/dataset/": 1, "GET /v1/dataset-file/": 1}
+
+    # Looked up again once they expire
+    monkeypatch.setattr(client, "ID_CACHE_TTL", 0.05)
+    matching_client._id_cache.clear()
+    matching_client.get_dataset_id("dataset")
+    time.sleep(0.1)
+    assert matching_client.get_dataset_id("dataset") == dataset_id
+    assert api.state.counters["GET /v1/dataset/"] == 3
+
+
+def test_id_cache_forgets_deleted(matching_client):
+    matching_client.create_dataset("dataset")
+    matching_client.create_dataset_file("dataset", "file")
+    dataset_id = matching_client.get_dataset_id("dataset")
+    matching_client.get_dataset_file_id("dataset", "file")
+
+    matching_client.delete_dataset("dataset")
+    with pytest.raises(Exception, match="No dataset with name 'dataset' found"):
+        matching_client.get_dataset_id("dataset")
+
+    matching_client.create_dataset("dataset")
+    assert matching_client.get_dataset_id("dataset") != dataset_id
+    with pytest.raises(Exception, match="No dataset file with name 'file' found"):
+        matching_client.get_dataset_file_id("dataset", "file")
+
+
+def test_id_cache_forgets_deleted_dataset_file(matching_client):
+    matching_client.create_dataset("dataset")
+    matching_client.create_dataset_file("dataset", "file")
+    dataset_file_id = matching_client.get_dataset_file_id("dataset", "file")
+
+    matching_client.delete_dataset_file("dataset", "file")
+    matching_client.create_dataset_file("dataset", "file")
+
+    assert matching_client.get_dataset_file_id("dataset", "file") != dataset_file_id
+
+
+def test_from_args(api):
+    first = argparse.Namespace(email="foo@example.com", password="bar")
+    second = argparse.Namespace(email="other@example.com", password="bar")
+
+    assert client.from_args(first) is client.from_args(first)
+    assert client.from_args(second) is not client.from_args(first)
+    assert client.from_args(second).token_service is token_service.token_service
+
+
+def test_async_upload_aborts_on_failure(api, matching_client):
+    matching_client.create_dataset("dataset")
+    matching_client.create_dataset_file("dataset", "file")
+    api.object_store.faults.error_rate = 1
+    csv_args = validation.make_csv_args(
+        io.BytesIO(b"first_name,last_name,city\nfoo,bar,boston\n")
+    )
+    async_client = client.AsyncMatchingClient(client=matching_client)
+
+    with pytest.raises(Exception):
+        asyncio.run(
+            async_client.upload_dataset_file(
+                "dataset",
+                "file",
+                csv_args,
+                validation_options=validation.ValidationOptions(use_cache=False),
+            )
+        )
+
+    assert api.state.counters["POST /v1/dataset-file/<id>/abort-upload/"] == 1
+    dataset_file = matching_client.list_dataset_files("dataset")[0]
+    assert dataset_file["status"] == "UPLOAD_NOT_STARTED"
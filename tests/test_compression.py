@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import bz2
+import codecs
+import gzip
+import io
+import lzma
+
+import pytest
+
+import aidentified_matching_api.compression as compression
+import aidentified_matching_api.upload as upload
+import aidentified_matching_api.validation as validation
+
+
+def _zstd_compress(data):
+    zstandard = pytest.importorskip("zstandard")
+    return zstandard.ZstdCompressor().compress(data)
+
+
+COMPRESSORS = [
+    ("gzip", gzip.compress),
+    ("bz2", bz2.compress),
+    ("xz", lzma.compress),
+    ("zstd", _zstd_compress),
+]
+
+CSV_DATA = (
+    codecs.BOM_UTF8
+    + b"first_name,last_name,city\n"
+    + "José,Muñoz,São Paulo\n".encode() * 1000
+)
+
+
+@pytest.mark.parametrize("expected, compress", COMPRESSORS)
+def test_detect_compression(expected, compress):
+    fd = io.BytesIO(compress(CSV_DATA))
+    assert compression.detect_compression(fd) == expected
+    assert fd.tell() == 0
+
+
+def test_detect_uncompressed():
+    assert compression.detect_compression(io.BytesIO(CSV_DATA)) is None
+    assert compression.detect_compression(io.BytesIO(b"BZh9,last_name\n")) is None
+    assert compression.detect_compression(io.BytesIO(b"")) is None
+
+
+@pytest.mark.parametrize("expected, compress", COMPRESSORS)
+def test_validate_and_rewrite_compressed(expected, compress, tmp_path, monkeypatch):
+    # Blocks split characters and line breaks
+    monkeypatch.setattr(validation, "READ_BLOCK_SIZE", 7)
+    path = tmp_path / "input.csv"
+    path.write_bytes(compress(CSV_DATA))
+
+    with open(path, "rb") as fd:
+        csv_args = validation.make_csv_args(fd)
+        assert isinstance(csv_args.raw_fd, compression.DecompressedFile)
+
+        validation.validate_csv(
+            csv_args, "OPPORTUNISTIC", validation.ValidationOptions(workers=2)
+        )
+
+        part_queue = asyncio.Queue()
+        asyncio.run(upload.rewrite_csv(csv_args, 5 * 1024 * 1024, part_queue))
+
+    assert part_queue.get_nowait() == (
+        0,
+        CSV_DATA[3:].replace(b"\n", b"\r\n"),
+    )
+
+
+def test_decompressed_seek():
+    data = bytes(range(256)) * 100
+    fd = compression.DecompressedFile(io.BytesIO(gzip.compress(data)), "gzip")
+
+    assert fd.read(10) == data[:10]
+    assert fd.seek(1000) == 1000
+    assert fd.read(10) == data[1000:1010]
+    assert fd.seek(5) == 5
+    assert fd.read(10) == data[5:15]
+    assert fd.seek(0) == 0
+    assert fd.read() == data
+    with pytest.raises(io.UnsupportedOperation):
+        fd.fileno()
+
+
+def test_bad_compressed_data():
+    fd = compression.DecompressedFile(io.BytesIO(gzip.compress(CSV_DATA)[:100]), "gzip")
+
+    with pytest.raises(Exception, match="Bad gzip compressed data"):
+        fd.read()
+
+
+def test_compressed_fingerprint(tmp_path):
+    path = tmp_path / "input.csv.gz"
+    path.write_bytes(gzip.compress(CSV_DATA))
+
+    with open(path, "rb") as fd:
+        expected = validation.file_fingerprint(fd)
+        decompressed = compression.open_decompressed(fd)
+        assert decompressed.read(10) == CSV_DATA[:10]
+
+        assert validation.file_fingerprint(decompressed) == expected
+        assert decompressed.read(10) == CSV_DATA[10:20]
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import socket
+import sys
+import threading
+
+import pytest
+
+import aidentified_matching_api
+import aidentified_matching_api.daemon as daemon
+
+
+@pytest.fixture
+def server(api):
+    server = daemon.DaemonServer(daemon.get_socket_path())
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    thread.join()
+
+
+def _main(monkeypatch, *argv):
+    monkeypatch.setattr(sys, "argv", ["aidentified_match", *argv])
+    return aidentified_matching_api.main()
+
+
+def _request(*argv, email="foo@example.com") -> dict:
+    return daemon._send_request(
+        {"command": "run", "argv": list(argv), "email": email, "password": "bar"}
+    )
+
+
+def test_forward(server, matching_client, monkeypatch, capsys):
+    matching_client.create_dataset("dataset")
+
+    assert _main(monkeypatch, "dataset", "list") == 0
+    assert [ds["name"] for ds in json.loads(capsys.readouterr().out)] == ["dataset"]
+    assert server.request_count == 1
+
+
+def test_forward_error(server, monkeypatch, capsys):
+    assert _main(monkeypatch, "dataset", "delete", "--name", "missing") == 1
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert captured.err == "Error: No dataset with name 'missing' found\n"
+
+
+def test_forward_stderr(server, monkeypatch, capsys):
+    resp = _request("dataset", "list", "--nope")
+    assert resp["exit_code"] == 2
+    assert "unrecognized arguments: --nope" in resp["stderr"]
+
+    resp = _request("--verbose", "dataset", "list")
+    assert resp["exit_code"] == 0
+    assert "INFO     get /v1/dataset/" in resp["stderr"]
+
+    # The daemon's stderr is forwarded to the client's
+    monkeypatch.setattr(daemon, "_send_request", lambda request: resp)
+    assert _main(monkeypatch, "dataset", "list") == 0
+    assert "get /v1/dataset/" in capsys.readouterr().err
+
+
+def test_forward_token_per_account(server):
+    first = _request("auth")["stdout"]
+    second = _request("auth", email="other@example.com")["stdout"]
+
+    assert first != second
+    assert _request("auth")["stdout"] == first
+
+
+def test_stale_socket(api, matching_client, monkeypatch, capsys):
+    # Left behind by a daemon that didn't exit cleanly
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(daemon.get_socket_path())
+    matching_client.create_dataset("dataset")
+
+    assert _main(monkeypatch, "dataset", "list") is None
+    assert [ds["name"] for ds in json.loads(capsys.readouterr().out)] == ["dataset"]
+
+
+def test_no_socket(api):
+    args = aidentified_matching_api.parser.parse_args(["dataset", "list"])
+
+    assert daemon.try_forward(args, ["dataset", "list"]) is None
+
+
+@pytest.mark.parametrize(
+    "argv,forwarded",
+    [
+        (["dataset", "list"], True),
+        (["--no-daemon", "dataset", "list"], False),
+        (["--metrics-file", "metrics.json", "dataset", "list"], False),
+        (["--progress", "dataset", "list"], False),
+        (["daemon", "status"], False),
+        (
+            ["dataset-file", "wait", "--dataset-name", "d", "--dataset-file-name", "f"],
+            False,
+        ),
+        (["inventory"], False),
+    ],
+)
+def test_can_forward(argv, forwarded):
+    args = aidentified_matching_api.parser.parse_args(argv)
+
+    assert daemon._can_forward(args) is forwarded
@@ -0,0 +1,293 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import io
+import os
+import sys
+import threading
+
+import pytest
+
+import aidentified_matching_api
+import aidentified_matching_api.client as client
+import aidentified_matching_api.dataset_file as dataset_file
+import aidentified_matching_api.validation as validation
+
+
+def test_upload_download(matching_client):
+    buffer = b"first_name;last_name;city\nJos\xc3\xa9;bar;boston\nfoo;bar;omaha\n"
+
+    matching_client.create_dataset("dataset")
+    for name in ["file_1", "file_2", "file_3"]:
+        matching_client.create_dataset_file("dataset", name)
+    assert len(matching_client.list_dataset_files("dataset")) == 3
+
+    csv_args = validation.make_csv_args(io.BytesIO(buffer), delimiter=";")
+    status = matching_client.upload_dataset_file(
+        "dataset",
+        "file_2",
+        csv_args,
+        validation_options=validation.ValidationOptions(use_cache=False),
+    )
+    assert status["status"] == "MATCHING_FINISHED"
+
+    out_fd = io.BytesIO()
+    matching_client.download_dataset_file("dataset", "file_2", out_fd)
+    assert out_fd.getvalue() == buffer.replace(b";", b",").replace(b"\n", b"\r\n")
+
+
+def _set_status(api, name, status):
+    for stored in api.state.dataset_files.values():
+        if stored["name"] == name:
+            stored["status"] = status
+
+
+def test_wait_for_dataset_files(api, matching_client, monkeypatch):
+    matching_client.create_dataset("dataset")
+    for name in ["file_1", "file_2", "file_3"]:
+        matching_client.create_dataset_file("dataset", name)
+    _set_status(api, "file_1", "MATCHING_IN_PROGRESS")
+    _set_status(api, "file_2", "VALIDATION_IN_PROGRESS")
+
+    sleeps = []
+    transitions = [
+        [],
+        [("file_2", "MATCHING_IN_PROGRESS")],
+        [("file_1", "MATCHING_FINISHED"), ("file_2", "MATCHING_ERROR")],
+    ]
+
+    def sleep(seconds):
+        for name, status in transitions[len(sleeps)]:
+            _set_status(api, name, status)
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(client.time, "sleep", sleep)
+    finished = []
+
+    dataset_files = matching_client.wait_for_dataset_files(
+        "dataset", ["file_1", "file_2"], on_finished=finished.append
+    )
+
+    # Backs off while nothing changes, back to the start after a change
+    assert sleeps == [5.0, 7.5, 5.0]
+    assert {name: df["status"] for name, df in dataset_files.items()} == {
+        "file_1": "MATCHING_FINISHED",
+        "file_2": "MATCHING_ERROR",
+    }
+    assert sorted(df["name"] for df in finished) == ["file_1", "file_2"]
+
+    with pytest.raises(Exception, match="No dataset file with name 'nope' found"):
+        matching_client.wait_for_dataset_files("dataset", ["nope"])
+
+
+def test_wait_for_upload(api, matching_client, monkeypatch):
+    matching_client.create_dataset("dataset")
+    for name in ["new", "aborted"]:
+        matching_client.create_dataset_file("dataset", name)
+    _set_status(api, "aborted", "UPLOAD_IN_PROGRESS")
+
+    sleeps = []
+    transitions = [
+        [("new", "UPLOAD_IN_PROGRESS"), ("aborted", "UPLOAD_NOT_STARTED")],
+        [("new", "MATCHING_FINISHED")],
+    ]
+
+    def sleep(seconds):
+        for name, status in transitions[len(sleeps)]:
+            _set_status(api, name, status)
+        sleeps.append(seconds)
+
+    monkeypatch.setattr(client.time, "sleep", sleep)
+
+    dataset_files = matching_client.wait_for_dataset_files(
+        "dataset", ["new", "aborted"]
+    )
+
+    # A new file is waited for until its upload, an aborted one isn't
+    assert len(sleeps) == 2
+    assert {name: df["status"] for name, df in dataset_files.items()} == {
+        "new": "MATCHING_FINISHED",
+        "aborted": "UPLOAD_NOT_STARTED",
+    }
+
+
+def test_wait_upload_grace(api, matching_client):
+    matching_client.create_dataset("dataset")
+    matching_client.create_dataset_file("dataset", "file")
+
+    dataset_files = matching_client.wait_for_dataset_files(
+        "dataset", ["file"], poll_interval=10, upload_grace=0.1
+    )
+
+    assert dataset_files["file"]["status"] == "UPLOAD_NOT_STARTED"
+
+
+def test_wait_command(api, tmp_path, monkeypatch):
+    input_path = tmp_path / "input.csv"
+    input_path.write_bytes(b"first_name,last_name,city\nfoo,bar,boston\n")
+    download_dir = tmp_path / "downloads"
+    download_dir.mkdir()
+
+    def run(*argv):
+        monkeypatch.setattr(sys, "argv", ["aidentified_match", *argv])
+        return aidentified_matching_api.main()
+
+    run("dataset", "create", "--name", "dataset")
+    for name in ["file_1", "file_2"]:
+        run(
+            "dataset-file",
+            "create",
+            "--dataset-name",
+            "dataset",
+            "--dataset-file-name",
+            name,
+        )
+    run(
+        "dataset-file",
+        "upload",
+        "--dataset-name",
+        "dataset",
+        "--dataset-file-name",
+        "file_1",
+        "--dataset-file-path",
+        str(input_path),
+    )
+    _set_status(api, "file_2", "MATCHING_IN_PROGRESS")
+
+    wait = ["dataset-file", "wait", "--dataset-name", "dataset"]
+    wait += ["--dataset-file-name", "file_1", "--dataset-file-name", "file_2"]
+    assert run(*wait, "--timeout", "0") == dataset_file.WAIT_TIMEOUT_EXIT_CODE
+
+    # Not uploaded yet, waited for until the timeout or the grace period
+    _set_status(api, "file_2", "UPLOAD_NOT_STARTED")
+    assert run(*wait, "--timeout", "0") == dataset_file.WAIT_TIMEOUT_EXIT_CODE
+    assert run(*wait, "--upload-grace", "0") == 5
+    _set_status(api, "file_2", "MATCHING_IN_PROGRESS")
+
+    _set_status(api, "file_2", "VALIDATION_ERROR")
+    assert run(*wait, "--download-dir", str(download_dir)) == 3
+    assert os.listdir(download_dir) == ["file_1"]
+    assert (download_dir / "file_1").read_bytes() == (
+        b"first_name,last_name,city\r\nfoo,bar,boston\r\n"
+    )
+
+
+def test_upload_many_command(api, tmp_path, monkeypatch):
+    input_dir = tmp_path / "inputs"
+    input_dir.mkdir()
+    for name in ["a.csv", "b.csv"]:
+        (input_dir / name).write_bytes(b"first_name,last_name,city\nfoo,bar,boston\n")
+    (input_dir / "bad.csv").write_bytes(b"nope,last_name\nfoo,bar\n")
+    report_dir = tmp_path / "reports"
+    report_dir.mkdir()
+
+    def run(*argv):
+        monkeypatch.setattr(sys, "argv", ["aidentified_match", *argv])
+        return aidentified_matching_api.main()
+
+    run("dataset", "create", "--name", "dataset")
+    exit_code = run(
+        "dataset-file",
+        "upload-many",
+        "--dataset-name",
+        "dataset",
+        "--dataset-file-paths",
+        str(input_dir),
+        "--max-buffered-mb",
+        "1",
+        "--max-api-calls",
+        "1",
+        "--concurrent-files",
+        "3",
+        "--validation-report",
+        str(report_dir / "errors.csv"),
+    )
+    assert exit_code == 1
+    # A report of its own for each file
+    assert sorted(os.listdir(report_dir)) == [
+        "errors_a.csv.csv",
+        "errors_b.csv.csv",
+        "errors_bad.csv.csv",
+    ]
+    assert "Invalid header 'nope'" in (report_dir / "errors_bad.csv.csv").read_text()
+
+    statuses = {
+        dataset_file["name"]: dataset_file["status"]
+        for dataset_file in api.state.dataset_files.values()
+    }
+    assert statuses == {
+        "a.csv": "MATCHING_FINISHED",
+        "b.csv": "MATCHING_FINISHED",
+        "bad.csv": "UPLOAD_NOT_STARTED",
+    }
+
+    with pytest.raises(Exception, match="No files match"):
+        run(
+            "dataset-file",
+            "upload-many",
+            "--dataset-name",
+            "dataset",
+            "--dataset-file-paths",
+            str(input_dir / "*.tsv"),
+        )
+
+
+def _piped(buffer: bytes):
+    read_fd, write_fd = os.pipe()
+
+    def write():
+        with os.fdopen(write_fd, "wb") as fd:
+            fd.write(buffer)
+
+    threading.Thread(target=write).start()
+    return os.fdopen(read_fd, "rb")
+
+
+@pytest.mark.parametrize(
+    "buffer, error",
+    [(b"bogus,header\n1,2\n", "Invalid header 'bogus'"), (b"", "No headers in file")],
+)
+def test_upload_shards_unreadable(api, matching_client, buffer, error):
+    matching_client.create_dataset("dataset")
+    csv_args = validation.make_csv_args(_piped(buffer))
+
+    with pytest.raises(Exception, match=error):
+        matching_client.upload_sharded_dataset_file("dataset", "file", csv_args)
+
+    assert api.state.dataset_files == {}
+
+
+def test_upload_shards_command(api, tmp_path, monkeypatch):
+    input_path = tmp_path / "input.csv"
+    input_path.write_bytes(b"first_name,last_name,city\n" + b"foo,bar,boston\n" * 3)
+
+    def run(*argv):
+        monkeypatch.setattr(sys, "argv", ["aidentified_match", *argv])
+        return aidentified_matching_api.main()
+
+    run("dataset", "create", "--name", "dataset")
+    upload_shards = ["dataset-file", "upload-shards", "--dataset-name", "dataset"]
+    upload_shards += ["--dataset-file-name", "file"]
+    upload_shards += ["--dataset-file-path", str(input_path), "--shard-rows", "2"]
+
+    assert run(*upload_shards) is None
+    assert sorted(
+        dataset_file["name"] for dataset_file in api.state.dataset_files.values()
+    ) == ["file_1", "file_2"]
+
+    # Nothing uploaded isn't a success
+    monkeypatch.setattr(
+        client.MatchingClient, "upload_sharded_dataset_file", lambda *_, **__: []
+    )
+    assert run(*upload_shards) == 1
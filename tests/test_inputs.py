@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import codecs
+import gzip
+import io
+import json
+
+import pytest
+
+import aidentified_matching_api.inputs as inputs
+import aidentified_matching_api.upload as upload
+import aidentified_matching_api.validation as validation
+
+JSONL_DATA = (
+    b'{"first_name": "Jos\\u00e9", "last_name": "M\xc3\xbcller", "city": "boston", "id": 1}\n'
+    b"\n"
+    b'{"last_name": "bar", "first_name": "foo\xe2\x80\xa8bar", "id": 2.5}\r\n'
+    b'{"first_name": "foo", "last_name": "bar", "city": null, "id": true}'
+)
+
+JSONL_ROWS = [
+    ["first_name", "last_name", "city", "id"],
+    ["José", "Müller", "boston", "1"],
+    ["foo\u2028bar", "bar", "", "2.5"],
+    ["foo", "bar", "", "true"],
+]
+
+
+@pytest.mark.parametrize(
+    "buffer, expected",
+    [
+        (b"first_name,last_name\n", "csv"),
+        (b"", "csv"),
+        (JSONL_DATA, "jsonl"),
+        (codecs.BOM_UTF8 + b'\n  {"a": 1}\n', "jsonl"),
+        (b"PAR1\x15\x04", "parquet"),
+    ],
+)
+def test_detect_format(buffer, expected):
+    fd = io.BytesIO(buffer)
+    assert inputs.detect_format(fd) == expected
+    assert fd.tell() == 0
+
+
+def test_jsonl_rows(monkeypatch):
+    # Blocks split lines and characters
+    monkeypatch.setattr(validation, "READ_BLOCK_SIZE", 7)
+    csv_args = validation.make_csv_args(io.BytesIO(JSONL_DATA))
+    assert csv_args.input_format == "jsonl"
+
+    assert list(validation.read_rows(csv_args)) == JSONL_ROWS
+
+
+def test_jsonl_bad_lines(tmp_path):
+    report_path = tmp_path / "report.jsonl"
+    buffer = (
+        b'{"first_name": "foo", "last_name": "bar", "city": "boston"}\n'
+        b'{"first_name": "foo", "last_name": "bar", "state": "MA"}\n'
+        b"[1, 2, 3]\n"
+        b'{"first_name": "foo", \n'
+        b'{"first_name": "foo", "last_name": ""}\n'
+    )
+    csv_args = validation.make_csv_args(io.BytesIO(buffer))
+
+    with pytest.raises(validation.ValidationError):
+        validation.validate_csv(
+            csv_args,
+            "OPPORTUNISTIC",
+            validation.ValidationOptions(report_path=str(report_path)),
+        )
+
+    with open(report_path) as fd:
+        errors = [json.loads(line) for line in fd]
+
+    assert [(error["row"], error["error_type"]) for error in errors] == [
+        (3, "csv_format"),
+        (4, "csv_format"),
+        (5, "csv_format"),
+        (6, "required_value"),
+    ]
+    assert errors[0]["message"] == (
+        "Bad record in row 3: line 2 has key 'state' that isn't in the first line"
+    )
+
+
+def test_upload_jsonl():
+    csv_args = validation.make_csv_args(io.BytesIO(gzip.compress(JSONL_DATA)))
+    validation.validate_csv(csv_args, "OPPORTUNISTIC")
+
+    part_queue = asyncio.Queue()
+    asyncio.run(upload.rewrite_csv(csv_args, 5 * 1024 * 1024, part_queue))
+
+    assert part_queue.get_nowait() == (
+        0,
+        "first_name,last_name,city,id\r\nJosé,Müller,boston,1\r\n"
+        "foo\u2028bar,bar,,2.5\r\nfoo,bar,,true\r\n".encode(),
+    )
+
+
+def test_upload_parquet(tmp_path):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    table = pyarrow.table(
+        {
+            "first_name": ["José", "foo", "foo"],
+            "last_name": ["Müller", "bar", "bar"],
+            "city": ["boston", None, None],
+            "id": [1, 2, 3],
+        }
+    )
+    path = tmp_path / "input.parquet"
+    pyarrow.parquet.write_table(table, path)
+
+    with open(path, "rb") as fd:
+        csv_args = validation.make_csv_args(fd)
+        assert csv_args.input_format == "parquet"
+        validation.validate_csv(csv_args, "OPPORTUNISTIC")
+
+        part_queue = asyncio.Queue()
+        asyncio.run(upload.rewrite_csv(csv_args, 5 * 1024 * 1024, part_queue))
+
+    assert part_queue.get_nowait() == (
+        0,
+        "first_name,last_name,city,id\r\nJosé,Müller,boston,1\r\n"
+        "foo,bar,,2\r\nfoo,bar,,3\r\n".encode(),
+    )
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import collections
+import json
+import sys
+
+import aidentified_matching_api
+import aidentified_matching_api.token_service as token_service
+
+
+def _run(monkeypatch, capsys, *args):
+    monkeypatch.setattr(sys, "argv", ["aidentified_match", "inventory", *args])
+    exit_code = aidentified_matching_api.main()
+    lines = capsys.readouterr().out.splitlines()
+    return exit_code, [json.loads(line) for line in lines]
+
+
+def test_inventory(api, matching_client, monkeypatch, capsys):
+    for dataset_name, file_count in [("a", 5), ("b", 1), ("c", 0)]:
+        matching_client.create_dataset(dataset_name)
+        for i in range(file_count):
+            matching_client.create_dataset_file(dataset_name, f"{dataset_name}{i}")
+    api.state.counters.clear()
+
+    exit_code, records = _run(
+        monkeypatch,
+        capsys,
+        "--include-deltas",
+        "--include-triggers",
+        "--concurrent-requests",
+        "3",
+    )
+
+    assert exit_code is None
+    by_type = collections.defaultdict(list)
+    for record in records:
+        by_type[record["type"]].append(record)
+    assert sorted(record["name"] for record in by_type["dataset"]) == ["a", "b", "c"]
+    assert sorted(
+        (record["dataset_name"], record["name"]) for record in by_type["dataset_file"]
+    ) == [("a", "a0"), ("a", "a1"), ("a", "a2"), ("a", "a3"), ("a", "a4"), ("b", "b0")]
+    assert len(by_type["delta_file"]) == len(by_type["trigger_file"]) == 6
+    assert by_type["delta_file"][0]["file_date"]
+    assert "error" not in by_type
+
+    # Each page fetched once: 2 of datasets, 3 of a's files, 1 each of b's and c's
+    assert api.state.counters["GET /v1/dataset/"] == 2
+    assert api.state.counters["GET /v1/dataset-file/"] == 5
+
+
+def test_inventory_cursor_pages(api, matching_client, monkeypatch, capsys):
+    api.api.cursor_pages = True
+    matching_client.create_dataset("a")
+    for i in range(5):
+        matching_client.create_dataset_file("a", f"a{i}")
+    api.state.counters.clear()
+
+    exit_code, records = _run(monkeypatch, capsys)
+
+    assert exit_code is None
+    assert sorted(
+        record["name"] for record in records if record["type"] == "dataset_file"
+    ) == ["a0", "a1", "a2", "a3", "a4"]
+    # The first page isn't fetched again to follow the cursors from it
+    assert api.state.counters["GET /v1/dataset/"] == 1
+    assert api.state.counters["GET /v1/dataset-file/"] == 3
+
+
+def test_inventory_dataset_names(api, matching_client, monkeypatch, capsys, tmp_path):
+    matching_client.create_dataset("a")
+    matching_client.create_dataset("b")
+    matching_client.create_dataset_file("a", "a0")
+    output = tmp_path / "inventory.ndjson"
+
+    exit_code, records = _run(
+        monkeypatch,
+        capsys,
+        "--dataset-name",
+        "a",
+        "--dataset-name",
+        "missing",
+        "--output",
+        str(output),
+    )
+
+    assert exit_code == 1
+    assert records == []
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [(record["type"], record.get("name")) for record in records] == [
+        ("error", None),
+        ("dataset", "a"),
+        ("dataset_file", "a0"),
+    ]
+    assert records[0]["dataset_name"] == "missing"
+    assert records[0]["error"] == "No dataset with name 'missing' found"
+
+
+def test_next_page_urls():
+    tokens = token_service.TokenService()
+    url = "https://example.com/v1/dataset-file/"
+    paged = {
+        "count": 5,
+        "next": f"{url}?dataset_name=a&page=2",
+        "results": [{}, {}],
+    }
+
+    assert tokens.next_page_urls(url, paged) == [
+        f"{url}?dataset_name=a&page=2",
+        f"{url}?dataset_name=a&page=3",
+    ]
+    assert tokens.next_page_urls(url, dict(paged, next=None)) == []
+    assert tokens.next_page_urls(url, dict(paged, next=f"{url}?cursor=abc")) is None
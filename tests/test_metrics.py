@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import json
+import sys
+
+import pytest
+
+import aidentified_matching_api
+import aidentified_matching_api.metrics as metrics
+
+
+@pytest.fixture
+def registry(monkeypatch):
+    registry = metrics.Metrics()
+    monkeypatch.setattr(metrics, "registry", registry)
+    return registry
+
+
+def test_disabled(registry):
+    with metrics.timer("phase") as span:
+        span.nbytes = 10
+    metrics.add("count")
+    metrics.gauge("depth", 1)
+
+    assert registry.to_dict()["timers"] == {}
+    assert registry.to_dict()["counters"] == {}
+    assert registry.to_dict()["gauges"] == {}
+
+
+def test_timer(registry):
+    metrics.enable()
+    with metrics.timer("phase", 1024):
+        pass
+    with pytest.raises(ValueError):
+        with metrics.timer("phase") as span:
+            span.nbytes = 1024
+            raise ValueError()
+    registry.record("phase", 3.0)
+    metrics.add("count", 2)
+    metrics.add("count")
+    for depth in [1, 3, 2]:
+        metrics.gauge("depth", depth)
+
+    snapshot = registry.to_dict()
+    phase = snapshot["timers"]["phase"]
+    assert phase["count"] == 3
+    assert phase["errors"] == 1
+    assert phase["bytes"] == 2048
+    assert phase["max_seconds"] == 3.0
+    assert phase["histogram"] == {"0.001": 2, "5.0": 1}
+    assert snapshot["counters"] == {"count": 3}
+    assert snapshot["gauges"]["depth"] == {
+        "samples": 3,
+        "mean": 2.0,
+        "max": 3,
+        "last": 2,
+    }
+
+
+def test_metrics_file(api, registry, tmp_path, monkeypatch):
+    input_path = tmp_path / "input.csv"
+    input_path.write_bytes(b"first_name,last_name,city\nfoo,bar,boston\nfoo,bar,\n")
+    metrics_path = tmp_path / "metrics.json"
+
+    for argv in [
+        ["dataset", "create", "--name", "dataset"],
+        ["dataset-file", "create", "--dataset-name", "dataset"]
+        + ["--dataset-file-name", "file"],
+        ["--metrics-file", str(metrics_path), "dataset-file", "upload"]
+        + ["--dataset-name", "dataset", "--dataset-file-name", "file"]
+        + ["--dataset-file-path", str(input_path), "--revalidate"],
+    ]:
+        monkeypatch.setattr(sys, "argv", ["aidentified_match", *argv])
+        aidentified_matching_api.main()
+
+    assert not registry.enabled
+    with open(metrics_path) as fd:
+        snapshot = json.load(fd)
+
+    # The token was fetched before metrics were on
+    assert set(snapshot["timers"]) == {
+        "validation",
+        "rewrite.read",
+        "rewrite.encode",
+        "upload.md5",
+        "upload.register_part",
+        "upload.put",
+        "upload.patch_etag",
+        "upload.complete",
+    }
+    assert snapshot["timers"]["upload.put"]["bytes"] == 53
+    assert snapshot["counters"] == {"rewrite.rows": 2, "upload.parts": 1}
+    assert snapshot["gauges"]["upload.queue_depth"]["samples"] == 1
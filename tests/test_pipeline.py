@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import json
+import sys
+
+import pytest
+
+import aidentified_matching_api
+import aidentified_matching_api.client as client
+import aidentified_matching_api.pipeline as pipeline
+from tests.test_fake_api import _set_status
+
+CSV = b"first_name,last_name,city\nfoo,bar,boston\n"
+
+
+def _write_manifest(tmp_path, manifest: dict) -> str:
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps({"poll_interval": 0.01, **manifest}))
+    return str(path)
+
+
+def _run(monkeypatch, manifest_path: str):
+    monkeypatch.setattr(
+        sys,
+        "argv",
+        ["aidentified_match", "pipeline", "run", "--manifest", manifest_path],
+    )
+    return aidentified_matching_api.main()
+
+
+def _dataset_file_names(api) -> list:
+    return sorted(
+        dataset_file["name"] for dataset_file in api.state.dataset_files.values()
+    )
+
+
+def test_run_and_rerun(api, tmp_path, monkeypatch, capsys):
+    for name in ["a.csv", "b.csv"]:
+        (tmp_path / name).write_bytes(CSV)
+    manifest_path = _write_manifest(
+        tmp_path,
+        {
+            "datasets": [
+                {
+                    "name": "first",
+                    "files": [
+                        {
+                            "name": "a",
+                            "path": "a.csv",
+                            "download": "a_matched.csv",
+                            "delta": "a_delta.csv",
+                        },
+                        {"name": "b", "path": "b.csv", "wait": False},
+                    ],
+                },
+                {"name": "second", "files": [{"name": "c", "path": "a.csv"}]},
+            ]
+        },
+    )
+
+    assert _run(monkeypatch, manifest_path) is None
+    summaries = json.loads(capsys.readouterr().out)
+    assert [summary["steps_done"] for summary in summaries] == [
+        ["create", "upload", "wait", "download", "delta"],
+        ["create", "upload"],
+        ["create", "upload", "wait"],
+    ]
+    assert (tmp_path / "a_matched.csv").read_bytes() == CSV.replace(b"\n", b"\r\n")
+    assert (tmp_path / "a_delta.csv").exists()
+    with open(f"{manifest_path}.checkpoint.json") as fd:
+        assert "first/a/download" in json.load(fd)["steps"]
+
+    # Everything was done, nothing is run again
+    def fail(*args, **kwargs):
+        raise AssertionError("Step run again")
+
+    monkeypatch.setattr(client.AsyncMatchingClient, "upload_dataset_file", fail)
+    monkeypatch.setattr(client.MatchingClient, "create_dataset_file", fail)
+    monkeypatch.setattr(client.MatchingClient, "download_dataset_file", fail)
+    assert _run(monkeypatch, manifest_path) is None
+    assert _dataset_file_names(api) == ["a", "b", "c"]
+
+
+def test_resume_after_failure(api, tmp_path, monkeypatch, capsys):
+    input_path = tmp_path / "a.csv"
+    input_path.write_bytes(b"nope,last_name\nfoo,bar\n")
+    manifest_path = _write_manifest(
+        tmp_path,
+        {
+            "datasets": [
+                {
+                    "name": "dataset",
+                    "files": [
+                        {"name": "a", "path": "a.csv", "download": "out.csv"},
+                        {"name": "b", "path": "b.csv"},
+                    ],
+                }
+            ]
+        },
+    )
+    (tmp_path / "b.csv").write_bytes(CSV)
+
+    assert _run(monkeypatch, manifest_path) == 1
+    summaries = json.loads(capsys.readouterr().out)
+    assert summaries[0]["steps_done"] == ["create"]
+    assert summaries[0]["error"].startswith("upload: ")
+    assert summaries[1]["error"] is None
+
+    input_path.write_bytes(CSV)
+    assert _run(monkeypatch, manifest_path) is None
+    summaries = json.loads(capsys.readouterr().out)
+    assert summaries[0]["steps_done"] == ["create", "upload", "wait", "download"]
+    assert (tmp_path / "out.csv").exists()
+    # The dataset-file created by the failed run was reused
+    assert _dataset_file_names(api) == ["a", "b"]
+
+
+def test_wait_without_path(api, matching_client, tmp_path, monkeypatch, capsys):
+    manifest = pipeline.load_manifest(_write_manifest(tmp_path, {"datasets": []}))
+    matching_client.create_dataset("dataset")
+    matching_client.create_dataset_file("dataset", "a")
+    watcher = pipeline.DatasetWatcher(
+        client.AsyncMatchingClient(client=matching_client), "dataset", manifest
+    )
+
+    async def wait():
+        waiting = asyncio.create_task(watcher.wait("a"))
+        await asyncio.sleep(0.1)
+        # Taken to be about to upload some other way
+        assert not waiting.done()
+        _set_status(api, "a", "MATCHING_FINISHED")
+        return await waiting
+
+    assert asyncio.run(wait())["status"] == "MATCHING_FINISHED"
+
+    manifest_path = _write_manifest(
+        tmp_path,
+        {
+            "upload_grace": 0.05,
+            "datasets": [{"name": "dataset", "files": [{"name": "b"}]}],
+        },
+    )
+    assert _run(monkeypatch, manifest_path) == 1
+    summaries = json.loads(capsys.readouterr().out)
+    assert summaries[0]["steps_done"] == ["create"]
+    assert summaries[0]["error"] == "wait: Dataset file is UPLOAD_NOT_STARTED"
+
+
+def test_yaml_manifest(tmp_path):
+    pytest.importorskip("yaml")
+    path = tmp_path / "manifest.yaml"
+    path.write_text(
+        "concurrent_files: 4\n"
+        "datasets:\n"
+        "  - name: dataset\n"
+        "    files:\n"
+        "      - name: a\n"
+        "        path: inputs/a.csv\n"
+        "        csv: {delimiter: ';'}\n"
+    )
+
+    manifest = pipeline.load_manifest(str(path))
+
+    assert manifest["concurrent_files"] == 4
+    spec = manifest["datasets"][0]["files"][0]
+    assert spec["path"] == str(tmp_path / "inputs" / "a.csv")
+    assert spec["csv"] == {"delimiter": ";"}
+    assert pipeline.file_steps(spec) == ["create", "upload", "wait"]
+
+
+@pytest.mark.parametrize(
+    "manifest,error",
+    [
+        ({"files": []}, "has no list of datasets"),
+        ({"datasets": [], "concurrency": 2}, "Unknown manifest settings: concurrency"),
+        ({"datasets": [{"name": "d", "files": [{}]}]}, "File 1 of d needs a name"),
+        (
+            {"datasets": [{"name": "d", "files": [{"name": "a", "wait": False}] * 2}]},
+            "d/a is listed twice",
+        ),
+        (
+            {
+                "datasets": [
+                    {"name": "d", "files": [{"name": "a", "wait": False, "delta": "x"}]}
+                ]
+            },
+            "a can't download without waiting",
+        ),
+        (
+            {
+                "datasets": [
+                    {"name": "d", "files": [{"name": "a", "csv": {"sep": ";"}}]}
+                ]
+            },
+            "Unknown csv settings for a: sep",
+        ),
+        (
+            {"datasets": [{"name": "d", "files": [{"name": "a", "csv": ";"}]}]},
+            "The csv settings of a aren't a mapping",
+        ),
+    ],
+)
+def test_bad_manifest(tmp_path, manifest, error):
+    path = tmp_path / "manifest.json"
+    path.write_text(json.dumps(manifest))
+
+    with pytest.raises(Exception, match=error):
+        pipeline.load_manifest(str(path))
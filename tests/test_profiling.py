@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import concurrent.futures
+import pstats
+import sys
+import tracemalloc
+
+import aidentified_matching_api
+import aidentified_matching_api.daemon as daemon
+import aidentified_matching_api.profiling as profiling
+
+
+def _in_thread():
+    return sum(range(1000))
+
+
+def _function_names(path) -> set:
+    return {name for _, _, name in pstats.Stats(str(path)).stats}
+
+
+def test_cpu_profile_covers_threads(tmp_path):
+    cpu_path = tmp_path / "cpu.prof"
+    with profiling.profile(cpu_path=str(cpu_path)):
+        with concurrent.futures.ThreadPoolExecutor(2) as executor:
+            assert executor.submit(_in_thread).result() == 499500
+
+    assert "_in_thread" in _function_names(cpu_path)
+    assert "cumulative" in (tmp_path / "cpu.prof.txt").read_text()
+    assert sys.getprofile() is None
+
+
+def test_memory_profile(tmp_path):
+    memory_path = tmp_path / "memory.txt"
+    with profiling.profile(memory_path=str(memory_path)):
+        blocks = [bytearray(1024) for _ in range(100)]
+
+    assert len(blocks) == 100
+    report = memory_path.read_text()
+    assert report.startswith("Peak traced memory:")
+    assert "test_profiling.py" in report
+    assert not tracemalloc.is_tracing()
+
+
+def test_profile_upload(api, tmp_path, monkeypatch):
+    input_path = tmp_path / "input.csv"
+    input_path.write_bytes(b"first_name,last_name,city\nfoo,bar,boston\nfoo,bar,\n")
+    cpu_path = tmp_path / "cpu.prof"
+    memory_path = tmp_path / "memory.txt"
+
+    for argv in [
+        ["dataset", "create", "--name", "dataset"],
+        ["dataset-file", "create", "--dataset-name", "dataset"]
+        + ["--dataset-file-name", "file"],
+        ["--profile-cpu", str(cpu_path), "--profile-memory", str(memory_path)]
+        + ["dataset-file", "upload"]
+        + ["--dataset-name", "dataset", "--dataset-file-name", "file"]
+        + ["--dataset-file-path", str(input_path), "--revalidate"],
+    ]:
+        monkeypatch.setattr(sys, "argv", ["aidentified_match", *argv])
+        aidentified_matching_api.main()
+
+    # Rows are encoded on an executor thread
+    assert {"upload_dataset_file", "_encode_rows"} <= _function_names(cpu_path)
+    assert memory_path.read_text().startswith("Peak traced memory:")
+
+
+def test_profiling_runs_locally():
+    args = aidentified_matching_api.parser.parse_args(
+        ["--profile-cpu", "cpu.prof", "dataset", "list"]
+    )
+    assert not daemon._can_forward(args)
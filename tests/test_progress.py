@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import io
+import json
+
+import pytest
+
+import aidentified_matching_api.progress as progress
+import aidentified_matching_api.validation as validation
+
+
+class Terminal(io.StringIO):
+    def isatty(self):
+        return True
+
+
+@pytest.fixture
+def reporter(monkeypatch):
+    reporter = progress.Progress()
+    monkeypatch.setattr(progress, "reporter", reporter)
+    return reporter
+
+
+def test_upload_download_lines(reporter, matching_client, tmp_path):
+    buffer = b"first_name,last_name,city\nfoo,bar,boston\nfoo,bar,\n"
+    input_path = tmp_path / "input.csv"
+    input_path.write_bytes(buffer)
+
+    stream = io.StringIO()
+    progress.enable(stream)
+    # Every update reports
+    reporter.interval = 0
+
+    matching_client.create_dataset("dataset")
+    matching_client.create_dataset_file("dataset", "file")
+    with open(input_path, "rb") as fd:
+        matching_client.upload_dataset_file(
+            "dataset",
+            "file",
+            fd,
+            validation_options=validation.ValidationOptions(use_cache=False),
+        )
+    matching_client.download_dataset_file("dataset", "file", io.BytesIO())
+
+    lines = [json.loads(line) for line in stream.getvalue().splitlines()]
+    final = {line["phase"]: line for line in lines if line["final"]}
+    assert [line["phase"] for line in lines if line["final"]] == [
+        "validating",
+        "uploading",
+        "downloading",
+    ]
+
+    assert final["validating"]["bytes"] == len(buffer)
+    assert final["uploading"]["bytes"] == final["uploading"]["total_bytes"]
+    assert final["uploading"]["rows"] == 2
+    assert final["uploading"]["parts_done"] == 1
+    assert final["uploading"]["parts_in_flight"] == 0
+    assert final["uploading"]["eta_seconds"] == 0
+    assert final["downloading"]["bytes"] == len(buffer) + 3
+    assert final["downloading"]["total_bytes"] == len(buffer) + 3
+
+
+def test_terminal(reporter):
+    stream = Terminal()
+    progress.enable(stream)
+    assert reporter.interval == progress.TTY_INTERVAL
+
+    progress.start("uploading", 4 * 1024 * 1024)
+    reporter.started_at -= 10
+    progress.advance(1024 * 1024)
+    progress.add_rows(12_345)
+    progress.part_started()
+    reporter.report()
+    progress.part_done(5)
+    progress.finish()
+
+    first, last = stream.getvalue().split("\r")[1:]
+    assert first == (
+        "uploading: 1.0 MB of 4.0 MB (25%), 102.4 KB/s, 12,345 rows,"
+        " 0 parts done 1 uploading, ETA 30s\x1b[K"
+    )
+    assert last.startswith("uploading: 1.0 MB of 4.0 MB (25%)")
+    assert last.endswith("1 parts done 0 uploading, ETA 30s\x1b[K\n")
+
+
+def test_disabled(reporter):
+    progress.start("uploading", 100)
+    progress.advance(10)
+    progress.finish()
+    assert reporter.nbytes == 0
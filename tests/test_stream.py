@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import codecs
+import gzip
+import io
+
+import pytest
+
+import aidentified_matching_api.stream as stream
+import aidentified_matching_api.upload as upload
+import aidentified_matching_api.validation as validation
+
+
+class Pipe(io.RawIOBase):
+    def __init__(self, data: bytes):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, buf):
+        return self.data.readinto(buf)
+
+
+CSV_DATA = (
+    codecs.BOM_UTF8
+    + b"first_name;last_name;city;id\n"
+    + b"".join(b"foo;bar;boston;%d\n" % idx for idx in range(5000))
+)
+
+
+def test_head_buffer():
+    fd = stream.HeadBuffer(Pipe(bytes(range(100))), head_size=20)
+    assert not fd.seekable()
+
+    assert fd.read(5) == bytes(range(5))
+    assert fd.seek(0) == 0
+    assert fd.read(3) == bytes(range(3))
+    assert fd.read(7) == bytes(range(3, 10))
+    assert fd.seek(3) == 3
+    assert fd.read(3) == bytes(range(3, 6))
+    assert fd.read(10) == bytes(range(6, 16))
+    assert fd.seek(15) == 15
+    assert fd.read(5) == bytes(range(15, 20))
+    assert fd.seek(0) == 0
+    assert fd.read() == bytes(range(100))
+
+    with pytest.raises(io.UnsupportedOperation):
+        fd.seek(0)
+
+
+@pytest.mark.parametrize("compress", [lambda data: data, gzip.compress])
+def test_upload_pipe(compress, tmp_path, monkeypatch):
+    monkeypatch.setattr(stream, "HEAD_BUFFER_SIZE", validation.SNIFF_SAMPLE_SIZE + 1024)
+    csv_args = validation.make_csv_args(io.BufferedReader(Pipe(compress(CSV_DATA))))
+    assert not csv_args.raw_fd.seekable()
+
+    csv_args = validation.detect_csv_args(csv_args)
+    assert csv_args.delimiter == ";"
+
+    rows = validation.validated_rows(csv_args, "OPPORTUNISTIC")
+    part_queue = asyncio.Queue()
+    asyncio.run(upload.rewrite_csv(csv_args, 5 * 1024 * 1024, part_queue, rows=rows))
+
+    expected = CSV_DATA[3:].replace(b";", b",").replace(b"\n", b"\r\n")
+    assert part_queue.get_nowait() == (0, expected)
+
+    # Validating again would need another pass
+    with pytest.raises(io.UnsupportedOperation):
+        validation.validate_csv(csv_args, "OPPORTUNISTIC")
+
+
+def test_upload_pipe_bad_row():
+    csv_args = validation.make_csv_args(
+        Pipe(b"first_name,last_name,city\nfoo,bar,boston\nfoo,,boston\n")
+    )
+    rows = validation.validated_rows(csv_args, "OPPORTUNISTIC")
+
+    assert next(rows) == ["first_name", "last_name", "city"]
+    assert next(rows) == ["foo", "bar", "boston"]
+    with pytest.raises(validation.ValidationError, match="Row 3 has invalid value"):
+        next(rows)
+
+
+def test_validated_rows_report(tmp_path):
+    report_path = tmp_path / "report.csv"
+    csv_args = validation.make_csv_args(
+        Pipe(b"first_name,last_name,city\nfoo,,boston\nfoo\nfoo,bar,boston\n")
+    )
+    rows = validation.validated_rows(
+        csv_args,
+        "OPPORTUNISTIC",
+        validation.ValidationOptions(report_path=str(report_path)),
+    )
+
+    # Rows with the wrong number of columns are left out.
+    assert next(rows) == ["first_name", "last_name", "city"]
+    assert next(rows) == ["foo", "", "boston"]
+    assert next(rows) == ["foo", "bar", "boston"]
+    with pytest.raises(validation.ValidationError, match="Validation found 2 errors"):
+        next(rows)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import json
+import sys
+
+import pytest
+
+import aidentified_matching_api
+import aidentified_matching_api.tracing as tracing
+
+
+@pytest.fixture
+def tracer():
+    yield tracing.tracer
+    tracing.disable()
+    tracing.tracer.reset()
+
+
+def _track_names(trace: dict) -> dict:
+    return {
+        event["tid"]: event["args"]["name"]
+        for event in trace["traceEvents"]
+        if event["name"] == "thread_name"
+    }
+
+
+def _spans(trace: dict) -> list:
+    return [event for event in trace["traceEvents"] if event["ph"] == "X"]
+
+
+def test_disabled(tracer):
+    assert tracing.wrap(len, "len") is len
+    with tracing.span("nothing"):
+        pass
+    tracing.record("nothing", tracing.now())
+    tracing.counter("nothing", 1)
+    assert _spans(tracer.to_dict()) == []
+
+
+def test_task_tracks(tracer):
+    tracing.enable()
+
+    async def task():
+        with tracing.span("outer", part=1):
+            with tracing.span("inner"):
+                await asyncio.sleep(0)
+
+    async def run():
+        await asyncio.gather(
+            asyncio.create_task(task(), name="first"),
+            asyncio.create_task(task(), name="second"),
+        )
+
+    asyncio.run(run())
+    trace = tracer.to_dict()
+
+    tracks = _track_names(trace)
+    assert sorted(tracks.values()) == ["first", "second"]
+    spans = _spans(trace)
+    assert len(spans) == 4
+    for tid in tracks:
+        inner, outer = [span for span in spans if span["tid"] == tid]
+        assert (inner["name"], outer["name"]) == ("inner", "outer")
+        assert outer["args"] == {"part": 1}
+        assert outer["ts"] <= inner["ts"]
+        assert inner["ts"] + inner["dur"] <= outer["ts"] + outer["dur"]
+
+
+def test_trace_file(api, tracer, tmp_path, monkeypatch):
+    input_path = tmp_path / "input.csv"
+    input_path.write_bytes(b"first_name,last_name,city\nfoo,bar,boston\nfoo,bar,\n")
+    trace_path = tmp_path / "trace.json"
+
+    for argv in [
+        ["dataset", "create", "--name", "dataset"],
+        ["dataset-file", "create", "--dataset-name", "dataset"]
+        + ["--dataset-file-name", "file"],
+        ["--trace-file", str(trace_path), "dataset-file", "upload"]
+        + ["--dataset-name", "dataset", "--dataset-file-name", "file"]
+        + ["--dataset-file-path", str(input_path), "--revalidate"],
+    ]:
+        monkeypatch.setattr(sys, "argv", ["aidentified_match", *argv])
+        aidentified_matching_api.main()
+
+    assert not tracer.enabled
+    with open(trace_path) as fd:
+        trace = json.load(fd)
+
+    tracks = _track_names(trace)
+    spans = {}
+    for span in _spans(trace):
+        spans.setdefault(tracks[span["tid"]], set()).add(span["name"])
+
+    assert spans["reader"] == {"read", "encode", "build", "queue put"}
+    assert spans["uploader 1"] >= {
+        "queue get",
+        "budget",
+        "part",
+        "hash",
+        "register",
+        "PUT",
+        "PATCH",
+    }
+    executor_spans = set().union(
+        *(names for track, names in spans.items() if track.startswith("asyncio"))
+    )
+    assert executor_spans == {"read", "encode", "hash", "register", "PUT", "PATCH"}
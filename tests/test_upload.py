@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+# Copyright 2022 Aidentified LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+import asyncio
+import codecs
+import io
+
+import pytest
+
+import aidentified_matching_api.upload as upload
+import aidentified_matching_api.validation as validation
+
+
+def _rewrite(csv_args, part_size_bytes=1024 * 1024):
+    part_queue = asyncio.Queue()
+    asyncio.run(upload.rewrite_csv(csv_args, part_size_bytes, part_queue))
+
+    parts = []
+    while not part_queue.empty():
+        parts.append(part_queue.get_nowait())
+    return parts
+
+
+def test_rewrite_csv():
+    fd = io.BytesIO("first_name;last_name\nJosé;bar\n".encode("latin-1"))
+    csv_args = validation.make_csv_args(fd, encoding="latin-1", delimiter=";")
+
+    assert _rewrite(csv_args) == [(0, "first_name,last_name\r\nJosé,bar\r\n".encode())]
+
+
+def test_rewrite_csv_parts():
+    fd = io.BytesIO(b"first_name,last_name\n" + b"foo,bar\n" * 100)
+    csv_args = validation.make_csv_args(fd)
+
+    parts = _rewrite(csv_args, part_size_bytes=100)
+
+    assert [part_idx for part_idx, _ in parts] == list(range(len(parts)))
+    assert all(len(data) == 100 for _, data in parts[:-1])
+    assert b"".join(data for _, data in parts) == (
+        b"first_name,last_name\r\n" + b"foo,bar\r\n" * 100
+    )
+
+
+def test_rewrite_csv_projection():
+    fd = io.BytesIO(b"customer_id,first_name,crm_notes,last_name\n1,foo,x,bar\n")
+    projection = validation.ColumnProjection({"customer_id": "id"}, drop_unknown=True)
+    csv_args = validation.make_csv_args(fd, projection=projection)
+
+    assert _rewrite(csv_args) == [(0, b"id,first_name,last_name\r\n1,foo,bar\r\n")]
+
+
+def test_rewrite_csv_projection_short_row():
+    fd = io.BytesIO(b"first_name,crm_notes,last_name\nfoo,x\n")
+    projection = validation.ColumnProjection(drop_columns=["crm_notes"])
+    csv_args = validation.make_csv_args(fd, projection=projection)
+
+    with pytest.raises(Exception) as exc:
+        _rewrite(csv_args)
+
+    assert str(exc.value) == "Row 2 has fewer columns than the header"
+
+
+def test_rewrite_csv_shards():
+    fd = io.BytesIO(
+        b"first_name,last_name\n" + b"".join(b"foo,%d\n" % i for i in range(5))
+    )
+    csv_args = validation.make_csv_args(fd)
+    shard_queues = []
+
+    async def next_part_queue():
+        shard_queues.append(asyncio.Queue())
+        return shard_queues[-1]
+
+    asyncio.run(
+        upload.rewrite_csv(
+            csv_args, 1024, None, shard_rows=2, next_part_queue=next_part_queue
+        )
+    )
+
+    assert [queue.get_nowait() for queue in shard_queues] == [
+        (0, b"first_name,last_name\r\nfoo,0\r\nfoo,1\r\n"),
+        (0, b"first_name,last_name\r\nfoo,2\r\nfoo,3\r\n"),
+        (0, b"first_name,last_name\r\nfoo,4\r\n"),
+    ]
+
+
+def test_upload_budget_bandwidth(monkeypatch):
+    sleeps = []
+
+    async def sleep(delay):
+        sleeps.append(delay)
+
+    async def upload_parts():
+        budget = upload.UploadBudget(2, bytes_per_second=1000)
+        monkeypatch.setattr(asyncio, "sleep", sleep)
+        for size in (500, 500, 2000):
+            async with budget.part(size):
+                pass
+
+    asyncio.run(upload_parts())
+
+    # The first second's worth goes straight through, the rest waits
+    assert len(sleeps) == 1
+    assert sleeps[0] == pytest.approx(2, abs=0.1)
+
+
+def test_upload_budget_memory():
+    held = []
+
+    async def hold_parts():
+        budget = upload.UploadBudget(2, max_buffered_bytes=100)
+
+        async def hold(name, size):
+            await budget.hold(size)
+            held.append(name)
+
+        await hold("first", 60)
+        # Bigger than the whole budget, but nothing else will be held
+        second = asyncio.create_task(hold("second", 150))
+        await asyncio.sleep(0)
+        assert held == ["first"]
+
+        budget.release(60)
+        await second
+        assert held == ["first", "second"]
+        budget.release(150)
+        assert budget.buffered_bytes == 0
+
+    asyncio.run(hold_parts())
+
+
+def test_rewrite_csv_strips_bom(tmp_path):
+    buffer = codecs.BOM_UTF8 + b"first_name,last_name\nfoo,bar\n"
+    path = tmp_path / "input.csv"
+    path.write_bytes(buffer)
+    expected = [(0, b"first_name,last_name\r\nfoo,bar\r\n")]
+
+    assert _rewrite(validation.make_csv_args(io.BytesIO(buffer))) == expected
+    with open(path, "rb") as fd:
+        assert _rewrite(validation.make_csv_args(fd)) == expected
@@ -15,13 +15,17 @@
 import codecs
 import csv
 import io
+import json
+import os
 
 import pytest
 
+import aidentified_matching_api.validation as validation
 from aidentified_matching_api.validation import AddressCsvValidator
 from aidentified_matching_api.validation import CsvArgs
 from aidentified_matching_api.validation import EmailCsvValidator
 from aidentified_matching_api.validation import OpportunisticCsvValidator
+from aidentified_matching_api.validation import ParallelCsvValidator
 from aidentified_matching_api.validation import ValidationError
 
 
@@ -160,3 +164,419 @@ def test_email_csv_header(buffer, exc_msg):
         validator.validate()
 
     assert str(exc.value) == exc_msg
+
+
+def _validation_error(validator):
+    try:
+        validator.validate()
+    except ValidationError as e:
+        return str(e)
+    return None
+
+
+PARALLEL_TEST_DATA = [
+    b"first_name,last_name,id,city\n"
+    + b"".join(b"foo,bar,%d,boston\n" % idx for idx in range(200)),
+    b"first_name,last_name,id,city\n"
+    + b"".join(b'foo,"bar\nbaz",%d,"bos,ton"\n' % idx for idx in range(200)),
+    b"first_name,last_name,id,city\n"
+    + b"".join(b"foo,bar,%d,boston\n" % idx for idx in range(200))
+    + b"foo,bar,7,boston\n",
+    b"first_name,last_name,id,city\n"
+    + b"".join(b"foo,bar,%d,boston\n" % idx for idx in range(200))
+    + b",bar,x,boston\n",
+    # Duplicate of an earlier chunk's id on a row that also fails another check
+    b"first_name,last_name,id,city\n"
+    + b"".join(b"foo,bar,%d,boston\n" % idx for idx in range(200))
+    + b",bar,7,boston\n",
+    b"first_name,last_name,id,city\n"
+    + b"".join(b"foo,bar,%d,boston\n" % idx for idx in range(200))
+    + b"foo,bar\n",
+    # Stray quote in an unquoted field throws off the boundary scan
+    b"first_name,last_name,id,city\n"
+    + b"".join(b'fo"o,"bar\nbaz",%d,boston\n' % idx for idx in range(200)),
+    b'first_name,last_name,id,city\n"foo,bar,1,boston\n'
+    + b"".join(b"foo,bar,%d,boston\n" % idx for idx in range(200)),
+    # Past the first chunk, reported at its offset in the file
+    b"first_name,last_name,id,city\n"
+    + b"".join(b"foo,bar,%d,boston\n" % idx for idx in range(200))
+    + b"foo,b\xffr,200,boston\n",
+    codecs.BOM_UTF8
+    + b"first_name,last_name,city\n"
+    + b"".join(b"foo,bar,boston\n" for idx in range(200)),
+]
+
+
+@pytest.mark.parametrize("buffer", PARALLEL_TEST_DATA)
+def test_parallel_matches_serial(buffer, tmp_path, monkeypatch):
+    monkeypatch.setattr(validation, "PARALLEL_BLOCK_SIZE", 64)
+    path = tmp_path / "input.csv"
+    path.write_bytes(buffer)
+
+    serial_validator = OpportunisticCsvValidator(
+        CsvArgs(io.BytesIO(buffer), *ORDINARY_CSV_ARGS)
+    )
+
+    with open(path, "rb") as fd:
+        csv_args = CsvArgs(fd, *ORDINARY_CSV_ARGS)
+        assert validation.can_validate_in_parallel(csv_args)
+        parallel_validator = ParallelCsvValidator(
+            csv_args, OpportunisticCsvValidator, 2
+        )
+
+        assert _validation_error(parallel_validator) == _validation_error(
+            serial_validator
+        )
+
+
+def test_parallel_size_limit(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_bytes(b"first_name,last_name,city" + b"\nx,y,z" * 500001)
+
+    with open(path, "rb") as fd:
+        validator = ParallelCsvValidator(
+            CsvArgs(fd, *ORDINARY_CSV_ARGS), OpportunisticCsvValidator, 2
+        )
+
+        with pytest.raises(ValidationError) as exc:
+            validator.validate()
+
+    assert str(exc.value) == "CSV has more than 500,000 data rows"
+
+
+def test_parallel_unsplittable_encoding(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_bytes("first_name,last_name,city\nfoo,bar,boston".encode("UTF-16"))
+
+    with open(path, "rb") as fd:
+        csv_args = CsvArgs(fd, codecs.lookup("UTF-16"), *ORDINARY_CSV_ARGS[1:])
+        assert not validation.can_validate_in_parallel(csv_args)
+
+
+@pytest.mark.parametrize("digest", [hash, validation.stable_id_digest])
+def test_compact_id_set(digest):
+    ids = validation.CompactIdSet(digest=digest, capacity=4)
+
+    for idx in range(10_000):
+        assert ids.add(f"customer-{idx}")
+
+    assert len(ids) == 10_000
+    assert not ids.add("customer-0")
+    assert not ids.add("customer-9999")
+    assert ids.add("customer-10000")
+
+
+def test_compact_id_set_add_all():
+    ids = validation.CompactIdSet(capacity=4)
+
+    assert ids.add_all(f"customer-{idx}" for idx in range(10_000))
+    assert len(ids) == 10_000
+    assert ids.add_all(["customer-10000"])
+    assert not ids.add_all(["customer-10001", "customer-5", "customer-10002"])
+    # Stopped at the duplicate
+    assert len(ids) == 10_002
+
+
+COLLECT_TEST_DATA = (
+    b"first_name,last_name,id,city\n"
+    + b"".join(b"foo,bar,%d,boston\n" % idx for idx in range(100))
+    + b"foo,bar\n"
+    + b",bar,3,boston\n"
+    + b"".join(b"foo,bar,%d,boston\n" % idx for idx in range(100, 200))
+    + b"foo,,150,boston\n"
+)
+
+COLLECT_TEST_ERRORS = [
+    ["102", "", "row_length", "Row 102 does not match header length"],
+    ["103", "id", "duplicate_id", "Row 103 has duplicate id '3'"],
+    ["103", "first_name", "required_value", "Row 103 has invalid value for first_name"],
+    ["204", "id", "duplicate_id", "Row 204 has duplicate id '150'"],
+    ["204", "last_name", "required_value", "Row 204 has invalid value for last_name"],
+]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_collect_errors(workers, tmp_path, monkeypatch):
+    monkeypatch.setattr(validation, "PARALLEL_BLOCK_SIZE", 64)
+    path = tmp_path / "input.csv"
+    path.write_bytes(COLLECT_TEST_DATA)
+    report_path = tmp_path / "report.csv"
+    options = validation.ValidationOptions(workers, str(report_path))
+
+    with open(path, "rb") as fd:
+        with pytest.raises(ValidationError) as exc:
+            validation.validate_csv(
+                CsvArgs(fd, *ORDINARY_CSV_ARGS), "OPPORTUNISTIC", options
+            )
+
+    assert str(exc.value).startswith("Validation found 5 errors, 5 written to")
+    with open(report_path, newline="") as fd:
+        rows = list(csv.reader(fd))
+    assert rows == [["row", "column", "error_type", "message"]] + COLLECT_TEST_ERRORS
+
+
+def test_collect_errors_limit(tmp_path):
+    report_path = tmp_path / "report.jsonl"
+    options = validation.ValidationOptions(report_path=str(report_path), max_errors=2)
+    fd = io.BytesIO(COLLECT_TEST_DATA)
+
+    with pytest.raises(ValidationError) as exc:
+        validation.validate_csv(
+            CsvArgs(fd, *ORDINARY_CSV_ARGS), "OPPORTUNISTIC", options
+        )
+
+    assert "duplicate_id: 2" in str(exc.value)
+    lines = report_path.read_text().splitlines()
+    assert len(lines) == 2
+    assert json.loads(lines[1]) == {
+        "row": 103,
+        "column": "id",
+        "error_type": "duplicate_id",
+        "message": "Row 103 has duplicate id '3'",
+    }
+
+
+def test_collect_errors_valid_file(tmp_path):
+    report_path = tmp_path / "report.csv"
+    options = validation.ValidationOptions(report_path=str(report_path))
+    fd = io.BytesIO(b"first_name,last_name,city\nfoo,bar,boston")
+
+    validation.validate_csv(CsvArgs(fd, *ORDINARY_CSV_ARGS), "OPPORTUNISTIC", options)
+
+    assert report_path.read_text().splitlines() == ["row,column,error_type,message"]
+
+
+VALUE_TEST_DATA = [
+    (b"first_name,last_name,email\nfoo,bar,foo@example.com", None),
+    (b"first_name,last_name,email\nfoo,bar,", None),
+    (
+        b"first_name,last_name,email_2\nfoo,bar,foo@example",
+        "Row 2 has malformed email_2 'foo@example'",
+    ),
+    (b"first_name,last_name,phone\nfoo,bar,(555) 867-5309", None),
+    (b"first_name,last_name,phone_1\nfoo,bar,+1 555.867.5309", None),
+    (
+        b"first_name,last_name,phone_1\nfoo,bar,867-5309",
+        "Row 2 has malformed phone_1 '867-5309'",
+    ),
+    (b"first_name,last_name,postal_code\nfoo,bar,02110-1234", None),
+    (
+        b"first_name,last_name,postal_code\nfoo,bar,2110",
+        "Row 2 has malformed postal_code '2110'",
+    ),
+    (b"first_name,last_name,state\nfoo,bar,ma", None),
+    (b"first_name,last_name,state\nfoo,bar,Massachusetts", None),
+    (
+        b"first_name,last_name,state\nfoo,bar,Mass.",
+        "Row 2 has malformed state 'Mass.'",
+    ),
+    (
+        b"first_name,last_name,state\nfoo,bar,{row}",
+        "Row 2 has malformed state '{row}'",
+    ),
+]
+
+
+@pytest.mark.parametrize("buffer, exc_msg", VALUE_TEST_DATA)
+def test_value_validation(buffer, exc_msg):
+    fd = io.BytesIO(buffer)
+    validator = OpportunisticCsvValidator(CsvArgs(fd, *ORDINARY_CSV_ARGS))
+    validator.check_values = True
+
+    assert _validation_error(validator) == exc_msg
+
+
+def test_value_validation_opt_in():
+    fd = io.BytesIO(b"first_name,last_name,postal_code\nfoo,bar,2110")
+    validator = OpportunisticCsvValidator(CsvArgs(fd, *ORDINARY_CSV_ARGS))
+
+    validator.validate()
+
+
+def test_validation_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(validation, "get_validation_cache_dir", lambda: str(tmp_path))
+    validate_calls = []
+    monkeypatch.setattr(
+        OpportunisticCsvValidator, "validate", lambda self: validate_calls.append(1)
+    )
+    path = tmp_path / "input.csv"
+    path.write_bytes(b"first_name,last_name,city\nfoo,bar,boston")
+
+    def run(**options):
+        with open(path, "rb") as fd:
+            validation.validate_csv(
+                CsvArgs(fd, *ORDINARY_CSV_ARGS),
+                "OPPORTUNISTIC",
+                validation.ValidationOptions(**options),
+            )
+
+    run()
+    run()
+    assert len(validate_calls) == 1
+
+    run(check_values=True)
+    run(use_cache=False)
+    assert len(validate_calls) == 3
+
+    # Same size and mtime, different content
+    stat = path.stat()
+    path.write_bytes(b"first_name,last_name,city\nfoo,bar,bostom")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    run()
+    assert len(validate_calls) == 4
+
+
+def test_file_fingerprint(tmp_path, monkeypatch):
+    monkeypatch.setattr(validation, "FINGERPRINT_BLOCK_SIZE", 4)
+    monkeypatch.setattr(validation, "FINGERPRINT_SAMPLES", 3)
+    path = tmp_path / "input.csv"
+    path.write_bytes(b"0123456789abcdef")
+
+    with open(path, "rb") as fd:
+        fingerprint = validation.file_fingerprint(fd)
+        assert fd.tell() == 0
+
+    # Only the first, middle and last blocks are sampled
+    stat = path.stat()
+    path.write_bytes(b"0123x56789abcdef")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    with open(path, "rb") as fd:
+        assert validation.file_fingerprint(fd) == fingerprint
+
+    path.write_bytes(b"0123456789abcdeF")
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    with open(path, "rb") as fd:
+        assert validation.file_fingerprint(fd) != fingerprint
+
+    assert validation.file_fingerprint(io.BytesIO(b"first_name")) is None
+
+
+DETECT_TEST_DATA = [
+    (b"first_name,last_name,city\nfoo,bar,boston\n", "utf-8", ",", '"'),
+    (b"first_name;last_name;city\nfoo;bar;boston\n", "utf-8", ";", '"'),
+    (b"first_name\tlast_name\tcity\nfoo\tbar\tboston\n", "utf-8", "\t", '"'),
+    (b"first_name|last_name|city\n'fo|o'|bar|boston\n", "utf-8", "|", "'"),
+    (
+        codecs.BOM_UTF8 + b"first_name,last_name,city\nfoo,bar,boston\n",
+        "utf-8",
+        ",",
+        '"',
+    ),
+    (
+        "first_name,last_name,city\nfoo,bar,boston\n".encode("UTF-16"),
+        "utf-16",
+        ",",
+        '"',
+    ),
+    (
+        "first_name,last_name,city\nJosé,Muñoz,São Paulo\n".encode("cp1252"),
+        "cp1252",
+        ",",
+        '"',
+    ),
+    (b"street_address_1\n123 fake st\n", "utf-8", ",", '"'),
+]
+
+
+@pytest.mark.parametrize("buffer, encoding, delimiter, quotechar", DETECT_TEST_DATA)
+def test_detect_csv_args(buffer, encoding, delimiter, quotechar):
+    fd = io.BytesIO(buffer)
+    csv_args = validation.detect_csv_args(CsvArgs(fd, *ORDINARY_CSV_ARGS))
+
+    assert csv_args.codec_info.name == encoding
+    assert csv_args.delimiter == delimiter
+    assert csv_args.quotechar == quotechar
+    assert fd.tell() == 0
+
+    validator = OpportunisticCsvValidator(csv_args)
+    assert validator.csv_reader.__next__()[0] in ("first_name", "street_address_1")
+
+
+PROJECTION_TEST_DATA = [
+    (
+        b"first_name,last_name,customer_id,crm_notes,city\nfoo,bar,1,x,boston\nfoo,bar,1,y,boston",
+        validation.ColumnProjection({"customer_id": "id"}, ["crm_notes"]),
+        "Row 3 has duplicate id '1'",
+    ),
+    (
+        b"first_name,surname,crm_notes,city\nfoo,,x,boston",
+        validation.ColumnProjection({"surname": "last_name"}, drop_unknown=True),
+        "Row 2 has invalid value for last_name",
+    ),
+    (
+        b"first_name,last_name,crm_notes,city\nfoo,bar,x,boston",
+        validation.ColumnProjection(drop_columns=["city"]),
+        "Invalid header 'crm_notes'",
+    ),
+    (
+        b"first_name,last_name,crm_notes,city\nfoo,bar,x",
+        validation.ColumnProjection(drop_columns=["crm_notes"]),
+        "Row 2 does not match header length",
+    ),
+    (
+        b"first_name,last_name,crm_notes,city\nfoo,bar,x,boston",
+        validation.ColumnProjection(drop_unknown=True),
+        None,
+    ),
+]
+
+
+@pytest.mark.parametrize("buffer, projection, exc_msg", PROJECTION_TEST_DATA)
+def test_projection(buffer, projection, exc_msg):
+    fd = io.BytesIO(buffer)
+    csv_args = CsvArgs(fd, *ORDINARY_CSV_ARGS, projection)
+    validator = OpportunisticCsvValidator(csv_args)
+
+    assert _validation_error(validator) == exc_msg
+
+
+def test_parse_header_map():
+    assert validation.parse_header_map(["a=b", "c=d=e"]) == {"a": "b", "c": "d=e"}
+
+    with pytest.raises(ValidationError):
+        validation.parse_header_map(["a"])
+
+
+MMAP_TEST_DATA = [
+    b"first_name,last_name,city\r\n" + b"foo,bar,boston\r\n" * 50,
+    b"first_name,last_name,city\r" + b"foo,bar,boston\r" * 50,
+    b'first_name,last_name,city\n"fo\r\no",bar,"bos\nton"\n' * 20,
+    codecs.BOM_UTF8 + "first_name,last_name,city\nJosé,Muñoz,São Paulo\n".encode() * 20,
+    b"first_name,last_name,city\nfoo,bar,boston",
+]
+
+
+@pytest.mark.parametrize("buffer", MMAP_TEST_DATA)
+def test_mmap_lines(buffer, tmp_path, monkeypatch):
+    # Blocks split line breaks and characters
+    monkeypatch.setattr(validation, "READ_BLOCK_SIZE", 7)
+    path = tmp_path / "input.csv"
+    path.write_bytes(buffer)
+
+    with open(path, "rb") as fd:
+        csv_args = CsvArgs(fd, *ORDINARY_CSV_ARGS)
+        mmap_rows = list(
+            validation.make_csv_reader(csv_args, validation.open_text(csv_args))
+        )
+
+    csv_args = CsvArgs(io.BytesIO(buffer), *ORDINARY_CSV_ARGS)
+    stream_rows = list(
+        validation.make_csv_reader(csv_args, validation.open_text(csv_args))
+    )
+
+    assert mmap_rows == stream_rows
+    assert mmap_rows[0] == ["first_name", "last_name", "city"]
+
+
+def test_mmap_encoding_error(tmp_path, monkeypatch):
+    monkeypatch.setattr(validation, "READ_BLOCK_SIZE", 8)
+    path = tmp_path / "input.csv"
+    path.write_bytes(b"first_name,last_name,city\nfoo,bar,bost\xffn\n")
+
+    with open(path, "rb") as fd:
+        validator = OpportunisticCsvValidator(CsvArgs(fd, *ORDINARY_CSV_ARGS))
+
+        with pytest.raises(ValidationError) as exc:
+            validator.validate()
+
+    assert str(exc.value) == "Bad character encoding at byte 38"